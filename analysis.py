@@ -0,0 +1,285 @@
+import asyncio
+import os
+
+from utils import (
+    get_video_info_async,
+    get_transcript_async,
+    process_transcript_with_fact_check
+)
+from incremental import analyze_incrementally
+from database import save_analysis, get_analysis
+from cache import AsyncSingleFlight
+from transcript_providers import TranscriptNotFoundError
+from metrics import timed, record_cache
+
+# How long (in seconds) a stored analysis is served before it is recomputed.
+# Set to 0 to always recompute.
+ANALYSIS_CACHE_TTL = int(os.getenv('ANALYSIS_CACHE_TTL', 24 * 60 * 60))
+
+# Upper bound on analyses run at once by batch requests, shared by all of them
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 8))
+BATCH_MAX_VIDEOS = int(os.getenv('BATCH_MAX_VIDEOS', 500))
+
+batch_semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+analysis_async_flight = AsyncSingleFlight()
+
+# Parts of an analysis, in the order they are streamed for a stored analysis
+ANALYSIS_EVENTS = ['video_info', 'transcript', 'summary', 'key_points', 'fact_check']
+
+
+class AnalysisError(Exception):
+    """An analysis failure that maps to an HTTP error response.
+    
+    permanent failures, such as a video without a transcript, won't go away
+    if the analysis is retried.
+    """
+    
+    def __init__(self, message, status_code=500, permanent=False):
+        super().__init__(message)
+        self.status_code = status_code
+        self.permanent = permanent
+
+
+class AnalysisBroadcast:
+    """The events of one running analysis, sent to every caller sharing it.
+    
+    A listener added while the analysis runs first gets the events sent
+    before it joined.
+    """
+    
+    def __init__(self):
+        self.sent = []
+        self.listeners = []
+        self.finished = False
+    
+    def send(self, name, data):
+        self.sent.append((name, data))
+        for listener in self.listeners:
+            listener(name, data)
+    
+    def listen(self, listener):
+        for name, data in self.sent:
+            listener(name, data)
+        self.listeners.append(listener)
+
+
+# Broadcasts of the analyses running now, by (video_id, force_refresh)
+analysis_broadcasts = {}
+
+
+async def run_shared_analysis(video_id, video_url, force_refresh=False, on_event=None):
+    """run_analysis, shared with every concurrent call for the same video.
+    
+    One analysis runs per video (and force_refresh) at a time, whether it was
+    asked for by /api/analyze, a stream or a batch. Each caller's on_event
+    gets every event of the shared analysis.
+    """
+    key = (video_id, force_refresh)
+    heard = []
+    
+    def listen(broadcast):
+        if on_event and broadcast not in heard:
+            broadcast.listen(on_event)
+            heard.append(broadcast)
+    
+    async def analyze():
+        broadcast = AnalysisBroadcast()
+        analysis_broadcasts[key] = broadcast
+        listen(broadcast)
+        try:
+            result = await run_analysis(video_id, video_url, force_refresh, on_event=broadcast.send)
+            broadcast.finished = True
+            return result
+        finally:
+            if analysis_broadcasts.get(key) is broadcast:
+                del analysis_broadcasts[key]
+    
+    running = analysis_broadcasts.get(key)
+    if running:
+        listen(running)
+    result = await analysis_async_flight.do(key, analyze)
+    
+    # If the run this caller joined was cancelled and another one finished
+    # instead, send the parts of the result it may have missed
+    if on_event and not any(broadcast.finished for broadcast in heard):
+        for name in ANALYSIS_EVENTS:
+            on_event(name, result[name])
+    return result
+
+
+async def run_analysis(video_id, video_url, force_refresh=False, on_event=None):
+    """Run (or load) the full analysis for a video and return the response payload.
+    
+    Runs on the pipeline event loop, so the oEmbed lookup, transcript fetch
+    and all LLM tasks are in flight at once without holding worker threads.
+    If on_event is given, it is called as on_event(name, data) with each part
+    of the payload as soon as that part is ready.
+    """
+    def emit(name, data):
+        if on_event:
+            on_event(name, data)
+    
+    # Serve a recent stored analysis if we have one
+    if not force_refresh and ANALYSIS_CACHE_TTL > 0:
+        result = await load_stored_analysis(video_id, max_age=ANALYSIS_CACHE_TTL)
+        record_cache('analysis', result is not None)
+        if result:
+            print(f"Serving stored analysis from {result['analyzed_at']}")
+            for name in ANALYSIS_EVENTS:
+                emit(name, result[name])
+            return result
+    
+    try:
+        with timed('analysis'):
+            return await compute_analysis(video_id, video_url, emit, force_refresh)
+    except AnalysisError:
+        if force_refresh:
+            raise
+        # An upstream is failing; an outdated analysis is better than an error
+        result = await load_stored_analysis(video_id)
+        if not result:
+            raise
+        print(f"Analysis failed, serving outdated stored analysis from {result['analyzed_at']}")
+        result['stale'] = True
+        for name in ANALYSIS_EVENTS:
+            emit(name, result[name])
+        return result
+
+
+async def load_stored_analysis(video_id, max_age=None):
+    """Load a complete stored analysis as a response payload, or None."""
+    try:
+        with timed('db_read'):
+            stored = await asyncio.to_thread(get_analysis, video_id, max_age=max_age)
+    except Exception as e:
+        print(f"Error reading stored analysis: {str(e)}")
+        return None
+    
+    if not (stored and stored['transcript'] and stored['summary'] and stored['key_points']):
+        return None
+    # Transcripts are stored bare; the fact-check annotations are rebuilt from the claims
+    fact_check = stored['fact_check'] or {'results': []}
+    return {
+        'video_info': stored['video_info'],
+        'transcript': process_transcript_with_fact_check(stored['transcript'], fact_check),
+        'summary': stored['summary'],
+        'key_points': stored['key_points'],
+        'fact_check': fact_check,
+        'cached': True,
+        'analyzed_at': stored['timestamp']
+    }
+
+
+async def compute_analysis(video_id, video_url, emit, force_refresh=False):
+    """Fetch the transcript, run every LLM task on it and store the result.
+    
+    With force_refresh the cached transcript, LLM responses and stored task
+    results are all ignored, so everything is recomputed.
+    """
+    async def fetch_video_info():
+        try:
+            with timed('video_info'):
+                video_info = await get_video_info_async(video_url)
+            print(f"Video info retrieved: {video_info}")
+        except Exception as e:
+            print(f"Error getting video info: {str(e)}")
+            video_info = None
+        emit('video_info', video_info)
+        return video_info
+    
+    async def run_task(name, task):
+        with timed(f'llm_{task}'):
+            result = await analyze_incrementally(video_id, transcript, task, force_refresh)
+        if name == 'fact_check':
+            result = result or {'results': []}
+        emit(name, result)
+        if name == 'fact_check':
+            # Re-send the transcript now that it can carry fact-check annotations
+            emit('transcript', process_transcript_with_fact_check(transcript, result))
+        return result
+    
+    # Get video information and transcript concurrently
+    video_info_task = asyncio.create_task(fetch_video_info())
+    
+    try:
+        with timed('transcript'):
+            transcript = await get_transcript_async(video_id, force_refresh=force_refresh)
+        print(f"Transcript retrieved ({len(transcript)} segments)")
+    except Exception as e:
+        print(f"Error getting transcript: {str(e)}")
+        video_info_task.cancel()
+        raise AnalysisError(
+            f'Error fetching transcript: {str(e)}', permanent=isinstance(e, TranscriptNotFoundError)
+        )
+    
+    emit('transcript', transcript)
+        
+    # Start all LLM analysis tasks concurrently
+    try:
+        fact_check, summary, key_points = await asyncio.gather(
+            run_task('fact_check', 'fact_check'),
+            run_task('summary', 'summarize'),
+            run_task('key_points', 'key_points')
+        )
+        
+        print("Analysis complete")
+    except Exception as e:
+        print(f"Error in LLM analysis: {str(e)}")
+        raise AnalysisError(f'Error analyzing content: {str(e)}')
+        
+    video_info = await video_info_task
+        
+    if not summary or not key_points:
+        raise AnalysisError('Failed to generate analysis. Please try again.')
+    
+    # Process transcript with fact-checking annotations
+    with timed('annotate'):
+        annotated_transcript = process_transcript_with_fact_check(transcript, fact_check)
+    
+    # Save analysis results to database
+    try:
+        with timed('db_write'):
+            await asyncio.to_thread(
+                save_analysis,
+                video_id=video_id,
+                video_url=video_url,
+                video_info=video_info,
+                summary=summary,
+                key_points=key_points,
+                fact_check=fact_check,
+                transcript=transcript
+            )
+    except Exception as e:
+        print(f"Error saving analysis: {str(e)}")
+    
+    return {
+        'video_info': video_info,
+        'transcript': annotated_transcript,
+        'summary': summary,
+        'key_points': key_points,
+        'fact_check': fact_check,
+        'cached': False
+    }
+
+
+async def run_batch_analysis(videos, force_refresh=False, on_result=None):
+    """Analyze many videos with bounded concurrency.
+    
+    videos is a list of (video_id, video_url) pairs. Returns one result dict
+    per video, in the same order, with either the analysis or the error. If
+    on_result is given, it is called with each result as soon as it is ready.
+    """
+    async def analyze_one(video_id, video_url):
+        async with batch_semaphore:
+            try:
+                result = await run_shared_analysis(video_id, video_url, force_refresh)
+                item = {'video_id': video_id, 'video_url': video_url, 'status': 'ok', 'result': result}
+            except Exception as e:
+                print(f"Error analyzing {video_id} in batch: {str(e)}")
+                item = {'video_id': video_id, 'video_url': video_url, 'status': 'error', 'error': str(e)}
+        
+        if on_result:
+            on_result(item)
+        return item
+    
+    return await asyncio.gather(*(analyze_one(video_id, video_url) for video_id, video_url in videos))
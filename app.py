@@ -1,36 +1,140 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context, g
+from flask.json.provider import DefaultJSONProvider
 from youtube_transcript_api import YouTubeTranscriptApi
 from youtube_transcript_api.formatters import TextFormatter
 import os
 from dotenv import load_dotenv
+
+# Load environment variables before local modules read their settings
+load_dotenv()
+
 from utils import (
     extract_video_id, 
-    get_video_info, 
-    get_transcript, 
-    analyze_with_llm,
-    process_transcript_with_fact_check
+    get_transcript_async, 
+    get_transcript_record_async,
+    invalidate_transcript,
+    analyze_with_llm_async,
+    transcript_cache,
+    llm_cache,
+    llm_async_flight,
+    video_info_async_flight,
+    transcript_flight
 )
 import traceback
 import json
-import asyncio
-import concurrent.futures
-from functools import partial
-from database import init_db, save_analysis, get_analysis
-
-# Load environment variables
-load_dotenv()
+import queue
+import time
+from database import (
+    init_db,
+    delete_analysis,
+    get_job,
+    find_fact_check_claims,
+    count_jobs_by_status,
+    claim_store_stats
+)
+from cache import SingleFlight
+from pipeline import submit, run_sync, pending_tasks, blocking_queue_depth
+from analysis import AnalysisError, analysis_async_flight, run_shared_analysis, run_batch_analysis, BATCH_MAX_VIDEOS
+from qa_sessions import QASessionError, sessions, start_session, ask_in_session
+from retrieval import get_question_context, index_cache
+from jobs import submit_job, retry_failed_job, start_job_workers, job_stats
+from rate_limiter import gemini_limiter
+from circuit_breaker import circuit_breakers
+from transcript_columns import Transcript, json_default
+from metrics import (
+    SERVER_TIMING_ENABLED,
+    RequestTimings,
+    current_timings,
+    registry,
+    gauge,
+    http_requests,
+    http_request_seconds
+)
 
 # Initialize database
 init_db()
 
-# Create a ThreadPoolExecutor for running async tasks
-executor = concurrent.futures.ThreadPoolExecutor(max_workers=3)
+# Concurrent /api/analyze requests for the same video share one computation
+analysis_flight = SingleFlight()
+
+flights = {
+    'analysis': analysis_flight,
+    'analysis_async': analysis_async_flight,
+    'transcript': transcript_flight,
+    'video_info_async': video_info_async_flight,
+    'llm_async': llm_async_flight
+}
+
+CIRCUIT_STATE_VALUES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+# Gauges are read when /metrics is scraped
+gauge('pipeline_tasks', 'Tasks scheduled on the pipeline event loop', pending_tasks)
+gauge('blocking_queue_depth', 'Blocking calls waiting for a pipeline thread', blocking_queue_depth)
+gauge('in_flight', 'Distinct computations running, shared by concurrent callers',
+      lambda: {name: flight.stats()['in_flight'] for name, flight in flights.items()}, labelname='flight')
+gauge('jobs', 'Background analysis jobs by status', count_jobs_by_status, labelname='status')
+gauge('cache_entries', 'Entries held by each in-process cache',
+      lambda: {'transcripts': len(transcript_cache), 'passage_indexes': len(index_cache)}, labelname='cache')
+gauge('qa_sessions', 'Open Q&A sessions', lambda: len(sessions))
+gauge('gemini_rate_scale', 'Fraction of the configured Gemini rate currently used',
+      lambda: gemini_limiter.stats()['scale'])
+gauge('circuit_state', 'Circuit breaker state: 0 closed, 1 half-open, 2 open',
+      lambda: {breaker.name: CIRCUIT_STATE_VALUES[breaker.state] for breaker in circuit_breakers.values()},
+      labelname='upstream')
+
+
+class TranscriptJSONProvider(DefaultJSONProvider):
+    """JSON provider that serializes transcripts only when a response is sent."""
+    
+    @staticmethod
+    def default(o):
+        if isinstance(o, Transcript):
+            return o.to_list()
+        return DefaultJSONProvider.default(o)
+
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
+app.json = TranscriptJSONProvider(app)
+
+
+@app.before_request
+def start_background_workers():
+    """Start the job workers with the first request the process serves.
+    
+    Importing the app doesn't start them, and with the debug reloader only
+    the child process that serves requests runs them.
+    """
+    start_job_workers()
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if SERVER_TIMING_ENABLED:
+        g.timings_token = current_timings.set(RequestTimings())
+
+
+@app.after_request
+def record_request_metrics(response):
+    """Count the request and, if enabled, report its stage timings in a Server-Timing header."""
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    elapsed = time.perf_counter() - g.get('request_started', time.perf_counter())
+    http_requests.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    http_request_seconds.observe(elapsed, endpoint=endpoint)
+    
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add('total', elapsed)
+        response.headers['Server-Timing'] = timings.header()
+    return response
+
+
+@app.teardown_request
+def clear_request_timings(error=None):
+    token = g.pop('timings_token', None)
+    if token is not None:
+        current_timings.reset(token)
 
-def run_async(func, *args, **kwargs):
-    """Run a function asynchronously using the thread pool."""
-    return executor.submit(func, *args, **kwargs)
 
 # Error handlers
 @app.errorhandler(404)
@@ -44,6 +148,24 @@ def handle_error(error):
     print(traceback.format_exc())
     return jsonify({'error': str(error)}), 500
 
+def parse_flag(options, name, default=False):
+    """Read a true/false request option from JSON or a query string.
+    
+    Accepts JSON booleans, 0 and 1, and the strings "true"/"false",
+    "yes"/"no", "1"/"0" and "" in any case. Raises ValueError for anything
+    else, rather than treating a string like "false" as true.
+    """
+    value = options.get(name, default)
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.lower() in ('1', 'true', 'yes'):
+        return True
+    if isinstance(value, str) and value.lower() in ('', '0', 'false', 'no'):
+        return False
+    raise ValueError(f'{name} must be true or false')
+
 # Main routes
 @app.route('/')
 def index():
@@ -54,6 +176,10 @@ def analyze_video():
     try:
         data = request.get_json()
         video_url = data.get('video_url')
+        try:
+            force_refresh = parse_flag(data, 'force_refresh')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         if not video_url:
             return jsonify({'error': 'No video URL provided'}), 400
@@ -67,72 +193,288 @@ def analyze_video():
             
         print(f"Video ID: {video_id}")
         
-        # Get video information and transcript concurrently
-        video_info_future = run_async(get_video_info, video_url)
-        transcript_future = run_async(get_transcript, video_id)
-        
+        # Concurrent requests for the same video wait on one running analysis
         try:
-            video_info = video_info_future.result()
-            print(f"Video info retrieved: {video_info}")
-        except Exception as e:
-            print(f"Error getting video info: {str(e)}")
-            video_info = None
+            result = analysis_flight.do(
+                (video_id, force_refresh),
+                lambda: run_sync(run_shared_analysis(video_id, video_url, force_refresh))
+            )
+        except AnalysisError as e:
+            return jsonify({'error': str(e)}), e.status_code
+        
+        return jsonify(result)
+        
+    except Exception as e:
+        print(f"Error in analyze_video: {str(e)}")
+        print("Traceback:")
+        print(traceback.format_exc())
+        return jsonify({'error': str(e)}), 500
+
+
+
+def format_sse(event, data):
+    """Format one Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data, default=json_default)}\n\n"
+
+
+@app.route('/api/analyze/stream', methods=['GET'])
+def analyze_video_stream():
+    """Analyze a video, streaming each part of the result as a Server-Sent Event."""
+    video_url = request.args.get('video_url')
+    try:
+        force_refresh = parse_flag(request.args, 'force_refresh')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if not video_url:
+        return jsonify({'error': 'No video URL provided'}), 400
+        
+    print(f"\nStreaming analysis for video: {video_url}")
+    
+    video_id = extract_video_id(video_url)
+    if not video_id:
+        return jsonify({'error': 'Invalid YouTube URL'}), 400
+    
+    # Events are produced on the pipeline loop and consumed by this request's thread.
+    # Streams of the same video share one analysis with each other and /api/analyze.
+    events = queue.Queue()
+    future = submit(run_shared_analysis(video_id, video_url, force_refresh, on_event=lambda name, data: events.put((name, data))))
+    future.add_done_callback(lambda _: events.put(None))
+    
+    def generate():
+        while True:
+            item = events.get()
+            if item is None:
+                break
+            yield format_sse(*item)
+        
+        error = future.exception()
+        if error:
+            print(f"Error in analyze_video_stream: {str(error)}")
+            yield format_sse('error', {'error': str(error)})
+        else:
+            result = future.result()
+            yield format_sse('done', {'cached': result['cached']})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.route('/api/analyze/batch', methods=['POST'])
+def analyze_video_batch():
+    """Analyze a list of videos, returning per-video results or errors.
+    
+    With "stream": true the results are streamed as NDJSON, one line per
+    video as soon as it finishes.
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({"error": "No data provided"}), 400
             
+        video_urls = data.get('video_urls')
         try:
-            transcript = transcript_future.result()
-            print(f"Transcript retrieved ({len(transcript)} segments)")
-        except Exception as e:
-            print(f"Error getting transcript: {str(e)}")
-            return jsonify({'error': f'Error fetching transcript: {str(e)}'}), 500
-            
-        # Start all LLM analysis tasks concurrently
-        transcript_json = json.dumps(transcript)
-        fact_check_future = run_async(analyze_with_llm, transcript_json, 'fact_check')
-        summary_future = run_async(analyze_with_llm, transcript, 'summarize')
-        key_points_future = run_async(analyze_with_llm, transcript, 'key_points')
+            force_refresh = parse_flag(data, 'force_refresh')
+            stream = parse_flag(data, 'stream')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        try:
-            # Get results from all futures
-            fact_check = fact_check_future.result() or {'results': []}
-            summary = summary_future.result()
-            key_points = key_points_future.result()
+        if not video_urls or not isinstance(video_urls, list):
+            return jsonify({'error': 'video_urls must be a non-empty list'}), 400
+        
+        # Extract IDs and drop duplicates, keeping the first URL seen for each video
+        videos = {}
+        invalid = []
+        for video_url in video_urls:
+            video_id = extract_video_id(video_url) if isinstance(video_url, str) else None
+            if not video_id:
+                invalid.append({'video_url': video_url, 'status': 'error', 'error': 'Invalid YouTube URL'})
+            elif video_id not in videos:
+                videos[video_id] = video_url
+        
+        if len(videos) > BATCH_MAX_VIDEOS:
+            return jsonify({'error': f'Too many videos in batch (max {BATCH_MAX_VIDEOS})'}), 400
+        
+        print(f"\nBatch analysis of {len(videos)} videos ({len(invalid)} invalid URLs)")
+        
+        if not stream:
+            results = run_sync(run_batch_analysis(list(videos.items()), force_refresh))
+            return jsonify({'results': invalid + results})
+        
+        # Results are produced on the pipeline loop and consumed by this request's thread
+        results_queue = queue.Queue()
+        future = submit(run_batch_analysis(list(videos.items()), force_refresh, on_result=results_queue.put))
+        future.add_done_callback(lambda _: results_queue.put(None))
+        
+        def generate():
+            for item in invalid:
+                yield json.dumps(item, default=json_default) + '\n'
+            while True:
+                item = results_queue.get()
+                if item is None:
+                    break
+                yield json.dumps(item, default=json_default) + '\n'
+        
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        
+    except Exception as e:
+        print(f"Error in analyze_video_batch: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/jobs', methods=['POST'])
+def create_analysis_job():
+    """Queue a video analysis and return a job ID to poll."""
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({"error": "No data provided"}), 400
             
-            if not summary or not key_points:
-                return jsonify({'error': 'Failed to generate analysis. Please try again.'}), 500
-                
-            print("Analysis complete")
+        video_url = data.get('video_url')
+        try:
+            force_refresh = parse_flag(data, 'force_refresh')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if not video_url:
+            return jsonify({'error': 'No video URL provided'}), 400
             
-            # Save analysis results to database
-            save_analysis(
-                video_id=video_id,
-                video_url=video_url,
-                video_info=video_info,
-                summary=summary,
-                key_points=key_points,
-                fact_check=fact_check
-            )
-        except Exception as e:
-            print(f"Error in LLM analysis: {str(e)}")
-            return jsonify({'error': f'Error analyzing content: {str(e)}'}), 500
+        video_id = extract_video_id(video_url)
+        if not video_id:
+            return jsonify({'error': 'Invalid YouTube URL'}), 400
+        
+        job_id = submit_job(video_id, video_url, force_refresh)
+        
+        return jsonify({
+            'job_id': job_id,
+            'video_id': video_id,
+            'status': 'queued',
+            'status_url': f'/api/jobs/{job_id}'
+        }), 202
         
-        # Process transcript with fact-checking annotations
-        annotated_transcript = process_transcript_with_fact_check(transcript, fact_check)
+    except Exception as e:
+        print(f"Error in create_analysis_job: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_analysis_job(job_id):
+    """Get a job's status, and its result once it has succeeded."""
+    try:
+        job = get_job(job_id)
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
         
+        response = {
+            'job_id': job['id'],
+            'video_id': job['video_id'],
+            'video_url': job['video_url'],
+            'status': job['status'],
+            'attempts': job['attempts'],
+            'max_attempts': job['max_attempts'],
+            'error': job['error'],
+            'created_at': job['created_at'],
+            'started_at': job['started_at'],
+            'finished_at': job['finished_at']
+        }
+        if job['status'] == 'succeeded':
+            response['result'] = job['result']
+        
+        return jsonify(response)
+        
+    except Exception as e:
+        print(f"Error in get_analysis_job: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/jobs/<job_id>/retry', methods=['POST'])
+def retry_analysis_job(job_id):
+    """Requeue a failed job."""
+    try:
+        job = get_job(job_id)
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+        
+        if not retry_failed_job(job_id):
+            return jsonify({'error': f"Only failed jobs can be retried (job is {job['status']})"}), 409
+        
+        return jsonify({'job_id': job_id, 'status': 'queued', 'status_url': f'/api/jobs/{job_id}'}), 202
+        
+    except Exception as e:
+        print(f"Error in retry_analysis_job: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/analysis/<video_id>', methods=['DELETE'])
+def invalidate_analysis(video_id):
+    """Drop stored analyses, task results and cached transcripts and LLM responses for a video so the next request recomputes it."""
+    try:
+        deleted = delete_analysis(video_id)
+        deleted_transcripts = invalidate_transcript(video_id)
+        deleted_llm_responses = llm_cache.delete_tag(video_id) if llm_cache else 0
+        print(f"Invalidated {deleted} stored analyses, {deleted_transcripts} transcripts and {deleted_llm_responses} LLM responses for video ID: {video_id}")
         return jsonify({
-            'video_info': video_info,
-            'transcript': annotated_transcript,
-            'summary': summary,
-            'key_points': key_points,
-            'fact_check': fact_check
+            'video_id': video_id,
+            'deleted': deleted,
+            'deleted_transcripts': deleted_transcripts,
+            'deleted_llm_responses': deleted_llm_responses
         })
         
     except Exception as e:
-        print(f"Error in analyze_video: {str(e)}")
-        print("Traceback:")
-        print(traceback.format_exc())
-        return jsonify({'error': str(e)}), 500
+        print(f"Error in invalidate_analysis: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/fact_checks', methods=['GET'])
+def list_fact_checks():
+    """List stored fact-checked claims, optionally filtered by video and status."""
+    try:
+        video_url = request.args.get('video_url')
+        status = request.args.get('status')
+        try:
+            limit = max(1, min(int(request.args.get('limit', 100)), 1000))
+        except ValueError:
+            return jsonify({"error": "limit must be an integer"}), 400
+        
+        video_id = None
+        if video_url:
+            video_id = extract_video_id(video_url)
+            if not video_id:
+                return jsonify({"error": "Invalid YouTube URL"}), 400
+        
+        claims = find_fact_check_claims(video_id=video_id, status=status, limit=limit)
+        return jsonify({'claims': claims, 'count': len(claims)})
+        
+    except Exception as e:
+        print(f"Error in list_fact_checks: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Report size and hit/miss counts for the transcript and LLM caches."""
+    return jsonify({
+        'transcripts': transcript_cache.stats(),
+        'passage_indexes': index_cache.stats(),
+        'llm': llm_cache.stats() if llm_cache else None,
+        'claim_store': claim_store_stats(),
+        'qa_sessions': sessions.stats(),
+        'in_flight': {name: flight.stats() for name, flight in flights.items()},
+        'rate_limits': {
+            'gemini': gemini_limiter.stats()
+        },
+        'circuit_breakers': {name: breaker.stats() for name, breaker in circuit_breakers.items()},
+        'pipeline_tasks': pending_tasks(),
+        'job_queue': job_stats()
+    })
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Stage timings, counters and gauges in the Prometheus text format."""
+    return Response(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 @app.route('/api/transcript', methods=['GET'])
@@ -140,6 +482,7 @@ def get_video_transcript():
     """Get video transcript with fact checking."""
     try:
         video_url = request.args.get('video_url')
+        language = request.args.get('language')
         if not video_url:
             return jsonify({"error": "No video URL provided"}), 400
             
@@ -151,16 +494,19 @@ def get_video_transcript():
             return jsonify({"error": "Invalid YouTube URL"}), 400
             
         # Get transcript
-        transcript = get_transcript(video_id)
+        transcript_record = run_sync(get_transcript_record_async(video_id, language))
+        transcript = transcript_record['transcript']
         if not transcript:
             return jsonify({"error": "Could not retrieve transcript"}), 404
             
         # Get fact checks for the transcript
-        fact_check_results = analyze_with_llm(transcript, 'fact_check')
+        fact_check_results = run_sync(analyze_with_llm_async(transcript, 'fact_check', video_id=video_id))
         
         # Combine transcript with fact checks
         result = {
             'transcript': transcript,
+            'language_code': transcript_record['language_code'],
+            'is_generated': transcript_record['is_generated'],
             'fact_checks': fact_check_results if fact_check_results else {'results': []}
         }
         
@@ -179,6 +525,7 @@ def get_video_summary():
     """Get a summary of the video content."""
     try:
         video_url = request.args.get('video_url')
+        language = request.args.get('language')
         if not video_url:
             return jsonify({"error": "No video URL provided"}), 400
             
@@ -190,12 +537,12 @@ def get_video_summary():
             return jsonify({"error": "Invalid YouTube URL"}), 400
             
         # Get transcript
-        transcript = get_transcript(video_id)
+        transcript = run_sync(get_transcript_async(video_id, language))
         if not transcript:
             return jsonify({"error": "Could not retrieve transcript"}), 404
             
         # Get summary from LLM
-        summary = analyze_with_llm(transcript, 'summarize')
+        summary = run_sync(analyze_with_llm_async(transcript, 'summarize', video_id=video_id))
         
         return jsonify({
             'summary': summary
@@ -215,6 +562,7 @@ def ask_question():
             
         video_url = data.get('video_url')
         question = data.get('question')
+        language = data.get('language')
         
         if not video_url or not question:
             return jsonify({"error": "Missing video_url or question"}), 400
@@ -224,20 +572,19 @@ def ask_question():
         if not video_id:
             return jsonify({"error": "Invalid YouTube URL"}), 400
             
-        # Get transcript and analyze question concurrently
-        transcript_future = run_async(get_transcript, video_id)
-        
+        # Get transcript on the pipeline loop
         try:
-            transcript = transcript_future.result()
+            transcript = run_sync(get_transcript_async(video_id, language))
         except Exception as e:
             print(f"Error getting transcript: {str(e)}")
             return jsonify({"error": "Could not retrieve transcript"}), 404
             
+        # Long transcripts are narrowed down to the passages relevant to the question
+        context = get_question_context(video_id, transcript, question)
+            
         # Get answer from LLM asynchronously
-        answer_future = run_async(analyze_with_llm, transcript, 'question', question=question)
-        
         try:
-            answer = answer_future.result()
+            answer = run_sync(analyze_with_llm_async(context, 'question', question=question, video_id=video_id))
         except Exception as e:
             print(f"Error getting answer: {str(e)}")
             return jsonify({"error": str(e)}), 500
@@ -253,5 +600,79 @@ def ask_question():
         print(f"Error in ask_question: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/sessions', methods=['POST'])
+def create_qa_session():
+    """Start a Q&A session for a video, so follow-up questions reuse its prepared transcript."""
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({"error": "No data provided"}), 400
+        
+        video_url = data.get('video_url')
+        if not video_url:
+            return jsonify({'error': 'No video URL provided'}), 400
+        
+        video_id = extract_video_id(video_url)
+        if not video_id:
+            return jsonify({'error': 'Invalid YouTube URL'}), 400
+        
+        try:
+            session = run_sync(start_session(video_id, data.get('language')))
+        except QASessionError as e:
+            return jsonify({'error': str(e)}), e.status_code
+        
+        return jsonify(session.to_dict()), 201
+        
+    except Exception as e:
+        print(f"Error in create_qa_session: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/sessions/<session_id>', methods=['GET'])
+def get_qa_session(session_id):
+    """Get a Q&A session's video and recent questions and answers."""
+    session = sessions.get(session_id)
+    if not session:
+        return jsonify({'error': 'Session not found or expired'}), 404
+    return jsonify(session.to_dict())
+
+@app.route('/api/sessions/<session_id>/questions', methods=['POST'])
+def ask_session_question(session_id):
+    """Ask a question in a Q&A session, following up on its earlier questions."""
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({"error": "No data provided"}), 400
+        
+        question = data.get('question')
+        if not question:
+            return jsonify({"error": "Missing question"}), 400
+        
+        session = sessions.get(session_id)
+        if not session:
+            return jsonify({'error': 'Session not found or expired'}), 404
+        
+        try:
+            answer = run_sync(ask_in_session(session, question))
+        except QASessionError as e:
+            return jsonify({'error': str(e)}), e.status_code
+        
+        return jsonify({
+            'session_id': session.id,
+            'video_id': session.video_id,
+            'question': question,
+            'answer': answer
+        })
+        
+    except Exception as e:
+        print(f"Error in ask_session_question: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/sessions/<session_id>', methods=['DELETE'])
+def end_qa_session(session_id):
+    """End a Q&A session and free its cached context."""
+    if not sessions.remove(session_id):
+        return jsonify({'error': 'Session not found or expired'}), 404
+    return jsonify({'session_id': session_id, 'ended': True})
+
 if __name__ == '__main__':
     app.run(port=1337, debug=True)
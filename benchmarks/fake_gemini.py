@@ -0,0 +1,221 @@
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+TIMESTAMP_RANGE = re.compile(r'\[(\d+:\d{2})-(\d+:\d{2})\] (.*)')
+
+
+class FakeGeminiConfig:
+    """How the fake upstream behaves. Latencies are in seconds, rates are 0-1."""
+
+    def __init__(self, latency=0.5, jitter=0.2, error_rate=0.0, throttle_rate=0.0,
+                 retry_after=1, oembed_latency=0.05, claims_per_chunk=2, seconds_per_1k_tokens=0.0):
+        self.latency = latency
+        # Extra latency for every 1000 prompt tokens that aren't in a context cache
+        self.seconds_per_1k_tokens = seconds_per_1k_tokens
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.oembed_latency = oembed_latency
+        self.claims_per_chunk = claims_per_chunk
+
+
+def detect_task(prompt):
+    """Which task a prompt was built for, from the instructions it starts with."""
+    if prompt.startswith('IMPORTANT: For every claim'):
+        return 'fact_check'
+    if prompt.startswith('Analyze the following video transcript'):
+        return 'summarize'
+    if prompt.startswith('Extract the main key points'):
+        return 'key_points'
+    if prompt.startswith('You are reading one part'):
+        return 'chunk_notes'
+    return 'question'
+
+
+def fact_check_answer(prompt, claims_per_chunk):
+    results = []
+    for chunk in prompt.split('\nCHUNK ')[1:]:
+        lines = TIMESTAMP_RANGE.findall(chunk)
+        for start, end, text in lines[::max(1, len(lines) // claims_per_chunk)][:claims_per_chunk]:
+            results.append({
+                'timestamp': start,
+                'timestamp_range': f'{start}-{end}',
+                'claim': text[:200],
+                'status': random.choice(['TRUE', 'FALSE', 'SKIP']),
+                'explanation': 'Synthetic fact check',
+                'references': ['Benchmark reference']
+            })
+    return {'results': results}
+
+
+def answer_for(task, prompt, config):
+    """A response body of the shape each task's parser expects."""
+    if task == 'fact_check':
+        return json.dumps(fact_check_answer(prompt, config.claims_per_chunk))
+    if task == 'summarize':
+        return json.dumps({
+            'brief_overview': 'A synthetic video.',
+            'detailed_summary': {'introduction': 'Start', 'main_content': 'Middle', 'conclusion': 'End'},
+            'topics_covered': ['benchmarks'],
+            'target_audience': 'Developers',
+            'key_takeaways': ['Measure before optimizing']
+        })
+    if task == 'key_points':
+        timestamps = re.findall(r'\[(\d+:\d{2})', prompt)[:5]
+        return json.dumps({
+            'main_points': [
+                {'timestamp': timestamp, 'point': 'A point', 'details': 'Details', 'importance': 'medium'}
+                for timestamp in timestamps
+            ],
+            'themes': ['Synthetic'],
+            'arguments': []
+        })
+    if task == 'chunk_notes':
+        return '\n'.join(f'- [{timestamp}] notes' for timestamp in re.findall(r'\[(\d+:\d{2})\]', prompt)[:20])
+    return 'A synthetic answer to the question.'
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        """oEmbed lookups."""
+        config = self.server.config
+        time.sleep(config.oembed_latency)
+        self.server.count('oembed')
+        self.send_json(200, {
+            'title': 'Synthetic benchmark video',
+            'author_name': 'Benchmark',
+            'thumbnail_url': 'https://img.youtube.com/vi/benchmark/maxresdefault.jpg'
+        })
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def do_PATCH(self):
+        """Gemini context cache TTL updates."""
+        self.read_json()
+        self.server.count('cache_extend')
+        self.send_json(200, {'name': urlparse(self.path).path.split('/v1beta/', 1)[-1]})
+
+    def do_DELETE(self):
+        """Gemini context cache deletions."""
+        name = urlparse(self.path).path.split('/v1beta/', 1)[-1]
+        self.server.count('cache_delete')
+        with self.server._lock:
+            self.server.cached_contents.pop(name, None)
+        self.send_json(200, {})
+
+    def create_cached_content(self, request):
+        """Gemini context cache creation: keep the system instruction under a new name."""
+        text = request['systemInstruction']['parts'][0]['text']
+        time.sleep(len(text) // 4 / 1000 * self.server.config.seconds_per_1k_tokens)
+        with self.server._lock:
+            name = f'cachedContents/fake{len(self.server.cached_contents) + 1}'
+            self.server.cached_contents[name] = text
+        self.server.count('cache_create')
+        self.send_json(200, {'name': name, 'model': request.get('model')})
+
+    def do_POST(self):
+        """Gemini generateContent calls, and context cache creation."""
+        config = self.server.config
+        request = self.read_json()
+        if urlparse(self.path).path.endswith('/cachedContents'):
+            self.create_cached_content(request)
+            return
+        prompt = request['contents'][0]['parts'][0]['text']
+        task = detect_task(prompt)
+        cached_tokens = 0
+        if request.get('cachedContent'):
+            with self.server._lock:
+                cached = self.server.cached_contents.get(request['cachedContent'])
+            if cached is None:
+                self.send_json(404, {'error': {'code': 404, 'status': 'NOT_FOUND'}})
+                return
+            cached_tokens = len(cached) // 4
+        new_tokens = sum(len(part.get('text', '')) for content in request['contents'] for part in content['parts'])
+        new_tokens += sum(len(part.get('text', '')) for part in request.get('systemInstruction', {}).get('parts', []))
+        new_tokens //= 4
+        time.sleep(max(0, random.gauss(config.latency, config.jitter)) + new_tokens / 1000 * config.seconds_per_1k_tokens)
+
+        roll = random.random()
+        if roll < config.throttle_rate:
+            self.server.count('throttled')
+            self.send_json(429, {'error': {'code': 429, 'status': 'RESOURCE_EXHAUSTED'}},
+                           headers={'Retry-After': str(config.retry_after)})
+            return
+        if roll < config.throttle_rate + config.error_rate:
+            self.server.count('errors')
+            self.send_json(500, {'error': {'code': 500, 'status': 'INTERNAL'}})
+            return
+
+        text = answer_for(task, prompt, config)
+        prompt_tokens = new_tokens + cached_tokens
+        output_tokens = len(text) // 4
+        self.server.count(task)
+        self.send_json(200, {
+            'candidates': [{'content': {'parts': [{'text': text}]}}],
+            'usageMetadata': {
+                'promptTokenCount': prompt_tokens,
+                'cachedContentTokenCount': cached_tokens,
+                'candidatesTokenCount': output_tokens,
+                'totalTokenCount': prompt_tokens + output_tokens
+            }
+        })
+
+
+class FakeUpstreamServer(ThreadingHTTPServer):
+    """Local stand-in for the Gemini API and the YouTube oEmbed API."""
+
+    daemon_threads = True
+
+    def __init__(self, config, host='127.0.0.1', port=0):
+        super().__init__((host, port), FakeUpstreamHandler)
+        self.config = config
+        self.counts = {}
+        self.cached_contents = {}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='fake-upstream', daemon=True).start()
+        return self
+
+    def reset_counts(self):
+        with self._lock:
+            counts, self.counts = self.counts, {}
+        return counts
+
+
+if __name__ == '__main__':
+    server = FakeUpstreamServer(FakeGeminiConfig(), port=8765)
+    print(f'Fake Gemini and oEmbed listening on {server.url}')
+    server.serve_forever()
@@ -0,0 +1,322 @@
+"""Load-test the API offline, against local stand-ins for YouTube and Gemini.
+
+Run from the repository root:
+
+    python -m benchmarks.run --scenarios analyze,question,transcript,followup --lengths 1,10,60,600
+
+Results are written to benchmarks/results/ as JSON. Pass --compare with an
+earlier result file to see how latency and throughput changed.
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import datetime
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import requests
+
+from benchmarks.fake_gemini import FakeGeminiConfig, FakeUpstreamServer
+from benchmarks.synthetic_transcripts import SyntheticTranscriptProvider, benchmark_video_id
+
+SCENARIOS = ['analyze', 'question', 'transcript', 'followup']
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+QUESTION = 'What does the video say about the speed of light?'
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help='Comma-separated endpoints to load: analyze, question, transcript, and '
+                             'followup (questions in Q&A sessions that have already had one)')
+    parser.add_argument('--lengths', default='1,10,60,600',
+                        help='Comma-separated transcript lengths in minutes (up to 600, i.e. 10 hours)')
+    parser.add_argument('--requests', type=int, default=20, help='Requests per scenario and length')
+    parser.add_argument('--concurrency', type=int, default=8, help='Requests in flight at once')
+    parser.add_argument('--videos', type=int, default=None,
+                        help='Distinct videos per scenario, at most 1000 '
+                             '(default: one per request, so every request is cold)')
+    parser.add_argument('--gemini-latency', type=float, default=0.5, help='Mean fake Gemini latency in seconds')
+    parser.add_argument('--gemini-jitter', type=float, default=0.2, help='Standard deviation of that latency')
+    parser.add_argument('--gemini-ms-per-1k-tokens', type=float, default=0.0,
+                        help='Extra fake Gemini latency per 1000 prompt tokens not in a context cache')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of Gemini calls that return 500')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of Gemini calls that return 429')
+    parser.add_argument('--retry-after', type=float, default=1, help='Retry-After sent with fake 429s')
+    parser.add_argument('--transcript-latency', type=float, default=0.3, help='Fake transcript fetch latency')
+    parser.add_argument('--oembed-latency', type=float, default=0.05, help='Fake oEmbed latency')
+    parser.add_argument('--label', default='', help='Name saved with the results, e.g. a branch name')
+    parser.add_argument('--output', default=RESULTS_DIR, help='Directory to write the results file to')
+    parser.add_argument('--compare', help='Earlier results file to compare against')
+    parser.add_argument('--verbose', action='store_true', help="Show the app's own log output")
+    return parser.parse_args(argv)
+
+
+def configure_environment(upstream_url, database_path):
+    """Point the app at the fake upstreams. Must run before the app is imported."""
+    os.environ['DATABASE_PATH'] = database_path
+    os.environ['GEMINI_API_BASE'] = upstream_url
+    os.environ['YOUTUBE_OEMBED_URL'] = f'{upstream_url}/oembed'
+    os.environ['GEMINI_API_KEY'] = 'benchmark'
+    os.environ['JOB_WORKERS'] = '0'
+    # Measure the app, not the client-side quota, unless asked to
+    os.environ.setdefault('GEMINI_REQUESTS_PER_MINUTE', '1000000')
+    os.environ.setdefault('GEMINI_TOKENS_PER_MINUTE', '1000000000')
+
+
+def start_app(provider):
+    """Serve the app on a local port with the transcript API replaced by provider."""
+    from werkzeug.serving import make_server
+    import app as app_module
+    import utils
+
+    utils.transcript_provider = provider
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='benchmark-app', daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def memory_mb():
+    """(current RSS, peak RSS) of this process in MB, where the platform reports them."""
+    current = peak = None
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    current = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    except ImportError:
+        pass
+    return current, peak
+
+
+def build_request(scenario, base_url, video_id, session_id=None):
+    video_url = f'https://www.youtube.com/watch?v={video_id}'
+    if scenario == 'followup':
+        return 'POST', f'{base_url}/api/sessions/{session_id}/questions', {'json': {'question': QUESTION}}
+    if scenario == 'analyze':
+        return 'POST', f'{base_url}/api/analyze', {'json': {'video_url': video_url}}
+    if scenario == 'question':
+        return 'POST', f'{base_url}/api/question', {'json': {'video_url': video_url, 'question': QUESTION}}
+    if scenario == 'transcript':
+        return 'GET', f'{base_url}/api/transcript', {'params': {'video_url': video_url}}
+    raise ValueError(f'Unknown scenario: {scenario}')
+
+
+def run_load(requests_to_send, concurrency):
+    """Send requests with up to concurrency in flight. Returns (latencies, statuses, wall time)."""
+    sessions = threading.local()
+
+    def send(request):
+        method, url, kwargs = request
+        if not hasattr(sessions, 'session'):
+            sessions.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            status = sessions.session.request(method, url, timeout=600, **kwargs).status_code
+        except requests.RequestException:
+            status = 0
+        return time.perf_counter() - start, status
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, requests_to_send))
+    wall_time = time.perf_counter() - start
+    return [latency for latency, _ in results], [status for _, status in results], wall_time
+
+
+def stage_totals():
+    from metrics import stage_seconds
+    return stage_seconds.totals()
+
+
+def stage_means_ms(before, after):
+    """Mean milliseconds per call of each stage between two stage_totals() snapshots."""
+    means = {}
+    for key, (count, total) in after.items():
+        previous_count, previous_total = before.get(key, (0, 0.0))
+        if count > previous_count:
+            means[','.join(key)] = round((total - previous_total) / (count - previous_count) * 1000, 2)
+    return dict(sorted(means.items()))
+
+
+def start_sessions(base_url, video_ids, concurrency):
+    """Open a Q&A session for each video and ask its first question. Returns {video ID: session ID}."""
+    def start(video_id):
+        with requests.Session() as http:
+            response = http.post(f'{base_url}/api/sessions', timeout=600,
+                                 json={'video_url': f'https://www.youtube.com/watch?v={video_id}'})
+            response.raise_for_status()
+            session_id = response.json()['session_id']
+            http.post(f'{base_url}/api/sessions/{session_id}/questions', timeout=600, json={'question': QUESTION})
+            return video_id, session_id
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return dict(pool.map(start, video_ids))
+
+
+def run_scenario(scenario, minutes, args, base_url, upstream):
+    # Each scenario gets its own videos so one doesn't warm the caches for the next
+    videos = min(args.videos or args.requests, 1000)
+    first = SCENARIOS.index(scenario) * 1000
+    video_ids = [benchmark_video_id(minutes, first + i % videos) for i in range(args.requests)]
+    # Follow-ups are measured in sessions that were opened beforehand
+    session_ids = {}
+    if scenario == 'followup':
+        session_ids = start_sessions(base_url, sorted(set(video_ids)), args.concurrency)
+    requests_to_send = [
+        build_request(scenario, base_url, video_id, session_ids.get(video_id))
+        for video_id in video_ids
+    ]
+    stages_before = stage_totals()
+    upstream.reset_counts()
+
+    latencies, statuses, wall_time = run_load(requests_to_send, args.concurrency)
+
+    rss, peak_rss = memory_mb()
+    latencies_ms = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99]).tolist()
+    return {
+        'scenario': scenario,
+        'minutes': minutes,
+        'requests': len(statuses),
+        'concurrency': args.concurrency,
+        'errors': sum(1 for status in statuses if status != 200),
+        'throughput_rps': round(len(statuses) / wall_time, 3),
+        'latency_ms': {
+            'mean': round(float(latencies_ms.mean()), 1),
+            'p50': round(p50, 1),
+            'p95': round(p95, 1),
+            'p99': round(p99, 1),
+            'max': round(float(latencies_ms.max()), 1)
+        },
+        'rss_mb': rss and round(rss, 1),
+        'peak_rss_mb': peak_rss and round(peak_rss, 1),
+        'stages_ms': stage_means_ms(stages_before, stage_totals()),
+        'upstream_calls': upstream.reset_counts()
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except OSError:
+        return None
+
+
+def print_results(results, out):
+    print(f"{'scenario':<11}{'minutes':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'errors':>8}{'RSS MB':>9}", file=out)
+    for result in results:
+        latency = result['latency_ms']
+        print(f"{result['scenario']:<11}{result['minutes']:>8}{result['throughput_rps']:>9.2f}"
+              f"{latency['p50']:>10.1f}{latency['p95']:>10.1f}{latency['p99']:>10.1f}"
+              f"{result['errors']:>8}{result['rss_mb'] or 0:>9.1f}", file=out)
+
+
+def percent_change(old, new):
+    if not old:
+        return 'n/a'
+    return f'{(new - old) / old:+.1%}'
+
+
+def print_comparison(previous, results, current_config, out):
+    """Latency and throughput of this run relative to an earlier one, per scenario and length."""
+    earlier = {(result['scenario'], result['minutes']): result for result in previous['results']}
+    print(f"\nCompared with {previous.get('label') or previous.get('commit') or 'previous run'} "
+          f"({previous.get('started_at')}):", file=out)
+    config = previous.get('config', {})
+    changed = [
+        f"{name}: {config.get(name)} -> {value}" for name, value in current_config.items()
+        if name not in ('label', 'output', 'compare', 'verbose') and config.get(name) != value
+    ]
+    if changed:
+        print('Settings differ: ' + ', '.join(changed), file=out)
+    matched = [(earlier[key], result) for result in results
+               if (key := (result['scenario'], result['minutes'])) in earlier]
+    if not matched:
+        print('No scenarios in common with this run.', file=out)
+        return
+    print(f"{'scenario':<11}{'minutes':>8}{'req/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}", file=out)
+    for old, result in matched:
+        print(f"{result['scenario']:<11}{result['minutes']:>8}"
+              f"{percent_change(old['throughput_rps'], result['throughput_rps']):>10}"
+              + ''.join(f"{percent_change(old['latency_ms'][p], result['latency_ms'][p]):>10}"
+                        for p in ('p50', 'p95', 'p99')), file=out)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    out = sys.stdout
+    scenarios = [scenario.strip() for scenario in args.scenarios.split(',') if scenario.strip()]
+    lengths = [int(minutes) for minutes in args.lengths.split(',') if minutes.strip()]
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            raise SystemExit(f'Unknown scenario: {scenario}')
+    if any(not 1 <= minutes <= 9999 for minutes in lengths):
+        raise SystemExit('Transcript lengths must be between 1 and 9999 minutes')
+
+    upstream = FakeUpstreamServer(FakeGeminiConfig(
+        latency=args.gemini_latency,
+        jitter=args.gemini_jitter,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+        oembed_latency=args.oembed_latency,
+        seconds_per_1k_tokens=args.gemini_ms_per_1k_tokens / 1000
+    )).start()
+    workdir = tempfile.mkdtemp(prefix='benchmark-')
+    configure_environment(upstream.url, os.path.join(workdir, 'benchmark.db'))
+
+    started_at = datetime.datetime.now().isoformat(timespec='seconds')
+    results = []
+    logs = contextlib.nullcontext()
+    if not args.verbose:
+        logs = contextlib.redirect_stdout(open(os.devnull, 'w'))
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    with logs:
+        server, base_url = start_app(SyntheticTranscriptProvider(latency=args.transcript_latency))
+        try:
+            # Start the pipeline loop, thread pools and connections before measuring
+            run_load([build_request(scenario, base_url, benchmark_video_id(1, 9000 + i))
+                      for i, scenario in enumerate(scenarios) if scenario != 'followup'], 1)
+            for scenario in scenarios:
+                for minutes in lengths:
+                    print(f'Running {scenario} with {minutes}-minute transcripts...', file=out)
+                    results.append(run_scenario(scenario, minutes, args, base_url, upstream))
+        finally:
+            server.shutdown()
+
+    print_results(results, out)
+    report = {
+        'label': args.label,
+        'commit': git_commit(),
+        'started_at': started_at,
+        'config': vars(args),
+        'results': results
+    }
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, f"{started_at.replace(':', '')}{'-' + args.label if args.label else ''}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'\nResults saved to {path}', file=out)
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), results, vars(args), out)
+
+
+if __name__ == '__main__':
+    main()
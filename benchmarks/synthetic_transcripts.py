@@ -0,0 +1,55 @@
+import random
+import time
+import zlib
+
+WORDS = (
+    'the speed of light is about three hundred thousand kilometres per second and water boils at '
+    'one hundred degrees at sea level while the moon orbits the earth every twenty seven days so '
+    'researchers measured the results twice before publishing their findings in a journal'
+).split()
+
+# Typical auto-generated captions: a few seconds and about a dozen words per segment
+SEGMENT_SECONDS = 4.0
+WORDS_PER_SEGMENT = 12
+
+
+def benchmark_video_id(minutes, number):
+    """An 11-character video ID that encodes the transcript length, e.g. bm0600m0001."""
+    return f'bm{minutes:04d}m{number:04d}'
+
+
+def minutes_for(video_id):
+    """The transcript length encoded by benchmark_video_id, or 10 minutes for other IDs."""
+    if video_id.startswith('bm') and video_id[6] == 'm':
+        return int(video_id[2:6])
+    return 10
+
+
+def synthetic_transcript(video_id, minutes):
+    """A deterministic transcript of the given length. Different IDs give different text."""
+    rng = random.Random(zlib.crc32(video_id.encode('utf-8')))
+    transcript = []
+    start = 0.0
+    end = minutes * 60
+    while start < end:
+        duration = round(rng.uniform(SEGMENT_SECONDS * 0.5, SEGMENT_SECONDS * 1.5), 2)
+        words = rng.choices(WORDS, k=WORDS_PER_SEGMENT)
+        transcript.append({'text': ' '.join(words), 'start': round(start, 2), 'duration': duration})
+        start += duration
+    return transcript
+
+
+class SyntheticTranscriptProvider:
+    """Transcript provider that stands in for the YouTube transcript API with generated transcripts."""
+
+    name = 'synthetic'
+
+    def __init__(self, latency=0.3):
+        self.latency = latency
+        self.fetched = 0
+
+    def fetch(self, video_id, language=None):
+        """Returns (transcript, language_code, is_generated), like the other transcript providers."""
+        time.sleep(self.latency)
+        self.fetched += 1
+        return synthetic_transcript(video_id, minutes_for(video_id)), language or 'en', True
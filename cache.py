@@ -0,0 +1,341 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import database
+from database import get_connection
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU cache with an optional per-entry TTL.
+    
+    Entries can carry a tag (such as a video ID) so that all of them can be
+    dropped together with delete_tag.
+    """
+
+    def __init__(self, max_size=256, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expires_at, _ = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None, tag=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at, tag)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def delete_tag(self, tag):
+        """Delete every entry set with this tag. Returns how many were deleted."""
+        with self._lock:
+            keys = [key for key, (_, _, entry_tag) in self._data.items() if entry_tag == tag]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def keys(self):
+        with self._lock:
+            return list(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+class SQLiteCache:
+    """Persistent key/value cache stored in a SQLite table, with per-entry TTLs and tags.
+    
+    Values must be JSON-serializable. Without a db_path the cache uses
+    DATABASE_PATH as it is when the cache is first used rather than when it
+    is created, and the table is created then too, so creating a cache
+    doesn't touch any database.
+    """
+
+    def __init__(self, db_path=None, table='llm_cache', max_rows=None):
+        self._db_path = db_path
+        self.table = table
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._table_lock = threading.Lock()
+        self._ready_paths = set()
+
+    @property
+    def db_path(self):
+        return self._db_path or database.DATABASE_PATH
+
+    def _connection(self):
+        """This thread's connection to the cache's database, creating the table on first use."""
+        path = self.db_path
+        conn = get_connection(path)
+        if path not in self._ready_paths:
+            with self._table_lock:
+                if path not in self._ready_paths:
+                    self._create_table(conn)
+                    self._ready_paths.add(path)
+        return conn
+
+    def _create_table(self, conn):
+        with conn:
+            conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL,
+                    created_at REAL NOT NULL,
+                    tag TEXT
+                )
+            ''')
+            # Tables created before entries had tags need the column added
+            columns = [row[1] for row in conn.execute(f'PRAGMA table_info({self.table})')]
+            if 'tag' not in columns:
+                conn.execute(f'ALTER TABLE {self.table} ADD COLUMN tag TEXT')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{self.table}_created_at ON {self.table} (created_at)')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{self.table}_tag ON {self.table} (tag)')
+
+    def get(self, key, default=None):
+        with self._connection() as conn:
+            row = conn.execute(
+                f'SELECT value, expires_at FROM {self.table} WHERE key = ?', (key,)
+            ).fetchone()
+            if row and row[1] is not None and row[1] < time.time():
+                conn.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+                row = None
+
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None, tag=None):
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        with self._lock, self._connection() as conn:
+            conn.execute(
+                f'INSERT OR REPLACE INTO {self.table} (key, value, expires_at, created_at, tag) VALUES (?, ?, ?, ?, ?)',
+                (key, json.dumps(value), expires_at, now, tag)
+            )
+            if self.max_rows:
+                conn.execute(f'''
+                    DELETE FROM {self.table} WHERE key IN (
+                        SELECT key FROM {self.table} ORDER BY created_at DESC LIMIT -1 OFFSET ?
+                    )
+                ''', (self.max_rows,))
+
+    def delete(self, key):
+        with self._connection() as conn:
+            deleted = conn.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,)).rowcount
+        return deleted > 0
+
+    def delete_tag(self, tag):
+        """Delete every entry set with this tag. Returns how many were deleted."""
+        with self._connection() as conn:
+            return conn.execute(f'DELETE FROM {self.table} WHERE tag = ?', (tag,)).rowcount
+
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute(f'DELETE FROM {self.table}')
+
+    def stats(self):
+        size = self._connection().execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+        return {'size': size, 'max_size': self.max_rows}
+
+
+class ResponseCache:
+    """Content-addressed cache in front of a backend (LRUCache or SQLiteCache).
+    
+    Keys are SHA-256 hashes of the parts that determine a response, and hits
+    and misses are counted per namespace (e.g. per LLM task).
+    """
+
+    def __init__(self, backend, ttls=None, default_ttl=None):
+        self.backend = backend
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+
+    @staticmethod
+    def make_key(*parts):
+        payload = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, namespace, key):
+        value = self.backend.get(key)
+        with self._lock:
+            counter = self.misses if value is None else self.hits
+            counter[namespace] = counter.get(namespace, 0) + 1
+        return value
+
+    def set(self, namespace, key, value, tag=None):
+        ttl = self.ttls.get(namespace, self.default_ttl)
+        if ttl == 0:
+            return
+        self.backend.set(key, value, ttl=ttl, tag=tag)
+
+    def delete_tag(self, tag):
+        return self.backend.delete_tag(tag)
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.backend.stats(),
+                'backend': type(self.backend).__name__,
+                'hits': dict(self.hits),
+                'misses': dict(self.misses)
+            }
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into one execution.
+    
+    The first caller for a key runs the function; callers arriving while it
+    is still running wait for and share its result (or exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            future = self._calls.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._calls[key] = future
+                self.executed += 1
+            else:
+                self.shared += 1
+
+        if not is_leader:
+            return future.result()
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'executed': self.executed,
+                'shared': self.shared
+            }
+
+
+class LeaderCancelled(Exception):
+    """The call an AsyncSingleFlight caller was waiting on was cancelled."""
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines running on one event loop.
+    
+    If the caller running the function is cancelled, the callers waiting on
+    it aren't: the first of them runs the function again and the rest wait
+    on that run instead.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.executed = 0
+        self.shared = 0
+
+    async def do(self, key, func, *args, **kwargs):
+        future = self._calls.get(key)
+        if future is not None:
+            self.shared += 1
+        while future is not None:
+            try:
+                return await asyncio.shield(future)
+            except LeaderCancelled:
+                future = self._calls.get(key)
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self.executed += 1
+        try:
+            result = await func(*args, **kwargs)
+        except asyncio.CancelledError:
+            future.set_exception(LeaderCancelled())
+            future.exception()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case no other caller was waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._calls.pop(key, None)
+
+    def in_flight(self):
+        return len(self._calls)
+
+    def stats(self):
+        return {
+            'in_flight': len(self._calls),
+            'executed': self.executed,
+            'shared': self.shared
+        }
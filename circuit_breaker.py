@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+from functools import wraps
+
+from metrics import circuit_rejections, upstream_errors
+from rate_limiter import is_retryable
+
+# Consecutive upstream failures before a breaker opens, and how long (in
+# seconds) it stays open before letting a probe request through
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5))
+CIRCUIT_RECOVERY_TIMEOUT = float(os.getenv('CIRCUIT_RECOVERY_TIMEOUT', 30))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Transcript API errors that mean YouTube is refusing or failing requests,
+# as opposed to the video simply having no transcript
+UPSTREAM_FAILURE_ERRORS = {'TooManyRequests', 'YouTubeRequestFailed', 'RequestBlocked', 'IpBlocked'}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose breaker is open."""
+
+    def __init__(self, name, retry_in):
+        super().__init__(f"{name} is unavailable, not retrying for {retry_in:.1f} seconds")
+        self.name = name
+        self.retry_in = retry_in
+
+
+def is_upstream_failure(error):
+    """Whether an error means the upstream is unhealthy, rather than the request being bad."""
+    while error is not None:
+        if is_retryable(error) or type(error).__name__ in UPSTREAM_FAILURE_ERRORS:
+            return True
+        error = error.__cause__
+    return False
+
+
+class CircuitBreaker:
+    """Fails calls to an unhealthy upstream fast instead of letting them wait and time out.
+
+    After failure_threshold consecutive upstream failures the breaker opens
+    and calls raise CircuitOpenError immediately. Once recovery_timeout has
+    passed it is half-open: a single probe call goes through, and closes the
+    breaker if it succeeds or reopens it if it fails.
+    """
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+                 recovery_timeout=CIRCUIT_RECOVERY_TIMEOUT, is_failure=is_upstream_failure):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.is_failure = is_failure
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.probing = False
+        self.rejected = 0
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    @property
+    def is_closed(self):
+        return self.state == CLOSED
+
+    def before_call(self):
+        """Raise CircuitOpenError if a call may not go through right now."""
+        with self._lock:
+            if self.state == OPEN:
+                retry_in = self.opened_at + self.recovery_timeout - time.monotonic()
+                if retry_in > 0:
+                    self.rejected += 1
+                    circuit_rejections.inc(upstream=self.name)
+                    raise CircuitOpenError(self.name, retry_in)
+                print(f"Circuit for {self.name} is half-open, probing")
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self.probing:
+                    self.rejected += 1
+                    circuit_rejections.inc(upstream=self.name)
+                    raise CircuitOpenError(self.name, self.recovery_timeout)
+                self.probing = True
+
+    def on_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                print(f"Circuit for {self.name} closed")
+            self.state = CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def on_failure(self, error):
+        if not self.is_failure(error):
+            # The upstream answered; the request itself was the problem
+            self.on_success()
+            return
+        upstream_errors.inc(upstream=self.name)
+        with self._lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                print(f"Circuit for {self.name} opened after {self.failures} failures: {error}")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.times_opened += 1
+
+    def on_cancel(self):
+        with self._lock:
+            self.probing = False
+
+    def protect(self, func):
+        """Decorator that runs a function through this breaker."""
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            self.before_call()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                self.on_failure(e)
+                raise
+            except BaseException:
+                self.on_cancel()
+                raise
+            self.on_success()
+            return result
+        return wrapper
+
+    def protect_async(self, func):
+        """Decorator that runs a coroutine function through this breaker."""
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            self.before_call()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                self.on_failure(e)
+                raise
+            except BaseException:
+                # Cancelled, e.g. a hedged request that lost the race
+                self.on_cancel()
+                raise
+            self.on_success()
+            return result
+        return wrapper
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'rejected': self.rejected,
+                'times_opened': self.times_opened
+            }
+
+
+oembed_breaker = CircuitBreaker('YouTube oEmbed')
+transcript_breaker = CircuitBreaker('YouTube transcripts')
+gemini_breaker = CircuitBreaker('Gemini')
+
+circuit_breakers = {
+    'oembed': oembed_breaker,
+    'transcript': transcript_breaker,
+    'gemini': gemini_breaker
+}
@@ -0,0 +1,262 @@
+import json
+import os
+import re
+import unicodedata
+import zlib
+
+import numpy as np
+
+from database import (
+    add_claim_sighting,
+    find_claim_candidates,
+    find_passage_candidates,
+    save_claim_passage,
+    save_known_claim
+)
+
+# Reuse fact checks of claims already verified in other videos, leaving the
+# transcript passages they came from out of fact-check prompts
+CLAIM_CACHE_ENABLED = os.getenv('CLAIM_CACHE_ENABLED', 'true').lower() == 'true'
+# Estimated Jaccard similarity of word pairs above which two texts count as the same
+CLAIM_MATCH_THRESHOLD = float(os.getenv('CLAIM_MATCH_THRESHOLD', 0.75))
+# Longest passage, in transcript segments, remembered for a claim
+CLAIM_PASSAGE_MAX_SEGMENTS = int(os.getenv('CLAIM_PASSAGE_MAX_SEGMENTS', 3))
+
+# Only definite verdicts are reused; SKIPped claims are checked again
+RESOLVED_STATUSES = ('TRUE', 'FALSE')
+
+# Texts with fewer words than this are too short to match reliably
+MIN_WORDS = 4
+MINHASH_PERMUTATIONS = 64
+# Bands of rows for locality-sensitive hashing. With 16 bands of 4 rows, texts
+# at 0.75 similarity almost always share a bucket, and texts at 0.3 only 12% of the time.
+MINHASH_BANDS = 16
+
+# Filler words dropped before comparing, common in auto-generated captions
+FILLER_WORDS = {'um', 'uh', 'er', 'ah', 'hmm', 'basically', 'actually'}
+# Words that flip a claim's meaning; "t" is what's left of "isn't" and the like
+NEGATION_WORDS = {'not', 'no', 'never', 'nor', 'neither', 'none', 'nothing', 'cannot', 't'}
+
+# Signatures are stored, so the permutations must never change between runs
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_random = np.random.RandomState(20240601)
+_PERMUTATION_A = _random.randint(1, 1 << 31, size=MINHASH_PERMUTATIONS).astype(np.uint64)
+_PERMUTATION_B = _random.randint(0, 1 << 31, size=MINHASH_PERMUTATIONS).astype(np.uint64)
+_BAND_MULTIPLIERS = _random.randint(
+    1, 1 << 62, size=MINHASH_PERMUTATIONS // MINHASH_BANDS, dtype=np.int64
+).astype(np.uint64) | np.uint64(1)
+_BAND_SALTS = _random.randint(0, 1 << 62, size=MINHASH_BANDS, dtype=np.int64).astype(np.uint64)
+
+
+def claim_words(text):
+    """Normalized words of a claim or passage: lowercased, without punctuation or filler.
+
+    Digit grouping is removed so "299,792" and "299792" are the same number.
+    """
+    text = unicodedata.normalize('NFKC', str(text)).lower()
+    text = re.sub(r'(?<=\d),(?=\d{3}\b)', '', text)
+    return [word for word in re.findall(r'\d+(?:\.\d+)?|[^\W_]+', text) if word not in FILLER_WORDS]
+
+
+def claim_anchors(words):
+    """The numbers and negations in a text, which have to match exactly for two texts to match.
+
+    Changing a figure or adding a "not" changes a claim's truth while barely
+    changing its word pairs.
+    """
+    return ' '.join(sorted(word for word in words if word[0].isdigit() or word in NEGATION_WORDS))
+
+
+def pair_hashes(words):
+    """Hashes of a text's word pairs (its shingles), or of the whole text if it is one word."""
+    if len(words) < 2:
+        return np.array([zlib.crc32(' '.join(words).encode('utf-8'))], dtype=np.uint64)
+    return np.fromiter(
+        (zlib.crc32(f'{first} {second}'.encode('utf-8')) for first, second in zip(words, words[1:])),
+        dtype=np.uint64, count=len(words) - 1
+    )
+
+
+def permute(hashes):
+    """Each hash under every MinHash permutation, as an (n, MINHASH_PERMUTATIONS) uint32 array."""
+    # a * h + b stays below 2**64 since a, b < 2**31 and h < 2**32
+    permuted = (hashes[:, None] * _PERMUTATION_A + _PERMUTATION_B) % _MERSENNE_PRIME
+    return (permuted & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+
+def minhash_signature(words):
+    """MinHash signature of a text's word pairs, as uint32 values."""
+    return permute(pair_hashes(words)).min(axis=0)
+
+
+def signature_buckets(signatures):
+    """LSH bucket of each band of one or more signatures, as signed 64-bit integers for SQLite."""
+    rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+    bands = signatures.reshape(signatures.shape[:-1] + (MINHASH_BANDS, rows)).astype(np.uint64)
+    # Multiply-add hashing, wrapping around at 2**64
+    return ((bands * _BAND_MULTIPLIERS).sum(axis=-1, dtype=np.uint64) + _BAND_SALTS).view(np.int64)
+
+
+def similarity(signature, other):
+    """Estimated Jaccard similarity of the texts two signatures were made from."""
+    return float(np.mean(signature == np.frombuffer(other, dtype=np.uint32)))
+
+
+def best_match(words, candidates):
+    """The candidate (id, anchors, signature, ...) most similar to words, if any is similar enough."""
+    signature = minhash_signature(words)
+    anchors = claim_anchors(words)
+    best, best_score = None, CLAIM_MATCH_THRESHOLD
+    for candidate in candidates:
+        if candidate[1] != anchors:
+            continue
+        score = similarity(signature, candidate[2])
+        if score >= best_score:
+            best, best_score = candidate, score
+    return best
+
+
+def passage_windows(segment_words):
+    """Every run of up to CLAIM_PASSAGE_MAX_SEGMENTS segments with enough words to match.
+
+    Returns (bounds, signatures, buckets) arrays with a row per run: its
+    (start, end) segment indexes, MinHash signature and LSH buckets. The
+    MinHash of a union of sets is the elementwise minimum of their MinHashes,
+    so each segment's word pairs, and the pair spanning each boundary between
+    segments, are hashed once and combined per run.
+    """
+    count = len(segment_words)
+    empty = np.iinfo(np.uint32).max
+    segment_signatures = np.full((count, MINHASH_PERMUTATIONS), empty, dtype=np.uint32)
+    owners = [i for i, words in enumerate(segment_words) for _ in range(len(words) - 1)]
+    if owners:
+        hashes = np.concatenate([pair_hashes(words) for words in segment_words if len(words) > 1])
+        owners = np.array(owners)
+        firsts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+        segment_signatures[owners[firsts]] = np.minimum.reduceat(permute(hashes), firsts, axis=0)
+    # A one-word segment has no pairs of its own, only the ones it forms with its neighbours
+    boundary_signatures = np.full((max(count - 1, 0), MINHASH_PERMUTATIONS), empty, dtype=np.uint32)
+    boundaries = [i for i in range(count - 1) if segment_words[i] and segment_words[i + 1]]
+    if boundaries:
+        boundary_signatures[boundaries] = permute(np.fromiter(
+            (zlib.crc32(f'{segment_words[i][-1]} {segment_words[i + 1][0]}'.encode('utf-8')) for i in boundaries),
+            dtype=np.uint64, count=len(boundaries)
+        ))
+    word_counts = np.array([len(words) for words in segment_words], dtype=np.int64)
+
+    bounds = [np.empty((0, 2), dtype=np.int64)]
+    window_signatures = [np.empty((0, MINHASH_PERMUTATIONS), dtype=np.uint32)]
+    signatures = segment_signatures
+    lengths = word_counts
+    for size in range(1, min(CLAIM_PASSAGE_MAX_SEGMENTS, count) + 1):
+        if size > 1:
+            runs = count - size + 1
+            signatures = np.minimum(signatures[:runs], segment_signatures[size - 1:])
+            signatures = np.minimum(signatures, boundary_signatures[size - 2:])
+            lengths = lengths[:runs] + word_counts[size - 1:]
+        starts = np.flatnonzero(lengths >= MIN_WORDS)
+        bounds.append(np.column_stack((starts, starts + size)))
+        window_signatures.append(signatures[starts])
+    signatures = np.concatenate(window_signatures)
+    return np.concatenate(bounds), signatures, signature_buckets(signatures)
+
+
+def find_known_passages(texts):
+    """Runs of transcript segments that match passages of already verified claims.
+
+    texts are the segments' texts. Returns non-overlapping (start, end,
+    claims) with claims the stored fact checks found in that passage, as
+    dicts of claim, status, explanation and references.
+    """
+    segment_words = [claim_words(text) for text in texts]
+    bounds, signatures, buckets = passage_windows(segment_words)
+    if not len(bounds):
+        return []
+
+    candidates = find_passage_candidates(np.unique(buckets).tolist())
+    if not candidates:
+        return []
+    # Only runs sharing a bucket with a stored passage need a closer look
+    hits = np.isin(buckets, np.fromiter(candidates, dtype=np.int64, count=len(candidates)))
+    matches = []
+    for window in np.flatnonzero(hits.any(axis=1)).tolist():
+        start, end = bounds[window].tolist()
+        anchors = claim_anchors([word for words in segment_words[start:end] for word in words])
+        seen = set()
+        window_claims = {}
+        score = 0.0
+        for bucket in buckets[window][hits[window]].tolist():
+            for passage_id, passage_anchors, passage_signature, claim in candidates[bucket]:
+                if passage_id in seen or passage_anchors != anchors or claim['status'] not in RESOLVED_STATUSES:
+                    continue
+                seen.add(passage_id)
+                passage_score = similarity(signatures[window], passage_signature)
+                if passage_score >= CLAIM_MATCH_THRESHOLD:
+                    window_claims[claim['id']] = claim
+                    score = max(score, passage_score)
+        if window_claims:
+            matches.append((score, end - start, start, end, list(window_claims.values())))
+
+    # Prefer the closest matches, then the longest passages
+    matches.sort(key=lambda match: (-match[0], -match[1], match[2]))
+    taken = np.zeros(len(texts), dtype=bool)
+    passages = []
+    for _, _, start, end, claims in matches:
+        if taken[start:end].any():
+            continue
+        taken[start:end] = True
+        passages.append((start, end, [
+            {key: claim[key] for key in ('claim', 'status', 'explanation', 'references')} for claim in claims
+        ]))
+    return sorted(passages, key=lambda passage: passage[0])
+
+
+def remember_claim(result, passage=None):
+    """Add a fact-checked claim to the store, merging it with a near-identical stored one.
+
+    passage is the transcript text the claim was found in. It is remembered
+    for claims with a definite verdict, so later transcripts containing the
+    same passage can skip fact-checking it.
+    """
+    words = claim_words(result.get('claim', ''))
+    if len(words) < MIN_WORDS:
+        return None
+    status = str(result.get('status', '')).upper()
+    signature = minhash_signature(words)
+    buckets = signature_buckets(signature).tolist()
+    references = json.dumps(result.get('references') or [])
+
+    match = best_match(words, find_claim_candidates(buckets))
+    if match:
+        claim_id, stored_status = match[0], match[3]
+        # The first definite verdict is kept; a SKIP is replaced by a later definite one
+        if stored_status in RESOLVED_STATUSES or status not in RESOLVED_STATUSES:
+            add_claim_sighting(claim_id)
+            status = stored_status
+        else:
+            add_claim_sighting(claim_id, (status, result.get('explanation'), references))
+    else:
+        claim_id = save_known_claim(
+            result.get('claim'), claim_anchors(words), signature.tobytes(), buckets,
+            status, result.get('explanation'), references
+        )
+
+    if passage is None or status not in RESOLVED_STATUSES:
+        return claim_id
+    passage_words = claim_words(passage)
+    if len(passage_words) < MIN_WORDS:
+        return claim_id
+    passage_signature = minhash_signature(passage_words)
+    passage_buckets = signature_buckets(passage_signature).tolist()
+    # A passage already remembered for this claim doesn't need another copy
+    same_claim = [
+        (passage_id, anchors, stored_signature)
+        for bucket, passages in find_passage_candidates(passage_buckets).items()
+        for passage_id, anchors, stored_signature, claim in passages
+        if claim['id'] == claim_id
+    ]
+    if not best_match(passage_words, same_claim):
+        save_claim_passage(
+            claim_id, claim_anchors(passage_words), passage_signature.tobytes(), passage_buckets
+        )
+    return claim_id
@@ -0,0 +1,32 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+# Send every database the app opens during tests to a throwaway directory.
+# This runs before any test module imports the app's modules, which read
+# DATABASE_PATH when they are imported.
+_database_dir = tempfile.mkdtemp(prefix='video-analysis-tests-')
+os.environ['DATABASE_PATH'] = os.path.join(_database_dir, 'video_analysis.db')
+# Tests run jobs themselves rather than through background workers
+os.environ['JOB_WORKERS'] = '0'
+
+import database
+
+# test_api.py exercises a running server; run it directly with python
+collect_ignore = ['test_api.py']
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_database_dir, ignore_errors=True)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh database in a temporary directory, used by every database call in the test."""
+    path = str(tmp_path / 'test.db')
+    monkeypatch.setattr(database, 'DATABASE_PATH', path)
+    database.init_db()
+    yield path
+    database.close_connection(path)
@@ -1,66 +1,604 @@
+import os
 import sqlite3
+import threading
 from datetime import datetime
 import json
 
+from storage_format import pack_json, unpack_json, pack_transcript, unpack_transcript
+
+# Path of the SQLite database holding analyses, transcripts, jobs and the LLM cache
+DATABASE_PATH = os.getenv('DATABASE_PATH', 'video_analysis.db')
+# Milliseconds to wait for another connection's write lock before failing
+SQLITE_BUSY_TIMEOUT = int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000))
+# Page cache per connection, in KiB, and how much of the file to memory-map, in bytes
+SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', 16384))
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+
+_local = threading.local()
+
+def connect(path=None):
+    """Open a connection to the database with WAL journaling and tuned pragmas."""
+    conn = sqlite3.connect(path or DATABASE_PATH, timeout=SQLITE_BUSY_TIMEOUT / 1000)
+    # WAL lets readers run alongside a writer; NORMAL sync is safe with WAL
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT}')
+    conn.execute(f'PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_SIZE}')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    return conn
+
+def get_connection(path=None):
+    """Get this thread's connection to the database, opening it on first use.
+    
+    Connections are kept open for the life of the thread instead of being
+    opened per query. Use it as a context manager to commit on success and
+    roll back on error.
+    """
+    path = path or DATABASE_PATH
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(path)
+    if conn is None:
+        conn = connections[path] = connect(path)
+    return conn
+
+def close_connection(path=None):
+    """Close this thread's connection to the database, if it has one."""
+    connections = getattr(_local, 'connections', {})
+    conn = connections.pop(path or DATABASE_PATH, None)
+    if conn is not None:
+        conn.close()
+
 def init_db():
-    conn = sqlite3.connect('video_analysis.db')
-    c = conn.cursor()
-    
-    # Create table for video analysis results
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS video_analysis (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            video_id TEXT NOT NULL,
-            video_url TEXT NOT NULL,
-            video_info TEXT,
-            summary TEXT,
-            key_points TEXT,
-            fact_check TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+    with get_connection() as conn:
+        c = conn.cursor()
+        
+        # Create table for video analysis results
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS video_analysis (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                video_id TEXT NOT NULL,
+                video_url TEXT NOT NULL,
+                video_info TEXT,
+                summary TEXT,
+                key_points TEXT,
+                fact_check TEXT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                transcript TEXT
+            )
+        ''')
+        
+        # Databases created before the transcript column existed need it added
+        c.execute('PRAGMA table_info(video_analysis)')
+        existing_columns = [row[1] for row in c.fetchall()]
+        if 'transcript' not in existing_columns:
+            c.execute('ALTER TABLE video_analysis ADD COLUMN transcript TEXT')
+        
+        # One row per video: re-analyses replace the previous row. Databases
+        # from before this kept every analysis, so keep only the latest.
+        c.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_video_analysis_video_id'")
+        if not c.fetchone():
+            c.execute('''
+                DELETE FROM video_analysis WHERE id NOT IN (
+                    SELECT MAX(id) FROM video_analysis GROUP BY video_id
+                )
+            ''')
+            if c.rowcount:
+                print(f"Removed {c.rowcount} superseded analyses")
+            c.execute('CREATE UNIQUE INDEX idx_video_analysis_video_id ON video_analysis (video_id)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_video_analysis_timestamp ON video_analysis (timestamp)')
+        
+        # One row per fact-checked claim of each stored analysis, for querying claims directly
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS fact_check_claims (
+                video_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                timestamp TEXT,
+                timestamp_range TEXT,
+                claim TEXT,
+                status TEXT,
+                explanation TEXT,
+                reference_list TEXT,
+                PRIMARY KEY (video_id, position)
+            )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_fact_check_claims_status ON fact_check_claims (status)')
+        
+        # LLM results per task and transcript fingerprint (a 2-minute chunk for
+        # fact checks, the whole transcript for other tasks), reused when a
+        # video is re-analyzed
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS task_results (
+                video_id TEXT NOT NULL,
+                task TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                result BLOB,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (video_id, task, fingerprint)
+            )
+        ''')
+        
+        # Fact-checked claims shared across videos. Near-identical claims are
+        # merged into one row, found through the MinHash LSH buckets in claim_buckets.
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS known_claims (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                claim TEXT NOT NULL,
+                anchors TEXT NOT NULL,
+                signature BLOB NOT NULL,
+                status TEXT,
+                explanation TEXT,
+                reference_list TEXT,
+                seen_count INTEGER NOT NULL DEFAULT 1,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # Transcript passages known claims were found in
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS claim_passages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                claim_id INTEGER NOT NULL,
+                anchors TEXT NOT NULL,
+                signature BLOB NOT NULL
+            )
+        ''')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS claim_buckets (
+                kind TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                item_id INTEGER NOT NULL,
+                PRIMARY KEY (kind, bucket, item_id)
+            ) WITHOUT ROWID
+        ''')
+        
+        # Create table for fetched transcripts, keyed by video and requested language
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS transcripts (
+                video_id TEXT NOT NULL,
+                requested_language TEXT NOT NULL DEFAULT '',
+                language_code TEXT,
+                is_generated INTEGER,
+                transcript TEXT NOT NULL,
+                fetched_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                last_accessed DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (video_id, requested_language)
+            )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_transcripts_last_accessed ON transcripts (last_accessed)')
+        
+        # Create table for queued analysis jobs
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                video_id TEXT NOT NULL,
+                video_url TEXT NOT NULL,
+                force_refresh INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL DEFAULT 3,
+                error TEXT,
+                result TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                available_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                started_at DATETIME,
+                finished_at DATETIME,
+                heartbeat_at DATETIME
+            )
+        ''')
+        # Databases created before workers sent heartbeats need the column added
+        c.execute('PRAGMA table_info(jobs)')
+        if 'heartbeat_at' not in [row[1] for row in c.fetchall()]:
+            c.execute('ALTER TABLE jobs ADD COLUMN heartbeat_at DATETIME')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_available ON jobs (status, available_at)')
     
-    conn.commit()
-    conn.close()
+    # Refresh the query planner's statistics for the new indexes
+    get_connection().execute('PRAGMA optimize')
 
-def save_analysis(video_id, video_url, video_info, summary, key_points, fact_check):
-    conn = sqlite3.connect('video_analysis.db')
-    c = conn.cursor()
+def save_analysis(video_id, video_url, video_info, summary, key_points, fact_check, transcript=None):
+    """Store the analysis for a video, replacing any earlier one.
     
-    # Convert dictionaries to JSON strings for storage
-    video_info_json = json.dumps(video_info) if video_info else None
-    fact_check_json = json.dumps(fact_check) if fact_check else None
-    key_points_json = json.dumps(key_points) if key_points else None
+    JSON payloads are stored compressed and the transcript in columnar form.
+    Each fact-checked claim also gets a row in fact_check_claims.
+    """
+    video_info_data = pack_json(video_info) if video_info else None
+    summary_data = pack_json(summary) if summary else None
+    fact_check_data = pack_json(fact_check) if fact_check else None
+    key_points_data = pack_json(key_points) if key_points else None
+    transcript_data = pack_transcript(transcript) if transcript else None
     
-    c.execute('''
-        INSERT INTO video_analysis 
-        (video_id, video_url, video_info, summary, key_points, fact_check)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (video_id, video_url, video_info_json, summary, key_points_json, fact_check_json))
+    claims = [
+        (video_id, position, result.get('timestamp'), result.get('timestamp_range'), result.get('claim'),
+         result.get('status'), result.get('explanation'), json.dumps(result.get('references') or []))
+        for position, result in enumerate((fact_check or {}).get('results', []))
+    ]
     
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        conn.execute('''
+            INSERT INTO video_analysis 
+            (video_id, video_url, video_info, summary, key_points, fact_check, transcript)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (video_id) DO UPDATE SET
+                video_url = excluded.video_url,
+                video_info = excluded.video_info,
+                summary = excluded.summary,
+                key_points = excluded.key_points,
+                fact_check = excluded.fact_check,
+                transcript = excluded.transcript,
+                timestamp = CURRENT_TIMESTAMP
+        ''', (video_id, video_url, video_info_data, summary_data, key_points_data, fact_check_data, transcript_data))
+        
+        conn.execute('DELETE FROM fact_check_claims WHERE video_id = ?', (video_id,))
+        conn.executemany('''
+            INSERT INTO fact_check_claims
+            (video_id, position, timestamp, timestamp_range, claim, status, explanation, reference_list)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', claims)
 
-def get_analysis(video_id):
-    conn = sqlite3.connect('video_analysis.db')
-    c = conn.cursor()
+def get_analysis(video_id, max_age=None):
+    """Get the stored analysis for a video.
+    
+    If max_age (in seconds) is given, an analysis older than that is ignored.
+    """
+    columns = ['id', 'video_id', 'video_url', 'video_info', 'summary', 'key_points', 'fact_check', 'timestamp', 'transcript']
+    query = f"SELECT {', '.join(columns)} FROM video_analysis WHERE video_id = ?"
+    params = [video_id]
+    if max_age is not None:
+        query += " AND timestamp >= datetime('now', ?)"
+        params.append(f'-{int(max_age)} seconds')
     
-    c.execute('SELECT * FROM video_analysis WHERE video_id = ?', (video_id,))
-    result = c.fetchone()
+    result = get_connection().execute(query, params).fetchone()
     
     if result:
         # Convert row to dictionary
-        columns = ['id', 'video_id', 'video_url', 'video_info', 'summary', 'key_points', 'fact_check', 'timestamp']
         analysis = dict(zip(columns, result))
         
-        # Parse JSON strings back to dictionaries
-        if analysis['video_info']:
-            analysis['video_info'] = json.loads(analysis['video_info'])
-        if analysis['fact_check']:
-            analysis['fact_check'] = json.loads(analysis['fact_check'])
-        if analysis['key_points']:
-            analysis['key_points'] = json.loads(analysis['key_points'])
+        # Unpack stored payloads
+        for field in ['video_info', 'summary', 'key_points', 'fact_check']:
+            if analysis[field]:
+                try:
+                    analysis[field] = unpack_json(analysis[field])
+                except json.JSONDecodeError:
+                    # Older rows stored the summary as plain text
+                    pass
+        if analysis['transcript']:
+            analysis['transcript'] = unpack_transcript(analysis['transcript'])
             
         return analysis
     
     return None
+
+def delete_analysis(video_id):
+    """Delete the stored analysis for a video. Returns the number of rows removed."""
+    with get_connection() as conn:
+        conn.execute('DELETE FROM fact_check_claims WHERE video_id = ?', (video_id,))
+        conn.execute('DELETE FROM task_results WHERE video_id = ?', (video_id,))
+        return conn.execute('DELETE FROM video_analysis WHERE video_id = ?', (video_id,)).rowcount
+
+def get_task_results(video_id, task):
+    """Stored results of a task for a video, as {fingerprint: result}."""
+    rows = get_connection().execute(
+        'SELECT fingerprint, result FROM task_results WHERE video_id = ? AND task = ?', (video_id, task)
+    ).fetchall()
+    return {fingerprint: unpack_json(result) for fingerprint, result in rows}
+
+def save_task_results(video_id, task, results, keep=None):
+    """Store results of a task for a video, given as {fingerprint: result}.
+    
+    If keep is given, the video's other results for the task whose
+    fingerprints are not in keep are deleted.
+    """
+    with get_connection() as conn:
+        conn.executemany('''
+            INSERT INTO task_results (video_id, task, fingerprint, result)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (video_id, task, fingerprint) DO UPDATE SET
+                result = excluded.result,
+                created_at = CURRENT_TIMESTAMP
+        ''', [(video_id, task, fingerprint, pack_json(result)) for fingerprint, result in results.items()])
+        
+        if keep is not None:
+            stored = [row[0] for row in conn.execute(
+                'SELECT fingerprint FROM task_results WHERE video_id = ? AND task = ?', (video_id, task)
+            )]
+            keep = set(keep)
+            conn.executemany(
+                'DELETE FROM task_results WHERE video_id = ? AND task = ? AND fingerprint = ?',
+                [(video_id, task, fingerprint) for fingerprint in stored if fingerprint not in keep]
+            )
+
+def find_fact_check_claims(video_id=None, status=None, limit=100):
+    """Query stored fact-checked claims, optionally for one video and/or with one status."""
+    query = '''
+        SELECT video_id, position, timestamp, timestamp_range, claim, status, explanation, reference_list
+        FROM fact_check_claims
+    '''
+    conditions = []
+    params = []
+    if video_id:
+        conditions.append('video_id = ?')
+        params.append(video_id)
+    if status:
+        conditions.append('status = ?')
+        params.append(status)
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY video_id, position LIMIT ?'
+    params.append(limit)
+    
+    claims = []
+    for row in get_connection().execute(query, params):
+        video_id, position, timestamp, timestamp_range, claim, status, explanation, references = row
+        claims.append({
+            'video_id': video_id,
+            'timestamp': timestamp,
+            'timestamp_range': timestamp_range,
+            'claim': claim,
+            'status': status,
+            'explanation': explanation,
+            'references': json.loads(references) if references else []
+        })
+    return claims
+
+# Bucket lookups are split into batches to stay under SQLite's variable limit
+CLAIM_BUCKET_BATCH_SIZE = 500
+
+def _find_bucket_items(kind, buckets, select):
+    """Rows of select joined to the items in any of the given LSH buckets, as (bucket, ...) tuples."""
+    buckets = list(buckets)
+    conn = get_connection()
+    rows = []
+    for i in range(0, len(buckets), CLAIM_BUCKET_BATCH_SIZE):
+        batch = buckets[i:i + CLAIM_BUCKET_BATCH_SIZE]
+        rows.extend(conn.execute(
+            select.format(placeholders=', '.join('?' * len(batch))), [kind] + batch
+        ))
+    return rows
+
+def find_claim_candidates(buckets):
+    """Known claims sharing an LSH bucket with a claim, as (id, anchors, signature, status) tuples."""
+    rows = _find_bucket_items('claim', buckets, '''
+        SELECT DISTINCT k.id, k.anchors, k.signature, k.status
+        FROM claim_buckets b JOIN known_claims k ON k.id = b.item_id
+        WHERE b.kind = ? AND b.bucket IN ({placeholders})
+    ''')
+    return list(rows)
+
+def find_passage_candidates(buckets):
+    """Claim passages in any of the given LSH buckets, with the claim each belongs to.
+    
+    Returns {bucket: [(passage id, anchors, signature, claim), ...]} with
+    claim a dict of the known claim's id, claim, status, explanation and
+    references.
+    """
+    rows = _find_bucket_items('passage', buckets, '''
+        SELECT b.bucket, p.id, p.anchors, p.signature,
+               k.id, k.claim, k.status, k.explanation, k.reference_list
+        FROM claim_buckets b
+        JOIN claim_passages p ON p.id = b.item_id
+        JOIN known_claims k ON k.id = p.claim_id
+        WHERE b.kind = ? AND b.bucket IN ({placeholders})
+    ''')
+    candidates = {}
+    for bucket, passage_id, anchors, signature, claim_id, claim, status, explanation, references in rows:
+        candidates.setdefault(bucket, []).append((passage_id, anchors, signature, {
+            'id': claim_id,
+            'claim': claim,
+            'status': status,
+            'explanation': explanation,
+            'references': json.loads(references) if references else []
+        }))
+    return candidates
+
+def save_known_claim(claim, anchors, signature, buckets, status, explanation, references):
+    """Store a newly seen claim and its LSH buckets. Returns its id."""
+    with get_connection() as conn:
+        claim_id = conn.execute('''
+            INSERT INTO known_claims (claim, anchors, signature, status, explanation, reference_list)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (claim, anchors, signature, status, explanation, references)).lastrowid
+        conn.executemany(
+            "INSERT OR IGNORE INTO claim_buckets (kind, bucket, item_id) VALUES ('claim', ?, ?)",
+            [(bucket, claim_id) for bucket in buckets]
+        )
+    return claim_id
+
+def add_claim_sighting(claim_id, verdict=None):
+    """Count another sighting of a known claim, replacing its verdict if one is given.
+    
+    verdict is a (status, explanation, references) tuple.
+    """
+    with get_connection() as conn:
+        if verdict is None:
+            conn.execute(
+                'UPDATE known_claims SET seen_count = seen_count + 1 WHERE id = ?', (claim_id,)
+            )
+        else:
+            conn.execute('''
+                UPDATE known_claims SET
+                    seen_count = seen_count + 1,
+                    status = ?, explanation = ?, reference_list = ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (*verdict, claim_id))
+
+def save_claim_passage(claim_id, anchors, signature, buckets):
+    """Store a transcript passage a known claim was found in, and its LSH buckets."""
+    with get_connection() as conn:
+        passage_id = conn.execute(
+            'INSERT INTO claim_passages (claim_id, anchors, signature) VALUES (?, ?, ?)',
+            (claim_id, anchors, signature)
+        ).lastrowid
+        conn.executemany(
+            "INSERT OR IGNORE INTO claim_buckets (kind, bucket, item_id) VALUES ('passage', ?, ?)",
+            [(bucket, passage_id) for bucket in buckets]
+        )
+
+def claim_store_stats():
+    """Number of known claims and of the passages they were found in."""
+    conn = get_connection()
+    return {
+        'claims': conn.execute('SELECT COUNT(*) FROM known_claims').fetchone()[0],
+        'passages': conn.execute('SELECT COUNT(*) FROM claim_passages').fetchone()[0]
+    }
+
+def save_transcript(video_id, transcript, language_code=None, is_generated=None, requested_language=None, max_rows=None):
+    """Store a fetched transcript, evicting the least recently used rows beyond max_rows."""
+    with get_connection() as conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO transcripts
+            (video_id, requested_language, language_code, is_generated, transcript, fetched_at, last_accessed)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+        ''', (video_id, requested_language or '', language_code,
+              None if is_generated is None else int(is_generated), pack_transcript(transcript)))
+        
+        if max_rows:
+            conn.execute('''
+                DELETE FROM transcripts WHERE rowid IN (
+                    SELECT rowid FROM transcripts ORDER BY last_accessed DESC LIMIT -1 OFFSET ?
+                )
+            ''', (max_rows,))
+
+def get_stored_transcript(video_id, requested_language=None, max_age=None):
+    """Get a stored transcript with the language and track it was fetched from."""
+    query = '''
+        SELECT language_code, is_generated, transcript, fetched_at
+        FROM transcripts WHERE video_id = ? AND requested_language = ?
+    '''
+    params = [video_id, requested_language or '']
+    if max_age is not None:
+        query += " AND fetched_at >= datetime('now', ?)"
+        params.append(f'-{int(max_age)} seconds')
+    
+    with get_connection() as conn:
+        result = conn.execute(query, params).fetchone()
+        
+        if result:
+            conn.execute('''
+                UPDATE transcripts SET last_accessed = CURRENT_TIMESTAMP
+                WHERE video_id = ? AND requested_language = ?
+            ''', (video_id, requested_language or ''))
+    
+    if result:
+        language_code, is_generated, transcript_data, fetched_at = result
+        return {
+            'video_id': video_id,
+            'language_code': language_code,
+            'is_generated': None if is_generated is None else bool(is_generated),
+            'transcript': unpack_transcript(transcript_data),
+            'fetched_at': fetched_at
+        }
+    
+    return None
+
+def delete_stored_transcript(video_id):
+    """Delete all stored transcripts for a video. Returns the number of rows removed."""
+    with get_connection() as conn:
+        return conn.execute('DELETE FROM transcripts WHERE video_id = ?', (video_id,)).rowcount
+
+JOB_COLUMNS = ['id', 'video_id', 'video_url', 'force_refresh', 'status', 'attempts', 'max_attempts',
+               'error', 'result', 'created_at', 'available_at', 'started_at', 'finished_at']
+
+def _job_from_row(row):
+    job = dict(zip(JOB_COLUMNS, row))
+    job['force_refresh'] = bool(job['force_refresh'])
+    if job['result']:
+        job['result'] = unpack_json(job['result'])
+    return job
+
+def create_job(job_id, video_id, video_url, force_refresh=False, max_attempts=3):
+    with get_connection() as conn:
+        conn.execute('''
+            INSERT INTO jobs (id, video_id, video_url, force_refresh, max_attempts)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (job_id, video_id, video_url, int(force_refresh), max_attempts))
+
+def get_job(job_id):
+    row = get_connection().execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return _job_from_row(row) if row else None
+
+def claim_next_job():
+    """Atomically mark the oldest available queued job as running and return it."""
+    with get_connection() as conn:
+        row = conn.execute(f'''
+            UPDATE jobs
+            SET status = 'running', attempts = attempts + 1, started_at = CURRENT_TIMESTAMP,
+                heartbeat_at = CURRENT_TIMESTAMP
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE status = 'queued' AND available_at <= CURRENT_TIMESTAMP
+                ORDER BY created_at
+                LIMIT 1
+            ) AND status = 'queued'
+            RETURNING {', '.join(JOB_COLUMNS)}
+        ''').fetchone()
+    
+    return _job_from_row(row) if row else None
+
+def complete_job(job_id, result):
+    with get_connection() as conn:
+        conn.execute('''
+            UPDATE jobs
+            SET status = 'succeeded', result = ?, error = NULL, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (pack_json(result), job_id))
+
+def fail_job(job_id, error, retry_delay=None):
+    """Record a job failure, requeueing it after retry_delay seconds if it has attempts left."""
+    with get_connection() as conn:
+        if retry_delay is not None:
+            conn.execute('''
+                UPDATE jobs
+                SET status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+                    available_at = datetime('now', ?),
+                    finished_at = CASE WHEN attempts < max_attempts THEN NULL ELSE CURRENT_TIMESTAMP END,
+                    error = ?
+                WHERE id = ?
+            ''', (f'+{int(retry_delay)} seconds', error, job_id))
+        else:
+            conn.execute('''
+                UPDATE jobs SET status = 'failed', error = ?, finished_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (error, job_id))
+
+def retry_job(job_id):
+    """Requeue a failed job with a fresh set of attempts. Returns False if it wasn't failed."""
+    with get_connection() as conn:
+        updated = conn.execute('''
+            UPDATE jobs
+            SET status = 'queued', attempts = 0, available_at = CURRENT_TIMESTAMP,
+                started_at = NULL, finished_at = NULL
+            WHERE id = ? AND status = 'failed'
+        ''', (job_id,)).rowcount
+    
+    return updated > 0
+
+def heartbeat_job(job_id):
+    """Record that a running job's worker is still working on it."""
+    with get_connection() as conn:
+        conn.execute(
+            "UPDATE jobs SET heartbeat_at = CURRENT_TIMESTAMP WHERE id = ? AND status = 'running'", (job_id,)
+        )
+
+def requeue_stale_jobs(older_than):
+    """Put running jobs whose worker hasn't sent a heartbeat for older_than seconds back on the queue.
+    
+    These were claimed by a worker that died or was restarted. Jobs that
+    have used up their attempts are failed instead, so a job that keeps
+    killing its worker isn't retried forever.
+    """
+    with get_connection() as conn:
+        return conn.execute('''
+            UPDATE jobs
+            SET status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+                available_at = CURRENT_TIMESTAMP,
+                finished_at = CASE WHEN attempts < max_attempts THEN NULL ELSE CURRENT_TIMESTAMP END,
+                error = CASE WHEN attempts < max_attempts THEN error ELSE 'Job was still running when its worker stopped' END
+            WHERE status = 'running' AND COALESCE(heartbeat_at, started_at) < datetime('now', ?)
+        ''', (f'-{int(older_than)} seconds',)).rowcount
+
+def count_jobs_by_status():
+    rows = get_connection().execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+    return dict(rows)
@@ -0,0 +1,65 @@
+import os
+
+import httpx
+
+# Connection pool settings. HTTP_POOL_SIZE is the number of keep-alive
+# connections kept per host and should be at least the number of upstream
+# calls usually in flight at once.
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 16))
+HTTP_POOL_HOSTS = int(os.getenv('HTTP_POOL_HOSTS', 8))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 120))
+
+# HTTP/2 needs the optional h2 package (pip install httpx[http2])
+HTTP2_ENABLED = os.getenv('HTTP2_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+
+# The async client belongs to the pipeline event loop that first uses it
+_async_client = None
+
+
+def create_async_client():
+    """Create a pooled, keep-alive async HTTP client."""
+    limits = httpx.Limits(
+        max_connections=HTTP_POOL_SIZE * HTTP_POOL_HOSTS,
+        max_keepalive_connections=HTTP_POOL_SIZE
+    )
+    timeout = httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+    if HTTP2_ENABLED:
+        try:
+            return httpx.AsyncClient(http2=True, limits=limits, timeout=timeout)
+        except ImportError:
+            print("HTTP2_ENABLED is set but the h2 package is not installed, falling back to HTTP/1.1")
+    return httpx.AsyncClient(limits=limits, timeout=timeout)
+
+
+def get_async_client():
+    """Get the shared async HTTP client. Must be called from the pipeline event loop."""
+    global _async_client
+    if _async_client is None:
+        _async_client = create_async_client()
+    return _async_client
+
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+async def async_http_request(method, url, timeout=None, **kwargs):
+    """Send a request over the shared async client."""
+    client = get_async_client()
+    if isinstance(timeout, tuple):
+        timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+    if timeout is not None:
+        kwargs['timeout'] = timeout
+    return await client.request(method, url, **kwargs)
+
+
+async def async_http_get(url, **kwargs):
+    return await async_http_request('GET', url, **kwargs)
+
+
+async def async_http_post(url, **kwargs):
+    return await async_http_request('POST', url, **kwargs)
@@ -0,0 +1,165 @@
+import asyncio
+import bisect
+import hashlib
+import os
+
+import numpy as np
+
+from database import get_task_results, save_task_results
+from metrics import record_cache
+from utils import (
+    FACT_CHECK_CHUNK_SECONDS,
+    FACT_CHECK_CONCURRENCY,
+    GEMINI_MODEL,
+    LLM_PROMPTS,
+    analyze_with_llm_async,
+    fact_check_group_async,
+    group_chunks,
+    merge_fact_check_results,
+    parse_timestamp
+)
+
+# Reuse stored results for the parts of a transcript (and the tasks) that
+# haven't changed when a video is re-analyzed
+INCREMENTAL_ANALYSIS = os.getenv('INCREMENTAL_ANALYSIS', 'true').lower() == 'true'
+
+
+def fingerprint(task, transcript):
+    """Hash of everything that determines a task's result for a transcript or part of one.
+
+    Covers the model, the task's prompt, and the text and timing of every
+    segment, so editing a prompt or re-timing a segment changes it too.
+    """
+    return transcript_fingerprint(transcript, prefix=f"{GEMINI_MODEL}\0{task}\0{LLM_PROMPTS[task]}\0")
+
+
+def transcript_fingerprint(transcript, prefix=''):
+    """Hash of the text and timing of every segment of a transcript, after prefix."""
+    digest = hashlib.sha256(prefix.encode('utf-8'))
+    digest.update(transcript.starts.tobytes())
+    digest.update(transcript.durations.tobytes())
+    for text in transcript.texts:
+        digest.update(text.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def chunk_fingerprints(transcript):
+    """(chunk bounds, fingerprints) of the 2-minute chunks a transcript is fact-checked in."""
+    bounds = transcript.chunk_bounds(FACT_CHECK_CHUNK_SECONDS)
+    return bounds, [fingerprint('fact_check', transcript[start:end]) for start, end in bounds]
+
+
+def consecutive_runs(indexes):
+    """Group sorted indexes into (first, last) runs of consecutive values."""
+    runs = []
+    for index in indexes:
+        if runs and runs[-1][1] == index - 1:
+            runs[-1][1] = index
+        else:
+            runs.append([index, index])
+    return runs
+
+
+def split_by_chunk(fact_check, chunk_starts):
+    """Assign each fact-check result to the chunk its timestamp falls in.
+
+    chunk_starts are the chunks' start times in seconds. Results without a
+    usable timestamp go to the first chunk.
+    """
+    # Timestamps are whole seconds, so compare against whole-second chunk starts
+    starts = np.floor(chunk_starts).tolist()
+    per_chunk = [[] for _ in starts]
+    for result in (fact_check or {}).get('results', []):
+        seconds = parse_timestamp(result.get('timestamp', ''))
+        index = 0 if seconds is None else max(0, bisect.bisect_right(starts, seconds) - 1)
+        per_chunk[index].append(result)
+    return [{'results': results} for results in per_chunk]
+
+
+async def load_task_results(video_id, task):
+    try:
+        return await asyncio.to_thread(get_task_results, video_id, task)
+    except Exception as e:
+        print(f"Error reading stored {task} results: {str(e)}")
+        return {}
+
+
+async def fact_check_incrementally(video_id, transcript, force_refresh=False):
+    """Fact-check only the chunks without a stored result, and merge them with the rest.
+
+    New results are stored per chunk, and results for chunks that are no
+    longer in the transcript are dropped. With force_refresh every chunk
+    is checked again and its stored result replaced.
+    """
+    bounds, fingerprints = chunk_fingerprints(transcript)
+    stored = {} if force_refresh else await load_task_results(video_id, 'fact_check')
+    missing = [i for i, value in enumerate(fingerprints) if value not in stored]
+    record_cache('analysis_chunks', True, len(bounds) - len(missing))
+    record_cache('analysis_chunks', False, len(missing))
+    if stored:
+        print(f"Reusing fact checks for {len(bounds) - len(missing)} of {len(bounds)} chunks")
+
+    # Runs of changed chunks are grouped into calls the same way a full
+    # transcript is, keeping the chunks (and fingerprints) found above
+    groups = []
+    for first, last in consecutive_runs(missing):
+        groups.extend([first + i for i in group] for group in group_chunks(transcript, bounds[first:last + 1]))
+
+    semaphore = asyncio.Semaphore(FACT_CHECK_CONCURRENCY)
+    new_results = {}
+
+    async def check(chunks):
+        group = transcript[bounds[chunks[0]][0]:bounds[chunks[-1]][1]]
+        try:
+            async with semaphore:
+                result = await fact_check_group_async(group, video_id, force_refresh)
+        except Exception as e:
+            print(f"Error fact-checking chunks {chunks[0] + 1}-{chunks[-1] + 1}: {str(e)}")
+            result = None
+        if result is None:
+            # Left unstored, so the next analysis tries these chunks again
+            return
+        chunk_results = split_by_chunk(result, transcript.starts[[bounds[i][0] for i in chunks]])
+        for i, chunk_result in zip(chunks, chunk_results):
+            new_results[fingerprints[i]] = chunk_result
+
+    await asyncio.gather(*(check(chunks) for chunks in groups))
+
+    if new_results or force_refresh or set(stored) - set(fingerprints):
+        try:
+            await asyncio.to_thread(save_task_results, video_id, 'fact_check', new_results, keep=fingerprints)
+        except Exception as e:
+            print(f"Error storing fact-check chunks: {str(e)}")
+
+    return merge_fact_check_results([stored.get(value) or new_results.get(value) for value in fingerprints])
+
+
+async def analyze_task_incrementally(video_id, transcript, task, force_refresh=False):
+    """Run a whole-transcript task, reusing the stored result if the transcript hasn't changed."""
+    key = fingerprint(task, transcript)
+    stored = {} if force_refresh else await load_task_results(video_id, task)
+    record_cache('analysis_tasks', key in stored)
+    if key in stored:
+        print(f"Transcript unchanged, reusing stored {task} result")
+        return stored[key]
+
+    result = await analyze_with_llm_async(transcript, task, video_id=video_id, force_refresh=force_refresh)
+    if result:
+        try:
+            await asyncio.to_thread(save_task_results, video_id, task, {key: result}, keep=[key])
+        except Exception as e:
+            print(f"Error storing {task} result: {str(e)}")
+    return result
+
+
+async def analyze_incrementally(video_id, transcript, task, force_refresh=False):
+    """Run an analysis task for a video, recomputing only what changed since it was last run.
+
+    force_refresh recomputes everything, then stores the new results.
+    """
+    if not INCREMENTAL_ANALYSIS:
+        return await analyze_with_llm_async(transcript, task, video_id=video_id, force_refresh=force_refresh)
+    if task == 'fact_check':
+        return await fact_check_incrementally(video_id, transcript, force_refresh)
+    return await analyze_task_incrementally(video_id, transcript, task, force_refresh)
@@ -0,0 +1,129 @@
+import os
+import threading
+import traceback
+import uuid
+
+from database import (
+    create_job,
+    claim_next_job,
+    complete_job,
+    fail_job,
+    heartbeat_job,
+    retry_job,
+    requeue_stale_jobs,
+    count_jobs_by_status
+)
+from pipeline import run_sync
+from analysis import AnalysisError, run_analysis
+
+# Number of analyses the job workers run at once, independent of web concurrency
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+JOB_RETRY_DELAY = int(os.getenv('JOB_RETRY_DELAY', 30))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 2))
+# Workers record a heartbeat this often (in seconds) while a job runs
+JOB_HEARTBEAT_INTERVAL = float(os.getenv('JOB_HEARTBEAT_INTERVAL', 30))
+# Running jobs without a heartbeat for this long are assumed orphaned by a dead worker and requeued
+JOB_STALE_AFTER = int(os.getenv('JOB_STALE_AFTER', 15 * 60))
+
+_wakeup = threading.Event()
+_workers = []
+_workers_started = False
+_workers_lock = threading.Lock()
+
+
+def submit_job(video_id, video_url, force_refresh=False):
+    """Queue an analysis job and return its ID."""
+    job_id = uuid.uuid4().hex
+    create_job(job_id, video_id, video_url, force_refresh=force_refresh, max_attempts=JOB_MAX_ATTEMPTS)
+    _wakeup.set()
+    print(f"Queued job {job_id} for video ID: {video_id}")
+    return job_id
+
+
+def retry_failed_job(job_id):
+    """Requeue a failed job. Returns False if the job isn't in the failed state."""
+    retried = retry_job(job_id)
+    if retried:
+        _wakeup.set()
+    return retried
+
+
+def send_heartbeats(job_id, stop):
+    """Record a heartbeat for a job every JOB_HEARTBEAT_INTERVAL seconds until stop is set."""
+    while not stop.wait(JOB_HEARTBEAT_INTERVAL):
+        try:
+            heartbeat_job(job_id)
+        except Exception as e:
+            print(f"Error recording heartbeat for job {job_id}: {str(e)}")
+
+
+def run_job(job):
+    """Run one claimed job and record its outcome."""
+    print(f"Running job {job['id']} (attempt {job['attempts']}/{job['max_attempts']}) for video ID: {job['video_id']}")
+    # Heartbeats keep a long analysis from being mistaken for one whose worker died
+    stop_heartbeats = threading.Event()
+    threading.Thread(
+        target=send_heartbeats, args=(job['id'], stop_heartbeats), name=f"job-heartbeat-{job['id']}", daemon=True
+    ).start()
+    try:
+        result = run_sync(run_analysis(job['video_id'], job['video_url'], job['force_refresh']))
+    except Exception as e:
+        print(f"Error in job {job['id']}: {str(e)}")
+        print(traceback.format_exc())
+        if isinstance(e, AnalysisError) and e.permanent:
+            # Retrying won't help, e.g. the video has no transcript
+            fail_job(job['id'], str(e))
+        else:
+            # Back off linearly with each attempt before the job is picked up again
+            fail_job(job['id'], str(e), retry_delay=JOB_RETRY_DELAY * job['attempts'])
+        return
+    finally:
+        stop_heartbeats.set()
+    
+    complete_job(job['id'], result)
+    print(f"Job {job['id']} succeeded")
+
+
+def worker_loop():
+    while True:
+        try:
+            job = claim_next_job()
+        except Exception as e:
+            print(f"Error claiming job: {str(e)}")
+            job = None
+        
+        if job is None:
+            _wakeup.wait(JOB_POLL_INTERVAL)
+            _wakeup.clear()
+            try:
+                requeue_stale_jobs(JOB_STALE_AFTER)
+            except Exception as e:
+                print(f"Error requeueing stale jobs: {str(e)}")
+            continue
+        
+        run_job(job)
+
+
+def start_job_workers(count=None):
+    """Start the background job workers once per process."""
+    global _workers_started
+    if _workers_started:
+        return
+    count = JOB_WORKERS if count is None else count
+    with _workers_lock:
+        if _workers_started:
+            return
+        _workers_started = True
+        for i in range(count):
+            worker = threading.Thread(target=worker_loop, name=f'job-worker-{i}', daemon=True)
+            worker.start()
+            _workers.append(worker)
+    print(f"Started {count} job workers")
+
+
+def job_stats():
+    return {
+        'workers': len(_workers),
+        'jobs': count_jobs_by_status()
+    }
@@ -0,0 +1,235 @@
+import contextvars
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Add a Server-Timing header with the time spent in each stage to API responses
+SERVER_TIMING_ENABLED = os.getenv('SERVER_TIMING_ENABLED', 'false').lower() == 'true'
+
+METRIC_PREFIX = 'video_analysis_'
+
+# Histogram buckets for stage timings, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in labels) + '}'
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """A value that only goes up, kept separately for each combination of labels."""
+
+    type = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = METRIC_PREFIX + name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple((name, labels.get(name, '')) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in sorted(self._values.items())]
+
+
+class Gauge:
+    """A value read when metrics are collected.
+
+    func returns either a number or a dict of {label value: number} for a
+    gauge with a single label.
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, help_text, func, labelname=None):
+        self.name = METRIC_PREFIX + name
+        self.help = help_text
+        self.func = func
+        self.labelname = labelname
+
+    def samples(self):
+        try:
+            value = self.func()
+        except Exception as e:
+            print(f"Error reading gauge {self.name}: {str(e)}")
+            return []
+        if isinstance(value, dict):
+            return [(self.name, ((self.labelname, label),), item) for label, item in sorted(value.items())]
+        return [(self.name, (), value)]
+
+
+class Histogram:
+    """Counts observations into cumulative buckets, with their sum and count."""
+
+    type = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DURATION_BUCKETS):
+        self.name = METRIC_PREFIX + name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple((name, labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def totals(self):
+        """{label values: (count, sum)} for every label combination observed."""
+        with self._lock:
+            return {
+                tuple(value for _, value in key): (count, total)
+                for key, (_, total, count) in self._values.items()
+            }
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        samples = []
+        for key, (counts, total, count) in items:
+            for bound, bucket_count in zip(self.buckets, counts):
+                samples.append((self.name + '_bucket', key + (('le', format_value(bound)),), bucket_count))
+            samples.append((self.name + '_sum', key, total))
+            samples.append((self.name + '_count', key, count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def counter(name, help_text, labelnames=()):
+    return registry.register(Counter(name, help_text, labelnames))
+
+
+def histogram(name, help_text, labelnames=(), buckets=DURATION_BUCKETS):
+    return registry.register(Histogram(name, help_text, labelnames, buckets))
+
+
+def gauge(name, help_text, func, labelname=None):
+    return registry.register(Gauge(name, help_text, func, labelname))
+
+
+stage_seconds = histogram('stage_duration_seconds', 'Time spent in each stage of a request', ['stage'])
+http_requests = counter('http_requests_total', 'API requests handled', ['endpoint', 'method', 'status'])
+http_request_seconds = histogram('http_request_duration_seconds', 'Time to produce an API response', ['endpoint'])
+cache_requests = counter('cache_requests_total', 'Cache lookups', ['cache', 'result'])
+upstream_retries = counter('upstream_retries_total', 'Upstream calls retried after a failure', ['call'])
+upstream_errors = counter('upstream_errors_total', 'Upstream failures seen by circuit breakers', ['upstream'])
+circuit_rejections = counter('circuit_rejections_total', 'Calls failed fast by an open circuit breaker', ['upstream'])
+llm_requests = counter('llm_requests_total', 'Requests answered by Gemini', ['task'])
+llm_tokens = counter('llm_tokens_total', 'Tokens reported in Gemini usageMetadata', ['task', 'kind'])
+
+
+class RequestTimings:
+    """Time spent in each stage while serving one request, for its Server-Timing header."""
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def header(self):
+        with self._lock:
+            return ', '.join(f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in self.stages.items())
+
+
+# Timings of the request being served. Coroutines submitted to the pipeline
+# loop carry it along with the rest of the caller's context.
+current_timings = contextvars.ContextVar('current_timings', default=None)
+
+
+def record_stage(stage, seconds):
+    stage_seconds.observe(seconds, stage=stage)
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+@contextmanager
+def timed(stage):
+    """Time the enclosed block as a stage. Works around awaits too."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def record_cache(cache, hit, count=1):
+    cache_requests.inc(count, cache=cache, result='hit' if hit else 'miss')
+
+
+def record_llm_usage(task, usage):
+    """Count the tokens Gemini reports having used for a request."""
+    llm_requests.inc(task=task)
+    if not usage:
+        return
+    for kind, field in (('prompt', 'promptTokenCount'), ('cached', 'cachedContentTokenCount'),
+                        ('output', 'candidatesTokenCount'), ('thoughts', 'thoughtsTokenCount'),
+                        ('total', 'totalTokenCount')):
+        if usage.get(field):
+            llm_tokens.inc(usage[field], task=task, kind=kind)
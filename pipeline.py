@@ -0,0 +1,116 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import os
+import threading
+
+# Blocking calls (transcript API, SQLite) made from coroutines run on this
+# many threads. Network calls to Gemini and oEmbed don't use threads at all.
+PIPELINE_BLOCKING_WORKERS = int(os.getenv('PIPELINE_BLOCKING_WORKERS', 32))
+
+_loop = None
+_loop_thread = None
+_blocking_executor = None
+_loop_lock = threading.Lock()
+
+
+def _run_loop(loop):
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+def get_loop():
+    """Get the pipeline event loop, starting it in a background thread on first use."""
+    global _loop, _loop_thread, _blocking_executor
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                _blocking_executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=PIPELINE_BLOCKING_WORKERS,
+                    thread_name_prefix='pipeline-blocking'
+                )
+                loop.set_default_executor(_blocking_executor)
+                _loop_thread = threading.Thread(
+                    target=_run_loop, args=(loop,), name='pipeline-loop', daemon=True
+                )
+                _loop_thread.start()
+                _loop = loop
+    return _loop
+
+
+def submit(coro):
+    """Schedule a coroutine on the pipeline loop and return a concurrent.futures.Future.
+    
+    The coroutine runs in a copy of the caller's context, so context
+    variables set while handling a request (like its stage timings) are
+    seen by the pipeline too.
+    """
+    loop = get_loop()
+    context = contextvars.copy_context()
+    future = concurrent.futures.Future()
+    
+    def start():
+        if not future.set_running_or_notify_cancel():
+            coro.close()
+            return
+        task = loop.create_task(coro, context=context)
+        task.add_done_callback(lambda task: _copy_result(task, future))
+    
+    loop.call_soon_threadsafe(start)
+    return future
+
+
+def _copy_result(task, future):
+    if task.cancelled():
+        future.set_exception(concurrent.futures.CancelledError())
+    elif task.exception() is not None:
+        future.set_exception(task.exception())
+    else:
+        future.set_result(task.result())
+
+
+def run_sync(coro, timeout=None):
+    """Run a coroutine on the pipeline loop and block the calling thread for its result."""
+    return submit(coro).result(timeout)
+
+
+def pending_tasks():
+    """Number of tasks currently scheduled on the pipeline loop."""
+    if _loop is None:
+        return 0
+    return len(asyncio.all_tasks(_loop))
+
+
+def blocking_queue_depth():
+    """Number of blocking calls waiting for a free thread in the pipeline's pool."""
+    if _blocking_executor is None:
+        return 0
+    return _blocking_executor._work_queue.qsize()
+
+
+async def hedged(make_call, delay, hedges=1):
+    """Await make_call(), starting a duplicate call if it hasn't finished after delay seconds.
+    
+    Returns the first successful result and cancels the calls still running.
+    Raises the last error if every call fails.
+    """
+    pending = {asyncio.ensure_future(make_call())}
+    launched = 1
+    error = None
+    try:
+        while pending:
+            timeout = delay if launched <= hedges else None
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+            if not done:
+                print(f"No response after {delay} seconds, sending a hedged request")
+                pending.add(asyncio.ensure_future(make_call()))
+                launched += 1
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,116 @@
+"""Fetch transcripts ahead of demand.
+
+Fills the transcript store so later analyses don't wait on a fetch, and can
+also write the transcripts to an archive for ArchiveTranscriptProvider:
+
+    python prefetch.py VIDEO_URL_OR_ID ... [--file ids.txt] [--archive transcripts.archive]
+"""
+import argparse
+import concurrent.futures
+import os
+import sys
+
+from dotenv import load_dotenv
+
+# Load environment variables before local modules read their settings
+load_dotenv()
+
+from database import init_db, get_stored_transcript
+from transcript_providers import ArchiveTranscriptProvider, write_transcript_archive
+from utils import (
+    TRANSCRIPT_CACHE_TTL,
+    TRANSCRIPT_DB_MAX_ROWS,
+    extract_video_id,
+    fetch_and_store_transcript
+)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('videos', nargs='*', help='YouTube URLs or video IDs')
+    parser.add_argument('--file', help="File with one URL or video ID per line ('-' for stdin)")
+    parser.add_argument('--language', help='Transcript language to fetch (default: the video\'s own)')
+    parser.add_argument('--concurrency', type=int, default=4, help='Transcripts fetched at once')
+    parser.add_argument('--refresh', action='store_true', help='Refetch transcripts that are already stored')
+    parser.add_argument('--archive', help='Also write the transcripts to this archive, keeping what it already holds')
+    return parser.parse_args(argv)
+
+
+def read_video_ids(args):
+    """Video IDs from the arguments and --file, in order and without duplicates."""
+    values = list(args.videos)
+    if args.file:
+        f = sys.stdin if args.file == '-' else open(args.file)
+        with f:
+            values.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    video_ids = []
+    for value in values:
+        video_id = value if len(value) == 11 and '/' not in value else extract_video_id(value)
+        if not video_id:
+            print(f"Skipping {value}: not a YouTube URL or video ID")
+        elif video_id not in video_ids:
+            video_ids.append(video_id)
+    return video_ids
+
+
+def prefetch_one(video_id, language=None, refresh=False):
+    """Make sure a fresh transcript is stored. Returns (record, whether it was fetched)."""
+    if not refresh:
+        record = get_stored_transcript(video_id, language, max_age=TRANSCRIPT_CACHE_TTL)
+        if record:
+            return record, False
+    return fetch_and_store_transcript(video_id, language), True
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    video_ids = read_video_ids(args)
+    if not video_ids:
+        print("No videos to prefetch")
+        return 1
+    if len(video_ids) > TRANSCRIPT_DB_MAX_ROWS:
+        print(f"Warning: only the {TRANSCRIPT_DB_MAX_ROWS} most recently used transcripts are kept "
+              f"(TRANSCRIPT_DB_MAX_ROWS); write an --archive to keep them all")
+
+    init_db()
+    records = {}
+    fetched = stored = failed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = {
+            pool.submit(prefetch_one, video_id, args.language, args.refresh): video_id
+            for video_id in video_ids
+        }
+        for future in concurrent.futures.as_completed(futures):
+            video_id = futures[future]
+            try:
+                record, was_fetched = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"Failed {video_id}: {str(e)}")
+                continue
+            fetched += was_fetched
+            stored += not was_fetched
+            records[video_id] = record
+            print(f"{'Fetched' if was_fetched else 'Already stored'} {video_id} "
+                  f"({len(record['transcript'])} segments)")
+
+    print(f"\nPrefetched {len(video_ids)} videos: {fetched} fetched, {stored} already stored, {failed} failed")
+
+    if args.archive:
+        def archive_records():
+            # Keep what the archive already has, unless it was just fetched again
+            if os.path.exists(args.archive):
+                for video_id, language_code, is_generated, transcript in ArchiveTranscriptProvider(args.archive).records():
+                    if video_id not in records:
+                        yield video_id, language_code, is_generated, transcript
+            for video_id, record in records.items():
+                yield video_id, record['language_code'], record['is_generated'], record['transcript']
+
+        count = write_transcript_archive(args.archive, archive_records())
+        print(f"Wrote {count} transcripts to {args.archive}")
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
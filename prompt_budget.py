@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+
+from transcript_columns import Transcript
+
+# Largest prompt (in estimated tokens) sent to the model in one call
+LLM_PROMPT_TOKEN_BUDGET = int(os.getenv('LLM_PROMPT_TOKEN_BUDGET', 100000))
+# Rough characters per token used for estimates; no tokenizer call is made
+CHARS_PER_TOKEN = float(os.getenv('CHARS_PER_TOKEN', 4))
+# Extra tokens per transcript segment for its timestamp label and line break
+SEGMENT_OVERHEAD_TOKENS = 6
+
+
+def estimate_tokens(text):
+    """Estimate the number of tokens in a string."""
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def estimate_segment_tokens(entry):
+    return estimate_tokens(entry['text']) + SEGMENT_OVERHEAD_TOKENS
+
+
+def estimate_transcript_tokens(transcript):
+    if isinstance(transcript, Transcript):
+        tokens = np.floor(transcript.text_lengths() / CHARS_PER_TOKEN) + 1 + SEGMENT_OVERHEAD_TOKENS
+        return int(tokens.sum())
+    return sum(estimate_segment_tokens(entry) for entry in transcript)
+
+
+def fits_budget(transcript, overhead_tokens=0, budget=None):
+    """Whether a transcript plus fixed prompt overhead fits in the token budget."""
+    budget = LLM_PROMPT_TOKEN_BUDGET if budget is None else budget
+    return estimate_transcript_tokens(transcript) + overhead_tokens <= budget
+
+
+def pack_segments(transcript, budget):
+    """Split consecutive transcript segments into parts of at most budget tokens each.
+
+    A single segment larger than the budget gets a part of its own. Parts
+    are slices of the transcript, which for a Transcript are views.
+    """
+    parts = []
+    part_start = 0
+    part_tokens = 0
+    for i, entry in enumerate(transcript):
+        tokens = estimate_segment_tokens(entry)
+        if i > part_start and part_tokens + tokens > budget:
+            parts.append(transcript[part_start:i])
+            part_start = i
+            part_tokens = 0
+        part_tokens += tokens
+    if part_start < len(transcript):
+        parts.append(transcript[part_start:])
+    return parts
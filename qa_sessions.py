@@ -0,0 +1,255 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
+
+from circuit_breaker import is_upstream_failure
+from metrics import record_cache
+from pipeline import submit
+from prompt_budget import LLM_PROMPT_TOKEN_BUDGET, estimate_tokens
+from retrieval import get_question_context
+from transcript_columns import format_timestamps
+from utils import (
+    create_gemini_cache_async,
+    delete_gemini_cache_async,
+    extend_gemini_cache_async,
+    get_transcript_async,
+    parse_llm_response,
+    send_gemini_request_async
+)
+
+# Sessions are ended after this many seconds without a question
+QA_SESSION_IDLE_SECONDS = int(os.getenv('QA_SESSION_IDLE_SECONDS', 30 * 60))
+QA_SESSION_MAX_SESSIONS = int(os.getenv('QA_SESSION_MAX_SESSIONS', 256))
+# Earlier questions and answers sent along with each new question
+QA_SESSION_HISTORY_TURNS = int(os.getenv('QA_SESSION_HISTORY_TURNS', 6))
+# Transcripts up to this many tokens are pinned to the session whole; longer
+# ones get the passages relevant to each question, like /api/question
+QA_SESSION_PIN_MAX_TOKENS = int(os.getenv('QA_SESSION_PIN_MAX_TOKENS', LLM_PROMPT_TOKEN_BUDGET))
+# Store pinned transcripts in a Gemini context cache, so follow-up questions
+# don't send them again. Gemini only caches contexts above a minimum size.
+QA_CONTEXT_CACHE_ENABLED = os.getenv('QA_CONTEXT_CACHE_ENABLED', 'true').lower() == 'true'
+QA_CONTEXT_CACHE_MIN_TOKENS = int(os.getenv('QA_CONTEXT_CACHE_MIN_TOKENS', 4096))
+
+QA_SESSION_PROMPT = """You answer questions about a YouTube video from its transcript. Answer from the transcript, give timestamps (MM:SS) where they help, and say so when the transcript doesn't cover something. Questions may follow up on earlier answers."""
+
+
+class QASessionError(Exception):
+    """A Q&A session failure that maps to an HTTP error response."""
+
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class QASession:
+    """A conversation about one video, with its transcript prepared once for every question.
+
+    mode is 'cached' when the transcript is held in a Gemini context cache,
+    'inline' when it is sent as the system instruction of each request, and
+    'retrieval' when the transcript is too long to pin and each question
+    gets the passages relevant to it.
+    """
+
+    def __init__(self, video_id, language, transcript, system, mode):
+        self.id = uuid.uuid4().hex
+        self.video_id = video_id
+        self.language = language
+        self.transcript = transcript
+        self.system = system
+        self.mode = mode
+        self.cache_name = None
+        self.cache_expires_at = None
+        # (question, answer) pairs, oldest first
+        self.history = []
+        self.created_at = self.last_used = time.time()
+        # Questions in one session are answered in order
+        self.lock = asyncio.Lock()
+
+    def history_turns(self):
+        """The recent history as alternating user and model turns."""
+        turns = []
+        for question, answer in self.history[-QA_SESSION_HISTORY_TURNS:]:
+            turns.append(('user', question))
+            turns.append(('model', answer))
+        return turns
+
+    def to_dict(self):
+        return {
+            'session_id': self.id,
+            'video_id': self.video_id,
+            'language': self.language,
+            'context': self.mode,
+            'history': [{'question': question, 'answer': answer} for question, answer in self.history],
+            'idle_timeout': QA_SESSION_IDLE_SECONDS,
+            'expires_in': max(0, round(self.last_used + QA_SESSION_IDLE_SECONDS - time.time()))
+        }
+
+
+class SessionStore:
+    """Open Q&A sessions by ID. Idle sessions, and the oldest beyond max_sessions, are ended."""
+
+    def __init__(self, max_sessions=QA_SESSION_MAX_SESSIONS, idle_seconds=QA_SESSION_IDLE_SECONDS):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def add(self, session):
+        with self._lock:
+            self._sessions[session.id] = session
+        self.evict()
+
+    def get(self, session_id):
+        """The session with this ID, marked as just used, or None if it has ended."""
+        self.evict()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_used = time.time()
+            return session
+
+    def remove(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            end_session(session)
+        return session is not None
+
+    def evict(self):
+        """End idle sessions, then the least recently used ones beyond max_sessions."""
+        cutoff = time.time() - self.idle_seconds
+        with self._lock:
+            evicted = [session for session in self._sessions.values() if session.last_used < cutoff]
+            for session in evicted:
+                del self._sessions[session.id]
+            if len(self._sessions) > self.max_sessions:
+                by_use = sorted(self._sessions.values(), key=lambda session: session.last_used)
+                for session in by_use[:len(self._sessions) - self.max_sessions]:
+                    del self._sessions[session.id]
+                    evicted.append(session)
+            self.evictions += len(evicted)
+        for session in evicted:
+            print(f"Ending idle Q&A session {session.id} for video ID: {session.video_id}")
+            end_session(session)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._sessions),
+                'max_size': self.max_sessions,
+                'cached_contexts': sum(1 for session in self._sessions.values() if session.cache_name),
+                'evictions': self.evictions
+            }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+sessions = SessionStore()
+
+
+def end_session(session):
+    """Free a session's Gemini context cache rather than waiting for it to expire."""
+    if session.cache_name:
+        submit(delete_gemini_cache_async(session.cache_name))
+        session.cache_name = None
+
+
+def format_session_transcript(transcript):
+    """The transcript as timestamped lines, so answers can point to moments in the video."""
+    labels = format_timestamps(transcript.starts)
+    return '\n'.join(f"[{label}] {text}" for label, text in zip(labels, transcript.texts))
+
+
+async def start_session(video_id, language=None):
+    """Open a Q&A session for a video, preparing its transcript for every question to come."""
+    try:
+        transcript = await get_transcript_async(video_id, language)
+    except Exception as e:
+        print(f"Error getting transcript: {str(e)}")
+        raise QASessionError("Could not retrieve transcript", 404)
+
+    system = f"{QA_SESSION_PROMPT}\n\nTranscript:\n{format_session_transcript(transcript)}"
+    tokens = estimate_tokens(system)
+    if tokens > QA_SESSION_PIN_MAX_TOKENS:
+        session = QASession(video_id, language, transcript, QA_SESSION_PROMPT, 'retrieval')
+    else:
+        session = QASession(video_id, language, transcript, system, 'inline')
+        if QA_CONTEXT_CACHE_ENABLED and tokens >= QA_CONTEXT_CACHE_MIN_TOKENS:
+            await cache_context(session)
+
+    sessions.add(session)
+    print(f"Started Q&A session {session.id} for video ID: {video_id} ({session.mode} context, ~{tokens} tokens)")
+    return session
+
+
+async def cache_context(session):
+    """Move a session's transcript into a Gemini context cache, or leave it inline if that fails.
+
+    The cache lives for twice the idle timeout and is extended once less
+    than the idle timeout is left, so it outlasts the session without being
+    extended on every question.
+    """
+    ttl = 2 * QA_SESSION_IDLE_SECONDS
+    try:
+        session.cache_name = await create_gemini_cache_async(session.system, ttl)
+    except Exception as e:
+        print(f"Error creating Gemini context cache, sending the transcript with each question: {str(e)}")
+        return
+    session.cache_expires_at = time.time() + ttl
+    session.mode = 'cached'
+
+
+async def keep_context_cached(session):
+    if session.cache_expires_at - time.time() >= QA_SESSION_IDLE_SECONDS:
+        return
+    ttl = 2 * QA_SESSION_IDLE_SECONDS
+    try:
+        await extend_gemini_cache_async(session.cache_name, ttl)
+        session.cache_expires_at = time.time() + ttl
+    except Exception as e:
+        print(f"Error extending Gemini context cache {session.cache_name}: {str(e)}")
+
+
+async def send_question(session, prompt, history):
+    if session.cache_name:
+        await keep_context_cached(session)
+        try:
+            return await send_gemini_request_async('question', prompt, history, cached_content=session.cache_name)
+        except Exception as e:
+            if is_upstream_failure(e):
+                raise
+            # The cache expired or was rejected, so carry on without it
+            print(f"Gemini context cache {session.cache_name} unusable, sending the transcript instead: {str(e)}")
+            session.cache_name = None
+            session.mode = 'inline'
+    return await send_gemini_request_async('question', prompt, history, system=session.system)
+
+
+async def ask_in_session(session, question):
+    """Answer a question in a session, with the session's earlier questions and answers as context."""
+    async with session.lock:
+        session.last_used = time.time()
+        prompt = question
+        if session.mode == 'retrieval':
+            context = await asyncio.to_thread(get_question_context, session.video_id, session.transcript, question)
+            prompt = f"{question}\n\n{context}"
+        record_cache('qa_context', session.mode == 'cached')
+
+        try:
+            result = await send_question(session, prompt, session.history_turns())
+        except Exception as e:
+            print(f"Error answering question in session {session.id}: {str(e)}")
+            raise QASessionError(f"Could not get an answer: {str(e)}", 502)
+        answer = parse_llm_response('question', result)
+        if answer is None:
+            raise QASessionError("Could not get an answer", 502)
+
+        session.history.append((question, answer))
+        del session.history[:-QA_SESSION_HISTORY_TURNS]
+        session.last_used = time.time()
+        return answer
@@ -0,0 +1,273 @@
+import asyncio
+import email.utils
+import os
+import random
+import threading
+import time
+from functools import wraps
+
+import httpx
+import requests
+
+from metrics import record_stage, upstream_retries
+
+# Gemini quota. Requests are spread out to stay under both limits instead of
+# being sent at once and retried after 429s.
+GEMINI_REQUESTS_PER_MINUTE = float(os.getenv('GEMINI_REQUESTS_PER_MINUTE', 60))
+GEMINI_TOKENS_PER_MINUTE = float(os.getenv('GEMINI_TOKENS_PER_MINUTE', 1000000))
+
+# Retries for rate limited or temporarily unavailable upstreams
+RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', 5))
+RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', 1))
+RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', 60))
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+THROTTLE_STATUS_CODES = {429, 503}
+
+
+class TokenBucket:
+    """Thread-safe token bucket that hands out reservations.
+
+    reserve() always succeeds and returns how long the caller should wait
+    before using what it reserved, so callers are served in arrival order
+    and nobody spins on the lock.
+    """
+
+    def __init__(self, rate_per_minute, burst_seconds=10):
+        self.rate_per_minute = rate_per_minute
+        self.burst_seconds = burst_seconds
+        self.available = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def rate(self):
+        """Tokens added per second."""
+        return self.rate_per_minute / 60
+
+    @property
+    def capacity(self):
+        return max(1, self.rate * self.burst_seconds)
+
+    def refill(self, now):
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount, now):
+        """Take amount tokens, possibly going into debt, and return the wait in seconds."""
+        self.refill(now)
+        self.available -= amount
+        if self.available >= 0:
+            return 0
+        return -self.available / self.rate
+
+    def refund(self, amount, now):
+        self.refill(now)
+        self.available = min(self.capacity, self.available + amount)
+
+
+class AdaptiveRateLimiter:
+    """Request and token rate limiter that slows down when the upstream pushes back.
+
+    Each 429 or 503 halves the sending rate and pauses all callers until the
+    upstream's Retry-After has passed. Every success recovers a little of the
+    configured rate.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute, min_scale=0.1, recovery_step=0.05):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.min_scale = min_scale
+        self.recovery_step = recovery_step
+        self.scale = 1.0
+        self.paused_until = 0
+        self.last_throttle = 0
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self._lock = threading.Lock()
+        self.throttled = 0
+        self.total_wait = 0.0
+
+    def reserve(self, tokens=0):
+        """Reserve one request and an estimated number of tokens.
+
+        Returns the number of seconds to wait before sending.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = max(
+                self.paused_until - now,
+                self.request_bucket.reserve(1, now),
+                self.token_bucket.reserve(tokens, now) if tokens else 0
+            )
+            wait = max(0, wait)
+            self.total_wait += wait
+            return wait
+
+    async def acquire_async(self, tokens=0):
+        """Wait on the event loop, without holding a thread, until a request may be sent."""
+        wait = self.reserve(tokens)
+        if wait:
+            record_stage('rate_limit_wait', wait)
+            await asyncio.sleep(wait)
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        """Correct the token bucket once the upstream reports what a request really used."""
+        if not actual_tokens:
+            return
+        with self._lock:
+            now = time.monotonic()
+            difference = actual_tokens - estimated_tokens
+            if difference > 0:
+                self.token_bucket.reserve(difference, now)
+            elif difference < 0:
+                self.token_bucket.refund(-difference, now)
+
+    def on_success(self):
+        with self._lock:
+            if self.scale < 1.0:
+                self._set_scale(min(1.0, self.scale + self.recovery_step))
+
+    def on_throttle(self, retry_after=None):
+        """Back off after the upstream rejected a request for being over quota."""
+        with self._lock:
+            now = time.monotonic()
+            self.throttled += 1
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            # Requests already in flight when the quota ran out fail together;
+            # count them as one signal rather than halving once per request
+            if now - self.last_throttle < 1:
+                return
+            self.last_throttle = now
+            self._set_scale(max(self.min_scale, self.scale / 2))
+            print(f"Upstream throttled us, sending at {self.scale:.0%} of the configured rate")
+
+    def _set_scale(self, scale):
+        now = time.monotonic()
+        # Settle both buckets at the old rate before changing it
+        self.request_bucket.refill(now)
+        self.token_bucket.refill(now)
+        self.scale = scale
+        self.request_bucket.rate_per_minute = self.requests_per_minute * scale
+        self.token_bucket.rate_per_minute = self.tokens_per_minute * scale
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests_per_minute': self.request_bucket.rate_per_minute,
+                'tokens_per_minute': self.token_bucket.rate_per_minute,
+                'scale': self.scale,
+                'paused_for': max(0, self.paused_until - time.monotonic()),
+                'throttled': self.throttled,
+                'total_wait': round(self.total_wait, 3)
+            }
+
+
+gemini_limiter = AdaptiveRateLimiter(GEMINI_REQUESTS_PER_MINUTE, GEMINI_TOKENS_PER_MINUTE)
+
+
+def error_response(error):
+    """The HTTP response attached to a requests or httpx error, if any."""
+    return getattr(error, 'response', None)
+
+
+def error_status(error):
+    response = error_response(error)
+    return getattr(response, 'status_code', None)
+
+
+def retry_after_seconds(error):
+    """Parse the Retry-After header of an error response, in seconds."""
+    response = error_response(error)
+    headers = getattr(response, 'headers', None) or {}
+    value = headers.get('Retry-After') or headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_throttled(error):
+    status = error_status(error)
+    if status is not None:
+        return status in THROTTLE_STATUS_CODES
+    # Libraries that don't expose the response (e.g. the transcript API) only tell us in the message
+    message = f"{type(error).__name__} {error}".lower()
+    return 'rate limit' in message or 'too many requests' in message or 'toomanyrequests' in message
+
+
+def is_retryable(error):
+    """Whether an upstream error is worth retrying."""
+    status = error_status(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                          httpx.TransportError)):
+        return True
+    if is_throttled(error):
+        return True
+    # Errors re-raised with `raise ... from e` are judged by what caused them
+    return error.__cause__ is not None and is_retryable(error.__cause__)
+
+
+def backoff_delay(attempt, retry_after=None, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY):
+    """Exponential backoff with full jitter, never shorter than Retry-After."""
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, cap))
+    return delay
+
+
+def retry_with_backoff(max_attempts=RETRY_MAX_ATTEMPTS, limiter=None):
+    """Decorator that retries rate limited or temporarily failing calls with backoff.
+
+    When a limiter is given, throttling errors also slow the limiter down for
+    everyone sharing it.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            for attempt in range(max_attempts):
+                try:
+                    return func(*args, **kwargs)
+                except Exception as e:
+                    if attempt == max_attempts - 1 or not is_retryable(e):
+                        raise
+                    retry_after = retry_after_seconds(e)
+                    if limiter and is_throttled(e):
+                        limiter.on_throttle(retry_after)
+                    delay = backoff_delay(attempt, retry_after)
+                    upstream_retries.inc(call=func.__name__)
+                    print(f"{func.__name__} failed ({e}), retrying in {delay:.1f} seconds...")
+                    time.sleep(delay)
+        return wrapper
+    return decorator
+
+
+def async_retry_with_backoff(max_attempts=RETRY_MAX_ATTEMPTS, limiter=None):
+    """Async version of retry_with_backoff; waits on the event loop between attempts."""
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            for attempt in range(max_attempts):
+                try:
+                    return await func(*args, **kwargs)
+                except Exception as e:
+                    if attempt == max_attempts - 1 or not is_retryable(e):
+                        raise
+                    retry_after = retry_after_seconds(e)
+                    if limiter and is_throttled(e):
+                        limiter.on_throttle(retry_after)
+                    delay = backoff_delay(attempt, retry_after)
+                    upstream_retries.inc(call=func.__name__)
+                    print(f"{func.__name__} failed ({e}), retrying in {delay:.1f} seconds...")
+                    await asyncio.sleep(delay)
+        return wrapper
+    return decorator
@@ -0,0 +1,136 @@
+import heapq
+import math
+import os
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from cache import LRUCache
+from incremental import transcript_fingerprint
+from transcript_columns import Transcript
+from utils import combine_transcript_segments, format_timestamp
+
+# Transcripts shorter than this (in characters) are sent to the LLM whole
+QA_FULL_TRANSCRIPT_MAX_CHARS = int(os.getenv('QA_FULL_TRANSCRIPT_MAX_CHARS', 20000))
+# Number of passages sent with a question for longer transcripts
+QA_TOP_K = int(os.getenv('QA_TOP_K', 8))
+QA_INDEX_CACHE_SIZE = int(os.getenv('QA_INDEX_CACHE_SIZE', 64))
+QA_WINDOW_SIZE = int(os.getenv('QA_WINDOW_SIZE', 6))
+
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'can', 'did', 'do', 'does', 'for',
+    'from', 'had', 'has', 'have', 'he', 'her', 'his', 'how', 'i', 'if', 'in', 'is', 'it', 'its',
+    'me', 'my', 'of', 'on', 'or', 'our', 'she', 'so', 'that', 'the', 'their', 'them', 'then',
+    'there', 'they', 'this', 'to', 'was', 'we', 'were', 'what', 'when', 'where', 'which', 'who',
+    'why', 'will', 'with', 'would', 'you', 'your', 'video', 'about'
+}
+
+index_cache = LRUCache(max_size=QA_INDEX_CACHE_SIZE)
+
+
+def tokenize(text):
+    """Lowercase word tokens with stopwords removed."""
+    return [token for token in re.findall(r'\w+', text.lower()) if token not in STOPWORDS]
+
+
+class PassageIndex:
+    """BM25 index over overlapping windows of transcript segments."""
+
+    def __init__(self, transcript, window_size=QA_WINDOW_SIZE, k1=1.5, b=0.75):
+        self.transcript = Transcript.from_segments(transcript)
+        self.passages = combine_transcript_segments(transcript, window_size)
+        self.k1 = k1
+        self.b = b
+
+        self.doc_lengths = []
+        self.postings = defaultdict(list)
+        for doc_id, passage in enumerate(self.passages):
+            term_counts = Counter(tokenize(passage['text']))
+            self.doc_lengths.append(sum(term_counts.values()))
+            for term, count in term_counts.items():
+                self.postings[term].append((doc_id, count))
+
+        total = len(self.passages)
+        self.avg_length = (sum(self.doc_lengths) / total) if total else 0
+        self.idf = {
+            term: math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def search(self, query, k=QA_TOP_K):
+        """Return the k best-matching passages for a query, best first."""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, count in self.postings[term]:
+                length_norm = 1 - self.b + self.b * self.doc_lengths[doc_id] / (self.avg_length or 1)
+                scores[doc_id] += idf * count * (self.k1 + 1) / (count + self.k1 * length_norm)
+
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [dict(self.passages[doc_id], score=score) for doc_id, score in best]
+
+    def context_for(self, query, k=QA_TOP_K):
+        """Build timestamped transcript excerpts relevant to a query.
+
+        Overlapping passages are merged into one excerpt and excerpts are
+        listed in video order.
+        """
+        passages = self.search(query, k)
+        if not passages:
+            # Nothing matched; fall back to the start of the video
+            passages = self.passages[:k]
+
+        spans = []
+        for passage in sorted(passages, key=lambda p: p['start']):
+            start, end = passage['start'], passage['start'] + passage['duration']
+            if spans and start <= spans[-1][1]:
+                spans[-1][1] = max(spans[-1][1], end)
+            else:
+                spans.append([start, end])
+
+        # Segments are in time order, so each span is a contiguous run of them
+        texts = self.transcript.texts
+        lows = np.searchsorted(self.transcript.starts, [start for start, _ in spans], side='left')
+        highs = np.searchsorted(self.transcript.starts, [end for _, end in spans], side='left')
+        
+        excerpts = []
+        for (start, end), low, high in zip(spans, lows.tolist(), highs.tolist()):
+            text = ' '.join(texts[low:high])
+            excerpts.append(f"[{format_timestamp(start)}-{format_timestamp(end)}] {text}")
+
+        return "Relevant excerpts from the transcript:\n\n" + '\n\n'.join(excerpts)
+
+
+def get_passage_index(video_id, transcript):
+    """Get the passage index for a video's transcript, building it on first use.
+
+    Indexes are keyed on the transcript's content, so a refetched transcript
+    (or one in another language) gets its own index.
+    """
+    key = (video_id, transcript_fingerprint(transcript))
+    index = index_cache.get(key)
+    if index is None:
+        print(f"Building passage index for video ID: {video_id}")
+        index = PassageIndex(transcript)
+        index_cache.set(key, index)
+    return index
+
+
+def get_question_context(video_id, transcript, question):
+    """Get the transcript content to send with a question.
+
+    Short transcripts are returned unchanged; long ones are reduced to the
+    passages most relevant to the question so the prompt size stays bounded.
+    """
+    transcript = Transcript.from_segments(transcript)
+    total_chars = int(transcript.text_lengths().sum()) + len(transcript)
+    if total_chars <= QA_FULL_TRANSCRIPT_MAX_CHARS:
+        return transcript
+
+    index = get_passage_index(video_id, transcript)
+    context = index.context_for(question)
+    print(f"Selected {len(context)} of {total_chars} transcript characters for question")
+    return context
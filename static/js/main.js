@@ -34,29 +34,51 @@ document.addEventListener('DOMContentLoaded', () => {
     });
 
     // Analyze video function
-    async function analyzeVideo(url) {
-        try {
-            showLoading();
-            
-            const response = await fetch('/api/analyze', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({ video_url: url })
+    // Results are streamed over Server-Sent Events and each part is rendered
+    // as soon as the server sends it.
+    function analyzeVideo(url) {
+        showLoading(false);
+        
+        const sections = ['video_info', 'transcript', 'summary', 'key_points', 'fact_check'];
+        const received = new Set();
+        const data = {};
+        let playerInitialized = false;
+        
+        const source = new EventSource(`/api/analyze/stream?video_url=${encodeURIComponent(url)}`);
+        
+        sections.forEach(section => {
+            source.addEventListener(section, (event) => {
+                data[section] = JSON.parse(event.data);
+                received.add(section);
+                
+                loadingElement.classList.add('hidden');
+                displayResults(data, !playerInitialized);
+                playerInitialized = true;
+                
+                setProgress(received.size / sections.length * 100);
             });
-
-            if (!response.ok) {
-                throw new Error('Analysis failed');
-            }
-
-            const data = await response.json();
-            displayResults(data);
-        } catch (error) {
-            showError(error.message);
-        } finally {
+        });
+        
+        source.addEventListener('done', () => {
+            source.close();
             hideLoading();
-        }
+        });
+        
+        source.addEventListener('error', (event) => {
+            source.close();
+            hideLoading();
+            
+            // Server-sent error events carry a message; connection errors don't
+            let message = 'Analysis failed';
+            if (event.data) {
+                try {
+                    message = JSON.parse(event.data).error || message;
+                } catch (error) {
+                    console.error('Error parsing error event:', error);
+                }
+            }
+            showError(message);
+        });
     }
 
     // Helper function to update tab content
@@ -68,14 +90,13 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // Display results function
-    async function displayResults(data) {
+    async function displayResults(data, initPlayer = true) {
         console.log('Received data:', data);
-        hideLoading();
         resultsContainer.classList.remove('hidden');
         
         // Extract video ID and initialize player
         const videoId = extractVideoId(videoUrlInput.value);
-        if (videoId) {
+        if (videoId && initPlayer) {
             initYouTubePlayer(videoId);
         }
         
@@ -409,8 +430,13 @@ document.addEventListener('DOMContentLoaded', () => {
         // Process transcript segments to collect fact checks
         if (data.transcript) {
             const transcriptSegments = Array.isArray(data.transcript) ? data.transcript : [];
+            // A claim spanning several segments is attached to each of them; list it once
+            const seenClaims = new Set();
             transcriptSegments.forEach(segment => {
                 if (segment.fact_check) {
+                    const claimKey = `${segment.fact_check.claim}|${segment.fact_check.timestamp_range}`;
+                    if (seenClaims.has(claimKey)) return;
+                    seenClaims.add(claimKey);
                     const status = segment.fact_check.status.toLowerCase();
                     const factCheck = {
                         claim: segment.fact_check.claim || segment.text,
@@ -607,20 +633,49 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    // Q&A functionality
+    // Q&A functionality. Questions about the same video share a server-side
+    // session, so follow-ups don't resend the transcript.
+    let qaSession = null;
+
+    async function getQaSession(videoUrl) {
+        if (qaSession && qaSession.videoUrl === videoUrl) {
+            return qaSession.id;
+        }
+        const response = await fetch('/api/sessions', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ video_url: videoUrl })
+        });
+        const data = await response.json();
+        if (!response.ok) {
+            throw new Error(data.error || 'Failed to start Q&A session');
+        }
+        qaSession = { id: data.session_id, videoUrl: videoUrl };
+        return qaSession.id;
+    }
+
+    async function postQuestion(sessionId, question) {
+        return fetch(`/api/sessions/${sessionId}/questions`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ question: question })
+        });
+    }
+
     async function askQuestion(question) {
         try {
             showLoading();
-            const response = await fetch('/api/question', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({ 
-                    video_url: videoUrlInput.value.trim(),
-                    question: question 
-                })
-            });
+            const videoUrl = videoUrlInput.value.trim();
+            let response = await postQuestion(await getQaSession(videoUrl), question);
+            if (response.status === 404) {
+                // The session ended after being idle; start a new one
+                qaSession = null;
+                response = await postQuestion(await getQaSession(videoUrl), question);
+            }
 
             const data = await response.json();
             if (!response.ok) {
@@ -696,14 +751,19 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // Helper functions
-    function showLoading() {
+    function showLoading(simulateProgress = true) {
         resultsContainer.classList.remove('hidden');
         loadingElement.classList.remove('hidden');
         videoContainer.classList.add('hidden');
         analyzeBtn.disabled = true;
         
-        // Reset and start progress bar animation
+        // Reset the progress bar; callers that report real progress use setProgress
         progressBar.style.width = '0%';
+        clearInterval(progressInterval);
+        if (!simulateProgress) {
+            return;
+        }
+        
         let progress = 0;
         progressInterval = setInterval(() => {
             if (progress < 90) {
@@ -713,6 +773,10 @@ document.addEventListener('DOMContentLoaded', () => {
         }, 500);
     }
 
+    function setProgress(percent) {
+        progressBar.style.width = `${Math.min(percent, 100)}%`;
+    }
+
     function hideLoading() {
         loadingElement.classList.add('hidden');
         analyzeBtn.disabled = false;
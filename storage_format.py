@@ -0,0 +1,76 @@
+import json
+import os
+import struct
+import zlib
+from array import array
+
+import numpy as np
+
+from transcript_columns import Transcript, json_default
+
+# zlib level for stored payloads: 1 is fastest, 9 is smallest
+STORAGE_COMPRESSION_LEVEL = int(os.getenv('STORAGE_COMPRESSION_LEVEL', 6))
+
+TRANSCRIPT_FORMAT = b'TR1'
+
+
+def pack_json(value):
+    """Serialize a JSON-compatible value to compressed bytes for storage."""
+    data = json.dumps(value, separators=(',', ':'), default=json_default).encode('utf-8')
+    return zlib.compress(data, STORAGE_COMPRESSION_LEVEL)
+
+
+def unpack_json(data):
+    """Load a value stored by pack_json, or plain JSON text from older rows."""
+    if isinstance(data, bytes):
+        data = zlib.decompress(data)
+    return json.loads(data)
+
+
+def pack_transcript(transcript):
+    """Store a transcript as columns instead of a list of JSON objects.
+
+    Starts and durations are packed as arrays of doubles and the texts as one
+    UTF-8 blob with an array of their lengths, then the whole thing is
+    compressed. Only text, start and duration are kept.
+    """
+    transcript = Transcript.from_segments(transcript)
+    texts = [text.encode('utf-8') for text in transcript.texts]
+    lengths = array('I', (len(text) for text in texts))
+    data = b''.join([
+        TRANSCRIPT_FORMAT,
+        struct.pack('<I', len(texts)),
+        transcript.starts.tobytes(),
+        transcript.durations.tobytes(),
+        lengths.tobytes(),
+        b''.join(texts)
+    ])
+    return zlib.compress(data, STORAGE_COMPRESSION_LEVEL)
+
+
+def unpack_transcript(data):
+    """Load a transcript stored by pack_transcript, or a JSON list from older rows."""
+    if not isinstance(data, bytes):
+        return Transcript.from_segments(json.loads(data))
+
+    data = zlib.decompress(data)
+    if not data.startswith(TRANSCRIPT_FORMAT):
+        raise ValueError('Unknown transcript storage format')
+    offset = len(TRANSCRIPT_FORMAT)
+    (count,) = struct.unpack_from('<I', data, offset)
+    offset += 4
+
+    # Copy the time columns out so the decompressed buffer can be freed
+    starts = np.frombuffer(data, dtype=np.float64, count=count, offset=offset).copy()
+    offset += starts.nbytes
+    durations = np.frombuffer(data, dtype=np.float64, count=count, offset=offset).copy()
+    offset += durations.nbytes
+    lengths = array('I')
+    lengths.frombytes(data[offset:offset + lengths.itemsize * count])
+    offset += lengths.itemsize * count
+
+    texts = []
+    for length in lengths:
+        texts.append(data[offset:offset + length].decode('utf-8'))
+        offset += length
+    return Transcript(texts, starts, durations)
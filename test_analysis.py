@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+import analysis
+from analysis import ANALYSIS_EVENTS, run_shared_analysis
+
+
+@pytest.fixture
+def fake_analysis(monkeypatch):
+    """Replace run_analysis with one that sends each part of the result a little apart."""
+    runs = []
+
+    async def fake_run_analysis(video_id, video_url, force_refresh=False, on_event=None):
+        runs.append(video_id)
+        result = {name: f'{name} {len(runs)}' for name in ANALYSIS_EVENTS}
+        result['cached'] = False
+        for name in ANALYSIS_EVENTS:
+            await asyncio.sleep(0.01)
+            on_event(name, result[name])
+        return result
+
+    monkeypatch.setattr(analysis, 'run_analysis', fake_run_analysis)
+    return runs
+
+
+def collector():
+    events = []
+    return events, lambda name, data: events.append((name, data))
+
+
+def test_concurrent_streams_share_one_analysis_and_all_get_every_event(fake_analysis):
+    first_events, first = collector()
+    late_events, late = collector()
+
+    async def main():
+        leader = asyncio.create_task(run_shared_analysis('video', 'url', on_event=first))
+        await asyncio.sleep(0.025)
+        # Joins after some events were sent
+        follower = asyncio.create_task(run_shared_analysis('video', 'url', on_event=late))
+        plain = asyncio.create_task(run_shared_analysis('video', 'url'))
+        return await asyncio.gather(leader, follower, plain)
+
+    results = asyncio.run(main())
+    assert fake_analysis == ['video']
+    assert results[0] is results[1] is results[2]
+    expected = [(name, f'{name} 1') for name in ANALYSIS_EVENTS]
+    assert first_events == expected
+    assert late_events == expected
+    assert analysis.analysis_broadcasts == {}
+
+
+def test_force_refresh_and_other_videos_run_separately(fake_analysis):
+    async def main():
+        return await asyncio.gather(
+            run_shared_analysis('video', 'url'),
+            run_shared_analysis('video', 'url', force_refresh=True),
+            run_shared_analysis('other', 'url')
+        )
+
+    asyncio.run(main())
+    assert sorted(fake_analysis) == ['other', 'video', 'video']
+
+
+def test_followers_of_a_cancelled_stream_still_get_the_whole_result(fake_analysis):
+    follower_events, follower = collector()
+
+    async def main():
+        leader = asyncio.create_task(run_shared_analysis('video', 'url', on_event=lambda name, data: None))
+        await asyncio.sleep(0.015)
+        waiting = asyncio.create_task(run_shared_analysis('video', 'url', on_event=follower))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await waiting
+
+    result = asyncio.run(main())
+    assert len(fake_analysis) == 2
+    # Whatever was sent by the cancelled run, the follower ends with the finished run's parts
+    latest = dict(follower_events)
+    assert latest == {name: result[name] for name in ANALYSIS_EVENTS}
@@ -0,0 +1,42 @@
+import pytest
+
+import app as app_module
+from app import parse_flag
+
+VIDEO_URL = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+
+
+@pytest.mark.parametrize('value, expected', [
+    (True, True), (False, False), (1, True), (0, False),
+    ('true', True), ('TRUE', True), ('yes', True), ('1', True),
+    ('false', False), ('False', False), ('no', False), ('0', False), ('', False)
+])
+def test_parse_flag(value, expected):
+    assert parse_flag({'force_refresh': value}, 'force_refresh') is expected
+
+
+@pytest.mark.parametrize('value', ['maybe', 2, None, [], {}])
+def test_parse_flag_rejects_other_values(value):
+    with pytest.raises(ValueError, match='force_refresh must be true or false'):
+        parse_flag({'force_refresh': value}, 'force_refresh')
+
+
+def test_parse_flag_default():
+    assert parse_flag({}, 'force_refresh') is False
+
+
+def test_force_refresh_string_false_does_not_refresh(db, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(app_module, 'submit_job', lambda video_id, video_url, force_refresh: submitted.append(force_refresh) or 'job')
+    client = app_module.app.test_client()
+
+    assert client.post('/api/jobs', json={'video_url': VIDEO_URL, 'force_refresh': 'false'}).status_code == 202
+    assert client.post('/api/jobs', json={'video_url': VIDEO_URL, 'force_refresh': 'true'}).status_code == 202
+    assert submitted == [False, True]
+
+    response = client.post('/api/jobs', json={'video_url': VIDEO_URL, 'force_refresh': 'sometimes'})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'force_refresh must be true or false'}
+    assert client.post('/api/analyze', json={'video_url': VIDEO_URL, 'force_refresh': 'sometimes'}).status_code == 400
+    assert client.post('/api/analyze/batch', json={'video_urls': [VIDEO_URL], 'stream': 'no way'}).status_code == 400
+    assert client.get(f'/api/analyze/stream?video_url={VIDEO_URL}&force_refresh=sometimes').status_code == 400
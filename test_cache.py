@@ -0,0 +1,79 @@
+import asyncio
+import os
+
+import pytest
+
+import database
+from cache import AsyncSingleFlight, ResponseCache, SQLiteCache
+
+
+def test_sqlite_cache_opens_its_database_on_first_use(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DATABASE_PATH', str(tmp_path / 'first.db'))
+    cache = ResponseCache(SQLiteCache(table='llm_cache'), ttls={'summarize': 60})
+    assert not os.path.exists(tmp_path / 'first.db')
+
+    monkeypatch.setattr(database, 'DATABASE_PATH', str(tmp_path / 'second.db'))
+    cache.set('summarize', 'key', {'summary': 's'}, tag='video')
+    assert cache.get('summarize', 'key') == {'summary': 's'}
+    assert not os.path.exists(tmp_path / 'first.db')
+    assert os.path.exists(tmp_path / 'second.db')
+
+    assert cache.delete_tag('video') == 1
+    assert cache.get('summarize', 'key') is None
+    database.close_connection(str(tmp_path / 'second.db'))
+
+
+def test_async_single_flight_shares_one_call():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def work(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return value * 2
+
+    async def main():
+        return await asyncio.gather(*(flight.do('key', work, 21) for _ in range(5)))
+
+    assert asyncio.run(main()) == [42] * 5
+    assert calls == [21]
+    assert flight.stats() == {'in_flight': 0, 'executed': 1, 'shared': 4}
+
+
+def test_async_single_flight_followers_outlive_a_cancelled_leader():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(len(calls))
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    async def main():
+        leader = asyncio.create_task(flight.do('key', work))
+        await asyncio.sleep(0)
+        followers = [asyncio.create_task(flight.do('key', work)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        results = await asyncio.gather(*followers)
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return results
+
+    # The first follower runs the call again and the others share its result
+    assert asyncio.run(main()) == [2, 2, 2]
+    assert len(calls) == 2
+    assert flight.in_flight() == 0
+
+
+def test_async_single_flight_shares_errors():
+    flight = AsyncSingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError('upstream failed')
+
+    async def main():
+        return await asyncio.gather(*(flight.do('key', fail) for _ in range(3)), return_exceptions=True)
+
+    assert [str(result) for result in asyncio.run(main())] == ['upstream failed'] * 3
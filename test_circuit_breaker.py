@@ -0,0 +1,203 @@
+import asyncio
+
+import httpx
+import pytest
+
+import circuit_breaker
+import utils
+from circuit_breaker import CircuitBreaker, CircuitOpenError, is_upstream_failure
+from pipeline import hedged
+
+
+def http_error(status):
+    request = httpx.Request('GET', 'https://example.com')
+    response = httpx.Response(status, request=request)
+    return httpx.HTTPStatusError(f"status {status}", request=request, response=response)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker.time, 'monotonic', clock.monotonic)
+    return clock
+
+
+def make_call(breaker, outcomes):
+    """A protected call that raises or returns the next of outcomes each time."""
+    @breaker.protect
+    def call():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    return call
+
+
+def test_upstream_failures_are_told_apart_from_bad_requests():
+    assert is_upstream_failure(http_error(503))
+    assert is_upstream_failure(httpx.ConnectTimeout('timed out'))
+    assert not is_upstream_failure(http_error(404))
+    assert not is_upstream_failure(ValueError('no transcript'))
+
+    class RequestBlocked(Exception):
+        pass
+
+    assert is_upstream_failure(RequestBlocked())
+    try:
+        try:
+            raise http_error(502)
+        except httpx.HTTPStatusError as e:
+            raise RuntimeError('lookup failed') from e
+    except RuntimeError as e:
+        assert is_upstream_failure(e)
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker('test', failure_threshold=3, recovery_timeout=30)
+    call = make_call(breaker, [http_error(503), http_error(503), 'ok', http_error(503), http_error(503), http_error(503)])
+
+    for _ in range(2):
+        with pytest.raises(httpx.HTTPStatusError):
+            call()
+    # A success in between starts the count again
+    assert call() == 'ok'
+    assert breaker.failures == 0
+
+    for _ in range(3):
+        with pytest.raises(httpx.HTTPStatusError):
+            call()
+    assert breaker.state == circuit_breaker.OPEN
+
+    with pytest.raises(CircuitOpenError) as rejected:
+        call()
+    assert rejected.value.retry_in == pytest.approx(30)
+    assert breaker.stats() == {'state': 'open', 'failures': 3, 'rejected': 1, 'times_opened': 1}
+
+
+def test_bad_requests_do_not_open_the_breaker(clock):
+    breaker = CircuitBreaker('test', failure_threshold=2)
+    call = make_call(breaker, [http_error(400)] * 3)
+    for _ in range(3):
+        with pytest.raises(httpx.HTTPStatusError):
+            call()
+    assert breaker.is_closed
+
+
+def test_half_open_breaker_lets_one_probe_through(clock):
+    breaker = CircuitBreaker('test', failure_threshold=1, recovery_timeout=30)
+    breaker.on_failure(http_error(503))
+    assert breaker.state == circuit_breaker.OPEN
+
+    clock.now += 31
+    breaker.before_call()
+    assert breaker.state == circuit_breaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    # A failed probe opens the breaker for another recovery timeout
+    breaker.on_failure(http_error(503))
+    assert breaker.state == circuit_breaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    clock.now += 31
+    breaker.before_call()
+    breaker.on_success()
+    assert breaker.is_closed
+    breaker.before_call()
+    breaker.before_call()
+    assert breaker.stats()['times_opened'] == 2
+
+
+def test_cancelled_probe_lets_the_next_call_probe(clock):
+    breaker = CircuitBreaker('test', failure_threshold=1, recovery_timeout=30)
+
+    @breaker.protect_async
+    async def slow():
+        await asyncio.sleep(1)
+
+    async def main():
+        breaker.on_failure(http_error(503))
+        clock.now += 31
+        probe = asyncio.create_task(slow())
+        await asyncio.sleep(0)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+    asyncio.run(main())
+    assert breaker.state == circuit_breaker.HALF_OPEN
+    breaker.before_call()
+
+
+def test_hedged_returns_the_first_result_and_cancels_the_rest():
+    started = []
+    cancelled = []
+
+    async def call():
+        index = len(started)
+        started.append(index)
+        try:
+            # The first call is slow, the hedged one answers quickly
+            await asyncio.sleep(1 if index == 0 else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(index)
+            raise
+        return index
+
+    async def main():
+        result = await hedged(call, 0.02)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(main()) == 1
+    assert started == [0, 1]
+    assert cancelled == [0]
+
+
+def test_hedged_does_not_hedge_fast_calls():
+    started = []
+
+    async def call():
+        started.append(1)
+        return 'fast'
+
+    assert asyncio.run(hedged(call, 0.5)) == 'fast'
+    assert len(started) == 1
+
+
+def test_hedged_raises_when_every_call_fails():
+    async def call():
+        await asyncio.sleep(0.02)
+        raise ValueError('down')
+
+    with pytest.raises(ValueError, match='down'):
+        asyncio.run(hedged(call, 0.01))
+
+
+def test_llm_requests_are_not_hedged_while_gemini_is_struggling(monkeypatch):
+    calls = []
+
+    async def slow_request(task, prompt, cache_key=None, video_id=None):
+        calls.append(task)
+        await asyncio.sleep(0.05)
+        return {'answer': 'a'}
+
+    monkeypatch.setattr(utils, 'request_llm_async', slow_request)
+    monkeypatch.setattr(utils, 'LLM_HEDGE_DELAY', 0.01)
+
+    assert asyncio.run(utils.request_llm_hedged_async('question', 'prompt')) == {'answer': 'a'}
+    assert len(calls) == 2
+
+    calls.clear()
+    monkeypatch.setattr(utils.gemini_breaker, 'state', circuit_breaker.HALF_OPEN)
+    assert asyncio.run(utils.request_llm_hedged_async('question', 'prompt')) == {'answer': 'a'}
+    assert len(calls) == 1
@@ -0,0 +1,122 @@
+import asyncio
+
+import numpy as np
+
+import utils
+from claim_store import (
+    claim_anchors,
+    claim_words,
+    find_known_passages,
+    minhash_signature,
+    passage_windows,
+    remember_claim,
+    signature_buckets,
+    similarity
+)
+from transcript_columns import Transcript
+
+CLAIM = {
+    'claim': 'The speed of light is 299,792 kilometres per second',
+    'status': 'TRUE',
+    'explanation': 'Measured value',
+    'references': ['https://example.com/light']
+}
+
+
+def test_claim_words_normalizes_case_punctuation_filler_and_digit_grouping():
+    assert claim_words('Um, the Speed of light is 299,792 km/s!') == [
+        'the', 'speed', 'of', 'light', 'is', '299792', 'km', 's'
+    ]
+
+
+def test_anchors_are_the_numbers_and_negations():
+    assert claim_anchors(claim_words("The moon isn't made of 2 cheeses")) == '2 t'
+    assert claim_anchors(claim_words('The moon is made of cheese')) == ''
+
+
+def test_signatures_are_deterministic_and_similar_texts_share_a_bucket():
+    words = claim_words(CLAIM['claim'])
+    signature = minhash_signature(words)
+    assert np.array_equal(signature, minhash_signature(list(words)))
+    assert similarity(signature, signature.tobytes()) == 1.0
+
+    reworded = minhash_signature(claim_words('Um, the speed of light is 299792 kilometres per second'))
+    assert similarity(signature, reworded.tobytes()) == 1.0
+    unrelated = minhash_signature(claim_words('Bananas are berries but strawberries are not'))
+    assert similarity(signature, unrelated.tobytes()) < 0.3
+    assert set(signature_buckets(signature).tolist()) & set(signature_buckets(reworded).tolist())
+
+
+def test_passage_windows_match_signatures_of_the_joined_segments():
+    segments = [claim_words(text) for text in [
+        'the speed of light', 'is', '299,792 kilometres per second', 'roughly', 'in a vacuum as measured'
+    ]]
+    bounds, signatures, buckets = passage_windows(segments)
+    assert len(bounds) == len(signatures) == len(buckets)
+    for (start, end), signature in zip(bounds.tolist(), signatures):
+        words = [word for words in segments[start:end] for word in words]
+        assert len(words) >= 4
+        assert np.array_equal(signature, minhash_signature(words))
+
+
+def test_remember_claim_merges_near_duplicates_but_not_changed_figures(db):
+    claim_id = remember_claim(CLAIM)
+    assert remember_claim(dict(CLAIM, claim='Um, the speed of light is 299792 kilometres per second')) == claim_id
+    assert remember_claim(dict(CLAIM, claim='The speed of light is 300,000 kilometres per second')) != claim_id
+    assert remember_claim(dict(CLAIM, claim='Too short')) is None
+
+
+def test_remembered_passages_are_found_in_other_transcripts(db):
+    passage = 'so the speed of light is 299,792 kilometres per second in a vacuum'
+    remember_claim(CLAIM, passage)
+
+    texts = ['welcome back everyone', 'so the speed of light is 299,792', 'kilometres per second in a vacuum', 'see you next time']
+    assert find_known_passages(texts) == [(1, 3, [{
+        'claim': CLAIM['claim'],
+        'status': 'TRUE',
+        'explanation': CLAIM['explanation'],
+        'references': CLAIM['references']
+    }])]
+    assert find_known_passages(['so the speed of light is 300,000', 'kilometres per second in a vacuum']) == []
+
+
+def test_skipped_claims_have_no_passages_to_reuse(db):
+    passage = 'so the speed of light is 299,792 kilometres per second in a vacuum'
+    remember_claim(dict(CLAIM, status='SKIP'), passage)
+    assert find_known_passages([passage]) == []
+
+
+def test_claims_sharing_a_passage_with_a_known_claim_are_still_checked(db, monkeypatch):
+    # The known claim runs into a segment that also holds a claim that was
+    # not picked up in the first video
+    texts = [
+        'welcome back everyone to the show',
+        'so the speed of light is 299,792',
+        'kilometres per second and the great wall of china is visible from space'
+    ]
+    prompts = []
+
+    async def fake_llm(content, task, video_id=None, force_refresh=False):
+        prompts.append(content.texts)
+        claims = []
+        if any('speed of light' in text for text in content.texts):
+            claims.append(dict(CLAIM, timestamp='00:04', timestamp_range='00:04-00:09'))
+        if video_id == 'b' and any('great wall' in text for text in content.texts):
+            claims.append({
+                'claim': 'The Great Wall of China is visible from space',
+                'timestamp': '00:08',
+                'timestamp_range': '00:08-00:12',
+                'status': 'FALSE'
+            })
+        return {'results': claims}
+
+    monkeypatch.setattr(utils, 'cached_llm_request_async', fake_llm)
+    transcript = Transcript(texts, np.array([0.0, 4.0, 8.0]), np.full(3, 4.0))
+    first = asyncio.run(utils.fact_check_with_known_claims_async(transcript, video_id='a'))
+    assert [result['claim'] for result in first['results']] == [CLAIM['claim']]
+
+    second = asyncio.run(utils.fact_check_with_known_claims_async(transcript, video_id='b'))
+    assert prompts[-1] == [texts[0], texts[2]]
+    assert sorted(result['claim'] for result in second['results']) == [
+        'The Great Wall of China is visible from space', CLAIM['claim']
+    ]
@@ -0,0 +1,101 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import incremental
+from incremental import (
+    chunk_fingerprints,
+    consecutive_runs,
+    fact_check_incrementally,
+    fingerprint,
+    split_by_chunk
+)
+from transcript_columns import Transcript, format_timestamps
+
+
+def make_transcript(count, duration=4.0, texts=None):
+    durations = np.full(count, duration)
+    texts = texts or [f"segment {i}" for i in range(count)]
+    return Transcript(list(texts), np.arange(count) * duration, durations)
+
+
+def test_fingerprints_change_with_text_timing_and_task():
+    transcript = make_transcript(10)
+    assert fingerprint('summarize', transcript) == fingerprint('summarize', make_transcript(10))
+    assert fingerprint('summarize', transcript) != fingerprint('key_points', transcript)
+
+    edited = make_transcript(10, texts=[f"segment {i}" for i in range(9)] + ['edited'])
+    assert fingerprint('summarize', transcript) != fingerprint('summarize', edited)
+    assert fingerprint('summarize', transcript) != fingerprint('summarize', make_transcript(10, duration=4.5))
+
+
+def test_chunk_fingerprints_only_change_for_edited_chunks():
+    texts = [f"segment {i}" for i in range(200)]
+    bounds, fingerprints = chunk_fingerprints(make_transcript(200, texts=texts))
+    assert bounds == make_transcript(200).chunk_bounds(incremental.FACT_CHECK_CHUNK_SECONDS)
+
+    texts[bounds[2][0]] = 'edited'
+    _, edited = chunk_fingerprints(make_transcript(200, texts=texts))
+    assert [i for i, (old, new) in enumerate(zip(fingerprints, edited)) if old != new] == [2]
+
+
+def test_consecutive_runs():
+    assert consecutive_runs([]) == []
+    assert consecutive_runs([0, 1, 2, 5, 7, 8]) == [[0, 2], [5, 5], [7, 8]]
+
+
+def test_split_by_chunk_uses_whole_second_chunk_starts():
+    fact_check = {'results': [
+        {'claim': 'a', 'timestamp': '00:05'},
+        {'claim': 'b', 'timestamp': '02:00'},
+        {'claim': 'c', 'timestamp': '04:30'},
+        {'claim': 'd', 'timestamp': 'soon'}
+    ]}
+    chunks = split_by_chunk(fact_check, np.array([0.0, 120.4, 240.0]))
+    assert [[result['claim'] for result in chunk['results']] for chunk in chunks] == [['a', 'd'], ['b'], ['c']]
+    assert split_by_chunk(None, np.array([0.0])) == [{'results': []}]
+
+
+@pytest.fixture
+def fact_checker(monkeypatch):
+    """Replace the LLM with one claim per chunk, recording the chunks each call covered."""
+    calls = []
+
+    async def fake_fact_check(content, video_id=None, force_refresh=False):
+        bounds = content.chunk_bounds(incremental.FACT_CHECK_CHUNK_SECONDS)
+        starts = format_timestamps(content.starts[[start for start, _ in bounds]])
+        calls.append(starts)
+        return {'results': [{'claim': f'claim at {start}', 'timestamp': start, 'status': 'TRUE'} for start in starts]}
+
+    monkeypatch.setattr(incremental, 'fact_check_group_async', fake_fact_check)
+    return calls
+
+
+def test_only_changed_chunks_are_fact_checked_again(db, fact_checker):
+    texts = [f"segment {i}" for i in range(300)]
+    first = asyncio.run(fact_check_incrementally('video', make_transcript(300, texts=texts)))
+    chunk_count = len(first['results'])
+    assert sum(len(call) for call in fact_checker) == chunk_count
+
+    fact_checker.clear()
+    assert asyncio.run(fact_check_incrementally('video', make_transcript(300, texts=texts))) == first
+    assert fact_checker == []
+
+    texts[40] = 'edited'
+    again = asyncio.run(fact_check_incrementally('video', make_transcript(300, texts=texts)))
+    assert fact_checker == [['02:00']]
+    assert again == first
+
+    fact_checker.clear()
+    asyncio.run(fact_check_incrementally('video', make_transcript(300, texts=texts), force_refresh=True))
+    assert sum(len(call) for call in fact_checker) == chunk_count
+
+
+def test_failed_chunks_are_not_stored(db, monkeypatch):
+    async def failing(content, video_id=None, force_refresh=False):
+        return None
+
+    monkeypatch.setattr(incremental, 'fact_check_group_async', failing)
+    assert asyncio.run(fact_check_incrementally('video', make_transcript(100))) == {'results': []}
+    assert incremental.get_task_results('video', 'fact_check') == {}
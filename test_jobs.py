@@ -0,0 +1,116 @@
+import jobs
+from analysis import AnalysisError
+from database import (
+    claim_next_job,
+    complete_job,
+    count_jobs_by_status,
+    create_job,
+    fail_job,
+    get_connection,
+    get_job,
+    heartbeat_job,
+    requeue_stale_jobs,
+    retry_job
+)
+
+
+def backdate_started(job_id, seconds):
+    """Make a running job look like its worker started it, and last sent a heartbeat, seconds ago."""
+    with get_connection() as conn:
+        conn.execute(
+            "UPDATE jobs SET started_at = datetime('now', ?), heartbeat_at = datetime('now', ?) WHERE id = ?",
+            (f'-{seconds} seconds', f'-{seconds} seconds', job_id)
+        )
+
+
+def test_jobs_are_claimed_once_in_order(db):
+    create_job('first', 'video1', 'url1', force_refresh=True)
+    create_job('second', 'video2', 'url2')
+    with get_connection() as conn:
+        conn.execute("UPDATE jobs SET created_at = datetime('now', '-1 minute') WHERE id = 'first'")
+
+    job = claim_next_job()
+    assert (job['id'], job['status'], job['attempts'], job['force_refresh']) == ('first', 'running', 1, True)
+    assert claim_next_job()['id'] == 'second'
+    assert claim_next_job() is None
+
+    complete_job('first', {'summary': 's'})
+    assert get_job('first')['result'] == {'summary': 's'}
+    assert count_jobs_by_status() == {'succeeded': 1, 'running': 1}
+
+
+def test_failed_jobs_are_retried_until_out_of_attempts(db):
+    create_job('job', 'video', 'url', max_attempts=2)
+
+    claim_next_job()
+    fail_job('job', 'upstream error', retry_delay=0)
+    assert get_job('job')['status'] == 'queued'
+
+    assert claim_next_job()['attempts'] == 2
+    fail_job('job', 'upstream error again', retry_delay=0)
+    job = get_job('job')
+    assert (job['status'], job['error']) == ('failed', 'upstream error again')
+    assert claim_next_job() is None
+
+    assert retry_job('job')
+    assert not retry_job('job')
+    assert claim_next_job()['attempts'] == 1
+
+
+def test_retry_delay_holds_jobs_back(db):
+    create_job('job', 'video', 'url')
+    claim_next_job()
+    fail_job('job', 'upstream error', retry_delay=3600)
+    assert get_job('job')['status'] == 'queued'
+    assert claim_next_job() is None
+
+
+def test_stale_jobs_are_requeued_then_failed_out_of_attempts(db):
+    create_job('job', 'video', 'url', max_attempts=2)
+    claim_next_job()
+    assert requeue_stale_jobs(60) == 0
+
+    backdate_started('job', 120)
+    assert requeue_stale_jobs(60) == 1
+    assert get_job('job')['status'] == 'queued'
+
+    claim_next_job()
+    backdate_started('job', 120)
+    assert requeue_stale_jobs(60) == 1
+    job = get_job('job')
+    assert job['status'] == 'failed'
+    assert job['error']
+    assert claim_next_job() is None
+
+
+def test_heartbeats_keep_long_running_jobs_from_being_requeued(db):
+    create_job('job', 'video', 'url')
+    claim_next_job()
+    backdate_started('job', 3600)
+    heartbeat_job('job')
+    assert requeue_stale_jobs(60) == 0
+    assert get_job('job')['status'] == 'running'
+
+    with get_connection() as conn:
+        conn.execute("UPDATE jobs SET heartbeat_at = datetime('now', '-120 seconds') WHERE id = 'job'")
+    assert requeue_stale_jobs(60) == 1
+    assert get_job('job')['status'] == 'queued'
+
+
+def test_jobs_for_videos_without_transcripts_fail_without_retrying(db, monkeypatch):
+    async def no_transcript(video_id, video_url, force_refresh=False):
+        raise AnalysisError('Error fetching transcript: none', permanent=True)
+
+    async def upstream_down(video_id, video_url, force_refresh=False):
+        raise AnalysisError('Error fetching transcript: timed out')
+
+    create_job('missing', 'video1', 'url1', max_attempts=3)
+    create_job('flaky', 'video2', 'url2', max_attempts=3)
+
+    monkeypatch.setattr(jobs, 'run_analysis', no_transcript)
+    jobs.run_job(claim_next_job())
+    monkeypatch.setattr(jobs, 'run_analysis', upstream_down)
+    jobs.run_job(claim_next_job())
+
+    assert get_job('missing')['status'] == 'failed'
+    assert get_job('flaky')['status'] == 'queued'
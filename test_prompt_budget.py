@@ -0,0 +1,65 @@
+import numpy as np
+
+import prompt_budget
+import utils
+from prompt_budget import (
+    estimate_segment_tokens,
+    estimate_tokens,
+    estimate_transcript_tokens,
+    fits_budget,
+    pack_segments
+)
+from transcript_columns import Transcript
+
+
+def make_segments(lengths):
+    return [{'text': 'x' * length, 'start': i * 2.0, 'duration': 2.0} for i, length in enumerate(lengths)]
+
+
+def test_estimates_agree_for_segment_lists_and_columnar_transcripts():
+    segments = make_segments([0, 3, 4, 41, 400])
+    assert estimate_tokens('x' * 41) == 11
+    assert estimate_transcript_tokens(segments) == sum(estimate_segment_tokens(entry) for entry in segments)
+    assert estimate_transcript_tokens(Transcript.from_segments(segments)) == estimate_transcript_tokens(segments)
+
+
+def test_fits_budget_counts_the_prompt_overhead():
+    segments = make_segments([40] * 10)
+    tokens = estimate_transcript_tokens(segments)
+    assert fits_budget(segments, budget=tokens)
+    assert fits_budget(segments, overhead_tokens=10, budget=tokens + 10)
+    assert not fits_budget(segments, overhead_tokens=11, budget=tokens + 10)
+
+
+def test_packed_parts_stay_within_budget_and_keep_every_segment_in_order():
+    rng = np.random.default_rng(7)
+    segments = make_segments(rng.integers(1, 200, size=300).tolist())
+    transcript = Transcript.from_segments(segments)
+    for content in (segments, transcript):
+        parts = pack_segments(content, 200)
+        assert all(estimate_transcript_tokens(part) <= 200 for part in parts)
+        assert [entry['start'] for part in parts for entry in part] == [entry['start'] for entry in segments]
+        # Each part is as full as the next segment allows
+        for part, following in zip(parts, parts[1:]):
+            assert estimate_transcript_tokens(part) + estimate_segment_tokens(following[0]) > 200
+
+
+def test_oversized_segments_get_a_part_of_their_own():
+    parts = pack_segments(make_segments([10, 2000, 10, 10]), 100)
+    assert [len(part) for part in parts] == [1, 1, 2]
+    assert pack_segments([], 100) == []
+
+
+def test_long_transcripts_are_split_for_notes_within_the_budget(monkeypatch):
+    monkeypatch.setattr(prompt_budget, 'LLM_PROMPT_TOKEN_BUDGET', 2000)
+    monkeypatch.setattr(utils, 'LLM_PROMPT_TOKEN_BUDGET', 2000)
+    transcript = Transcript.from_segments(make_segments([120] * 200))
+    assert utils.needs_hierarchical_mode(transcript, 'summarize')
+    assert not utils.needs_hierarchical_mode(transcript[:10], 'summarize')
+    assert not utils.needs_hierarchical_mode(transcript, 'chunk_notes')
+
+    parts = utils.split_for_notes(transcript)
+    budget = 2000 - utils.prompt_overhead_tokens('chunk_notes')
+    assert len(parts) > 1
+    assert all(estimate_transcript_tokens(part) <= budget for part in parts)
+    assert sum(len(part) for part in parts) == len(transcript)
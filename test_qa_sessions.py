@@ -0,0 +1,184 @@
+import asyncio
+
+import httpx
+import numpy as np
+import pytest
+
+import qa_sessions
+from qa_sessions import QASession, QASessionError, SessionStore, ask_in_session, start_session
+from transcript_columns import Transcript
+
+TRANSCRIPT = Transcript(['the moon orbits the earth', 'once every 27 days'], np.array([0.0, 4.0]), np.full(2, 4.0))
+
+
+def gemini_answer(text):
+    return {'candidates': [{'content': {'parts': [{'text': text}]}}]}
+
+
+def http_error(status):
+    request = httpx.Request('POST', 'https://example.com')
+    response = httpx.Response(status, request=request)
+    return httpx.HTTPStatusError(f"status {status}", request=request, response=response)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(qa_sessions.time, 'time', clock.time)
+    return clock
+
+
+@pytest.fixture
+def deleted_caches(monkeypatch):
+    """Record the Gemini context caches that ended sessions delete."""
+    deleted = []
+    monkeypatch.setattr(qa_sessions, 'delete_gemini_cache_async', deleted.append)
+    monkeypatch.setattr(qa_sessions, 'submit', lambda call: None)
+    return deleted
+
+
+def make_session(video_id='video', cache_name=None):
+    session = QASession(video_id, None, TRANSCRIPT, 'system', 'cached' if cache_name else 'inline')
+    session.cache_name = cache_name
+    return session
+
+
+def test_idle_sessions_expire_and_free_their_context_cache(clock, deleted_caches):
+    store = SessionStore(max_sessions=10, idle_seconds=60)
+    idle = make_session(cache_name='cachedContents/idle')
+    store.add(idle)
+    clock.now += 30
+    active = make_session()
+    store.add(active)
+
+    clock.now += 40
+    assert store.get(idle.id) is None
+    assert store.get(active.id) is active
+    assert deleted_caches == ['cachedContents/idle']
+    assert store.stats() == {'size': 1, 'max_size': 10, 'cached_contexts': 0, 'evictions': 1}
+
+    # Getting a session counts as using it
+    clock.now += 50
+    assert store.get(active.id) is active
+
+
+def test_least_recently_used_sessions_are_ended_beyond_the_limit(clock, deleted_caches):
+    store = SessionStore(max_sessions=2, idle_seconds=600)
+    first, second, third = make_session('a'), make_session('b'), make_session('c')
+    store.add(first)
+    clock.now += 1
+    store.add(second)
+    clock.now += 1
+    store.get(first.id)
+    clock.now += 1
+    store.add(third)
+
+    assert len(store) == 2
+    assert store.get(second.id) is None
+    assert store.get(first.id) is first and store.get(third.id) is third
+    assert store.remove(first.id)
+    assert not store.remove(first.id)
+
+
+def test_unusable_context_cache_falls_back_to_the_inline_transcript(monkeypatch):
+    requests = []
+
+    async def fake_request(task, prompt, history=None, system=None, cached_content=None):
+        requests.append({'cached_content': cached_content, 'system': system, 'history': history})
+        if cached_content:
+            raise http_error(404)
+        return gemini_answer('About 27 days.')
+
+    monkeypatch.setattr(qa_sessions, 'send_gemini_request_async', fake_request)
+    session = make_session(cache_name='cachedContents/expired')
+    session.cache_expires_at = qa_sessions.time.time() + 10 * qa_sessions.QA_SESSION_IDLE_SECONDS
+
+    assert asyncio.run(ask_in_session(session, 'How long is an orbit?')) == 'About 27 days.'
+    assert [request['cached_content'] for request in requests] == ['cachedContents/expired', None]
+    assert requests[1]['system'] == 'system'
+    assert (session.mode, session.cache_name) == ('inline', None)
+
+    requests.clear()
+    assert asyncio.run(ask_in_session(session, 'And the sun?')) == 'About 27 days.'
+    assert requests[0]['history'] == [('user', 'How long is an orbit?'), ('model', 'About 27 days.')]
+
+
+def test_upstream_failures_keep_the_context_cache(monkeypatch):
+    async def unavailable(task, prompt, history=None, system=None, cached_content=None):
+        raise http_error(503)
+
+    monkeypatch.setattr(qa_sessions, 'send_gemini_request_async', unavailable)
+    session = make_session(cache_name='cachedContents/live')
+    session.cache_expires_at = qa_sessions.time.time() + 10 * qa_sessions.QA_SESSION_IDLE_SECONDS
+
+    with pytest.raises(QASessionError) as error:
+        asyncio.run(ask_in_session(session, 'How long is an orbit?'))
+    assert error.value.status_code == 502
+    assert (session.mode, session.cache_name) == ('cached', 'cachedContents/live')
+    assert session.history == []
+
+
+def test_history_keeps_the_most_recent_turns(monkeypatch):
+    async def answer(task, prompt, history=None, system=None, cached_content=None):
+        return gemini_answer(f"answer to {prompt}")
+
+    monkeypatch.setattr(qa_sessions, 'send_gemini_request_async', answer)
+    monkeypatch.setattr(qa_sessions, 'QA_SESSION_HISTORY_TURNS', 2)
+    session = make_session()
+    for i in range(4):
+        asyncio.run(ask_in_session(session, f"q{i}"))
+    assert session.history == [('q2', 'answer to q2'), ('q3', 'answer to q3')]
+
+
+@pytest.fixture
+def session_store(monkeypatch):
+    store = SessionStore()
+    monkeypatch.setattr(qa_sessions, 'sessions', store)
+
+    async def fake_transcript(video_id, language=None):
+        return TRANSCRIPT
+
+    monkeypatch.setattr(qa_sessions, 'get_transcript_async', fake_transcript)
+    return store
+
+
+def test_sessions_cache_pin_or_retrieve_the_transcript_by_size(monkeypatch, session_store):
+    created = []
+
+    async def create_cache(system, ttl):
+        created.append(ttl)
+        return 'cachedContents/new'
+
+    monkeypatch.setattr(qa_sessions, 'create_gemini_cache_async', create_cache)
+    monkeypatch.setattr(qa_sessions, 'QA_CONTEXT_CACHE_MIN_TOKENS', 1)
+    session = asyncio.run(start_session('video'))
+    assert (session.mode, session.cache_name) == ('cached', 'cachedContents/new')
+    assert created == [2 * qa_sessions.QA_SESSION_IDLE_SECONDS]
+    assert session_store.get(session.id) is session
+
+    monkeypatch.setattr(qa_sessions, 'QA_CONTEXT_CACHE_MIN_TOKENS', 10 ** 9)
+    assert asyncio.run(start_session('video')).mode == 'inline'
+
+    monkeypatch.setattr(qa_sessions, 'QA_SESSION_PIN_MAX_TOKENS', 10)
+    session = asyncio.run(start_session('video'))
+    assert session.mode == 'retrieval'
+    assert 'Transcript:' not in session.system
+
+
+def test_sessions_stay_inline_when_the_context_cache_cannot_be_created(monkeypatch, session_store):
+    async def create_cache(system, ttl):
+        raise http_error(400)
+
+    monkeypatch.setattr(qa_sessions, 'create_gemini_cache_async', create_cache)
+    monkeypatch.setattr(qa_sessions, 'QA_CONTEXT_CACHE_MIN_TOKENS', 1)
+    session = asyncio.run(start_session('video'))
+    assert (session.mode, session.cache_name) == ('inline', None)
+    assert '[00:04] once every 27 days' in session.system
@@ -0,0 +1,179 @@
+import asyncio
+
+import httpx
+import pytest
+
+import rate_limiter
+from rate_limiter import (
+    AdaptiveRateLimiter,
+    TokenBucket,
+    async_retry_with_backoff,
+    backoff_delay,
+    is_retryable,
+    retry_after_seconds,
+    retry_with_backoff
+)
+
+
+def http_error(status, headers=None):
+    request = httpx.Request('POST', 'https://example.com')
+    response = httpx.Response(status, headers=headers or {}, request=request)
+    return httpx.HTTPStatusError(f"status {status}", request=request, response=response)
+
+
+def test_token_bucket_hands_out_waits_in_arrival_order():
+    bucket = TokenBucket(60, burst_seconds=2)
+    bucket.updated = 0
+    assert bucket.capacity == 2
+    assert bucket.reserve(1, 0) == 0
+    assert bucket.reserve(1, 0) == 0
+    assert bucket.reserve(1, 0) == pytest.approx(1)
+    assert bucket.reserve(1, 0) == pytest.approx(2)
+    # Refilling pays off the debt before anything else is handed out
+    assert bucket.reserve(1, 3) == pytest.approx(0)
+
+
+def test_token_bucket_refunds_never_exceed_capacity():
+    bucket = TokenBucket(60, burst_seconds=2)
+    bucket.updated = 0
+    bucket.reserve(5, 0)
+    bucket.refund(10, 0)
+    assert bucket.available == 2
+
+
+def test_limiter_waits_for_the_scarcer_of_requests_and_tokens():
+    limiter = AdaptiveRateLimiter(600, 600)
+    assert limiter.reserve(tokens=100) == 0
+    wait = limiter.reserve(tokens=100)
+    # 100 tokens are missing at 10 tokens a second
+    assert wait == pytest.approx(10, abs=0.1)
+    assert limiter.stats()['total_wait'] == pytest.approx(wait, abs=0.01)
+
+
+def test_throttling_halves_the_rate_once_per_burst_and_pauses_for_retry_after():
+    limiter = AdaptiveRateLimiter(60, 1000)
+    limiter.on_throttle(retry_after=5)
+    limiter.on_throttle(retry_after=2)
+    stats = limiter.stats()
+    assert stats['scale'] == 0.5
+    assert stats['requests_per_minute'] == 30
+    assert stats['tokens_per_minute'] == 500
+    assert stats['throttled'] == 2
+    assert stats['paused_for'] == pytest.approx(5, abs=0.1)
+    assert limiter.reserve() == pytest.approx(5, abs=0.1)
+
+    for _ in range(20):
+        limiter.on_success()
+    assert limiter.stats()['scale'] == 1.0
+
+
+def test_throttling_never_goes_below_the_minimum_rate():
+    limiter = AdaptiveRateLimiter(60, 1000, min_scale=0.25)
+    for _ in range(5):
+        limiter.last_throttle = 0
+        limiter.on_throttle()
+    assert limiter.scale == 0.25
+
+
+def test_record_usage_corrects_the_token_estimate():
+    limiter = AdaptiveRateLimiter(60, 600)
+    limiter.reserve(tokens=50)
+    limiter.record_usage(50, 100)
+    assert limiter.token_bucket.available == pytest.approx(0, abs=0.1)
+    limiter.record_usage(100, 40)
+    assert limiter.token_bucket.available == pytest.approx(60, abs=0.1)
+
+
+def test_retry_after_accepts_seconds_and_dates():
+    assert retry_after_seconds(http_error(429, {'Retry-After': '7'})) == 7
+    assert retry_after_seconds(http_error(429, {'Retry-After': 'Thu, 01 Jan 1970 00:00:00 GMT'})) == 0
+    assert retry_after_seconds(http_error(429)) is None
+
+
+def test_retryable_errors():
+    assert is_retryable(http_error(429))
+    assert is_retryable(http_error(503))
+    assert not is_retryable(http_error(400))
+    assert is_retryable(httpx.ConnectError('refused'))
+    assert is_retryable(Exception('429 Too Many Requests'))
+
+    try:
+        try:
+            raise http_error(502)
+        except httpx.HTTPStatusError as e:
+            raise RuntimeError('Gemini request failed') from e
+    except RuntimeError as e:
+        assert is_retryable(e)
+
+
+def test_backoff_is_capped_but_never_shorter_than_retry_after(monkeypatch):
+    monkeypatch.setattr(rate_limiter.random, 'uniform', lambda low, high: high)
+    assert backoff_delay(0, base=1, cap=60) == 1
+    assert backoff_delay(3, base=1, cap=60) == 8
+    assert backoff_delay(10, base=1, cap=60) == 60
+    assert backoff_delay(0, retry_after=20, base=1, cap=60) == 20
+    assert backoff_delay(0, retry_after=600, base=1, cap=60) == 60
+
+
+def test_retry_with_backoff_retries_429s_and_slows_the_limiter(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(rate_limiter.time, 'sleep', sleeps.append)
+    limiter = AdaptiveRateLimiter(60, 1000)
+    attempts = []
+
+    @retry_with_backoff(max_attempts=3, limiter=limiter)
+    def call():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise http_error(429, {'Retry-After': '2'})
+        return 'ok'
+
+    assert call() == 'ok'
+    assert len(attempts) == 3
+    assert len(sleeps) == 2 and all(delay >= 2 for delay in sleeps)
+    assert limiter.stats()['throttled'] == 2
+    assert limiter.scale == 0.5
+
+
+def test_retry_with_backoff_gives_up(monkeypatch):
+    monkeypatch.setattr(rate_limiter.time, 'sleep', lambda delay: None)
+    attempts = []
+
+    @retry_with_backoff(max_attempts=3)
+    def unavailable():
+        attempts.append(1)
+        raise http_error(503)
+
+    @retry_with_backoff(max_attempts=3)
+    def bad_request():
+        attempts.append(1)
+        raise http_error(400)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        unavailable()
+    assert len(attempts) == 3
+
+    attempts.clear()
+    with pytest.raises(httpx.HTTPStatusError):
+        bad_request()
+    assert len(attempts) == 1
+
+
+def test_async_retry_waits_on_the_event_loop(monkeypatch):
+    sleeps = []
+
+    async def fake_sleep(delay):
+        sleeps.append(delay)
+
+    monkeypatch.setattr(rate_limiter.asyncio, 'sleep', fake_sleep)
+    attempts = []
+
+    @async_retry_with_backoff(max_attempts=2)
+    async def call():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise http_error(429, {'Retry-After': '3'})
+        return 'ok'
+
+    assert asyncio.run(call()) == 'ok'
+    assert sleeps and sleeps[0] >= 3
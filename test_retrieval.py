@@ -0,0 +1,82 @@
+import retrieval
+from retrieval import PassageIndex, get_passage_index, get_question_context, tokenize
+from transcript_columns import Transcript
+
+FILLER = 'we talked about the weather and the traffic on the way in'
+
+
+def make_segments(texts, duration=5.0):
+    return [{'text': text, 'start': i * duration, 'duration': duration} for i, text in enumerate(texts)]
+
+
+def test_tokenize_drops_stopwords_and_punctuation():
+    assert tokenize('What is the Speed of Light, in a vacuum?') == ['speed', 'light', 'vacuum']
+
+
+def test_search_ranks_the_passage_about_the_question_first():
+    texts = [FILLER] * 30
+    texts[12] = 'photosynthesis turns sunlight into chemical energy in the leaves'
+    texts[25] = 'sunlight also warms the oceans'
+    index = PassageIndex(make_segments(texts), window_size=4)
+
+    results = index.search('how does photosynthesis use sunlight', k=3)
+    assert results
+    assert results[0]['start'] <= 12 * 5.0 < results[0]['start'] + results[0]['duration']
+    assert 'photosynthesis' in results[0]['text']
+    assert [result['score'] for result in results] == sorted((result['score'] for result in results), reverse=True)
+    assert index.search('quantum chromodynamics') == []
+
+
+def test_rare_terms_outweigh_common_ones():
+    texts = [f"{FILLER} energy" for _ in range(20)]
+    texts[3] = 'mitochondria make energy'
+    texts[15] = 'energy energy energy'
+    index = PassageIndex(make_segments(texts), window_size=2)
+
+    best = index.search('mitochondria energy', k=1)[0]
+    assert 'mitochondria' in best['text']
+
+
+def test_context_merges_overlapping_passages_in_video_order():
+    texts = [FILLER] * 40
+    texts[30] = 'the second law of thermodynamics says entropy increases'
+    texts[5] = 'entropy is a measure of disorder'
+    index = PassageIndex(make_segments(texts), window_size=4)
+
+    context = index.context_for('entropy', k=4)
+    assert context.startswith('Relevant excerpts from the transcript:')
+    excerpts = context.split('\n\n')[1:]
+    assert len(excerpts) == 2
+    assert 'disorder' in excerpts[0] and 'thermodynamics' in excerpts[1]
+    assert excerpts[0].startswith('[00:')
+
+
+def test_context_falls_back_to_the_start_of_the_video():
+    index = PassageIndex(make_segments([FILLER] * 10), window_size=4)
+    context = index.context_for('quantum chromodynamics', k=1)
+    assert '[00:00-00:20]' in context
+
+
+def test_short_transcripts_are_sent_whole(monkeypatch):
+    monkeypatch.setattr(retrieval, 'QA_FULL_TRANSCRIPT_MAX_CHARS', 10000)
+    segments = make_segments([FILLER] * 5)
+    context = get_question_context('short', segments, 'weather?')
+    assert isinstance(context, Transcript)
+    assert context.texts == [FILLER] * 5
+
+
+def test_long_transcripts_get_relevant_passages_and_a_cached_index(monkeypatch):
+    monkeypatch.setattr(retrieval, 'QA_FULL_TRANSCRIPT_MAX_CHARS', 100)
+    texts = [FILLER] * 50
+    texts[20] = 'volcanoes form where tectonic plates meet'
+    segments = make_segments(texts)
+
+    context = get_question_context('long', segments, 'where do volcanoes form')
+    assert isinstance(context, str)
+    assert 'volcanoes' in context
+    assert len(context) < sum(len(text) for text in texts)
+
+    index = get_passage_index('long', Transcript.from_segments(segments))
+    assert get_passage_index('long', Transcript.from_segments(segments)) is index
+    texts[20] = 'volcanoes form above hot spots'
+    assert get_passage_index('long', Transcript.from_segments(make_segments(texts))) is not index
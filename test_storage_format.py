@@ -0,0 +1,77 @@
+import json
+import zlib
+
+import numpy as np
+import pytest
+
+import database
+from storage_format import pack_json, pack_transcript, unpack_json, unpack_transcript
+from transcript_columns import Transcript
+
+SEGMENTS = [
+    {'text': 'welcome back', 'start': 0.0, 'duration': 2.5},
+    {'text': 'café, naïve and 東京 🎉', 'start': 2.5, 'duration': 3.25},
+    {'text': '', 'start': 5.75, 'duration': 0.5}
+]
+FACT_CHECK = {'results': [{'claim': 'Water boils at 100°C', 'status': 'TRUE', 'references': []}]}
+
+
+def test_json_round_trips_compressed():
+    data = pack_json(FACT_CHECK)
+    assert isinstance(data, bytes)
+    assert unpack_json(data) == FACT_CHECK
+    assert unpack_json(pack_json('plain summary')) == 'plain summary'
+
+
+def test_json_accepts_legacy_text():
+    assert unpack_json(json.dumps(FACT_CHECK)) == FACT_CHECK
+
+
+def test_transcripts_round_trip_as_columns():
+    transcript = unpack_transcript(pack_transcript(SEGMENTS))
+    assert isinstance(transcript, Transcript)
+    assert transcript.texts == [entry['text'] for entry in SEGMENTS]
+    assert np.array_equal(transcript.starts, [0.0, 2.5, 5.75])
+    assert np.array_equal(transcript.durations, [2.5, 3.25, 0.5])
+
+    assert len(unpack_transcript(pack_transcript([]))) == 0
+
+
+def test_transcripts_accept_legacy_json_lists():
+    transcript = unpack_transcript(json.dumps(SEGMENTS))
+    assert transcript.texts == [entry['text'] for entry in SEGMENTS]
+    assert np.array_equal(transcript.starts, [0.0, 2.5, 5.75])
+
+
+def test_unknown_transcript_formats_are_rejected():
+    with pytest.raises(ValueError):
+        unpack_transcript(zlib.compress(b'TR9\x00'))
+
+
+def test_analyses_stored_before_compression_still_load(db):
+    with database.get_connection() as conn:
+        conn.execute('''
+            INSERT INTO video_analysis (video_id, video_url, video_info, summary, key_points, fact_check, transcript)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', ('old', 'https://youtu.be/old', json.dumps({'title': 'Old'}), 'A plain text summary',
+              json.dumps(['point']), json.dumps(FACT_CHECK), json.dumps(SEGMENTS)))
+
+    analysis = database.get_analysis('old')
+    assert analysis['video_info'] == {'title': 'Old'}
+    assert analysis['summary'] == 'A plain text summary'
+    assert analysis['key_points'] == ['point']
+    assert analysis['fact_check'] == FACT_CHECK
+    assert analysis['transcript'].texts == [entry['text'] for entry in SEGMENTS]
+
+
+def test_analyses_and_transcripts_round_trip_through_the_database(db):
+    database.save_analysis('new', 'https://youtu.be/new', {'title': 'New'}, 'Summary', ['point'], FACT_CHECK, SEGMENTS)
+    analysis = database.get_analysis('new')
+    assert analysis['summary'] == 'Summary'
+    assert analysis['fact_check'] == FACT_CHECK
+    assert analysis['transcript'].texts == [entry['text'] for entry in SEGMENTS]
+
+    database.save_transcript('new', Transcript.from_segments(SEGMENTS), language_code='en', is_generated=True)
+    stored = database.get_stored_transcript('new')
+    assert stored['language_code'] == 'en' and stored['is_generated'] is True
+    assert np.array_equal(stored['transcript'].durations, [2.5, 3.25, 0.5])
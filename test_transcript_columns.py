@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from transcript_columns import Transcript, format_timestamps
+from utils import format_timestamp
+
+
+def make_transcript(durations):
+    durations = np.asarray(durations, dtype=np.float64)
+    starts = np.cumsum(durations) - durations
+    return Transcript([f"segment {i}" for i in range(len(durations))], starts, durations)
+
+
+def greedy_chunk_bounds(durations, chunk_size):
+    """The loop chunk_bounds replaced: fill each chunk until the next segment would overflow it."""
+    chunks = []
+    current = []
+    current_duration = 0
+    for i, duration in enumerate(durations):
+        if current_duration + duration > chunk_size:
+            chunks.append(current)
+            current = [i]
+            current_duration = duration
+        else:
+            current.append(i)
+            current_duration += duration
+    if current:
+        chunks.append(current)
+    return [(chunk[0], chunk[-1] + 1) for chunk in chunks if chunk]
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_chunk_bounds_matches_greedy_loop(seed):
+    random = np.random.RandomState(seed)
+    count = random.randint(1, 2000)
+    # Durations with few decimals make chunks that add up to exactly 120s
+    if seed % 3 == 0:
+        durations = random.choice([0.0, 0.5, 1.0, 1.5, 2.0, 3.0, 4.0], count)
+    elif seed % 3 == 1:
+        durations = np.round(random.uniform(0, 3, count), 1)
+    else:
+        durations = np.round(random.uniform(0, 8, count), 2)
+    transcript = make_transcript(durations)
+    assert transcript.chunk_bounds(120) == greedy_chunk_bounds(durations.tolist(), 120)
+
+
+def test_chunk_bounds_keeps_long_segments_in_their_own_chunk():
+    assert make_transcript([150, 10, 200, 5]).chunk_bounds(120) == [(0, 1), (1, 2), (2, 3), (3, 4)]
+    assert make_transcript([]).chunk_bounds(120) == []
+
+
+def test_chunk_bounds_of_slice_starting_at_a_chunk_match_the_full_transcript():
+    durations = np.round(np.random.RandomState(7).uniform(0, 8, 3000), 2)
+    transcript = make_transcript(durations)
+    bounds = transcript.chunk_bounds(120)
+    start = bounds[5][0]
+    shifted = [(chunk_start - start, chunk_end - start) for chunk_start, chunk_end in bounds[5:]]
+    assert transcript[start:].chunk_bounds(120) == shifted
+
+
+def test_slices_are_views_with_matching_texts():
+    transcript = make_transcript([1.0] * 10)
+    part = transcript[3:6]
+    assert len(part) == 3
+    assert part.texts == ['segment 3', 'segment 4', 'segment 5']
+    assert part[0].start == 3.0
+    assert part.starts.base is not None
+
+
+def test_format_timestamps_matches_format_timestamp():
+    seconds = [0, 0.99, 59.5, 60, 3599.9, 3600, 7 * 3600 + 61.2]
+    assert format_timestamps(seconds) == [format_timestamp(value) for value in seconds]
@@ -0,0 +1,185 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from transcript_providers import (
+    ArchiveTranscriptProvider,
+    ChainedTranscriptProvider,
+    LocalFileTranscriptProvider,
+    TranscriptNotFoundError,
+    create_transcript_provider,
+    parse_caption_timestamp,
+    parse_cues,
+    parse_json_transcript,
+    write_transcript_archive
+)
+
+VIDEO_ID = 'dQw4w9WgXcQ'
+OTHER_VIDEO_ID = 'jNQXAC9IVRw'
+
+VTT = """WEBVTT
+Kind: captions
+Language: en
+
+00:00:01.000 --> 00:00:03.500 align:start position:0%
+never gonna <c.colorE5E5E5><00:00:02.000>give</c> you up
+
+NOTE a comment block
+
+00:00:03.500 --> 00:00:06.000
+never gonna
+let you down
+"""
+
+SRT = """1\r
+00:00:01,000 --> 00:00:03,500\r
+<i>hello</i> there\r
+\r
+2\r
+00:01:02,250 --> 00:01:04,000\r
+general kenobi\r
+"""
+
+
+def test_caption_timestamps():
+    assert parse_caption_timestamp('00:00:01.500') == 1.5
+    assert parse_caption_timestamp('01:02:03,250') == 3723.25
+    assert parse_caption_timestamp('02:03.5') == 123.5
+
+
+def test_vtt_cues_drop_headers_notes_and_inline_tags():
+    assert parse_cues(VTT) == [
+        {'text': 'never gonna give you up', 'start': 1.0, 'duration': 2.5},
+        {'text': 'never gonna let you down', 'start': 3.5, 'duration': 2.5}
+    ]
+
+
+def test_srt_cues():
+    assert parse_cues(SRT) == [
+        {'text': 'hello there', 'start': 1.0, 'duration': 2.5},
+        {'text': 'general kenobi', 'start': 62.25, 'duration': 1.75}
+    ]
+
+
+def test_json_transcripts_are_lists_or_records():
+    segments = [{'text': 'hi', 'start': 0.0, 'duration': 1.0}]
+    assert parse_json_transcript(json.dumps(segments)) == (segments, None, None)
+    record = {'transcript': segments, 'language_code': 'de', 'is_generated': False}
+    assert parse_json_transcript(json.dumps(record)) == (segments, 'de', False)
+
+
+def test_local_files_are_matched_by_video_id_and_language(tmp_path):
+    (tmp_path / f"{VIDEO_ID}.en.vtt").write_text(VTT, encoding='utf-8')
+    (tmp_path / f"{VIDEO_ID}.fr.srt").write_text(SRT, encoding='utf-8')
+    record = {'transcript': [{'text': 'hallo', 'start': 0.0, 'duration': 1.0}], 'language_code': 'de', 'is_generated': True}
+    (tmp_path / f"{OTHER_VIDEO_ID}.json").write_text(json.dumps(record), encoding='utf-8')
+    provider = LocalFileTranscriptProvider(str(tmp_path))
+
+    transcript, language, is_generated = provider.fetch(VIDEO_ID, 'fr')
+    assert transcript[0]['text'] == 'hello there'
+    assert (language, is_generated) == ('fr', None)
+    assert provider.fetch(VIDEO_ID)[1] == 'en'
+    assert provider.fetch(OTHER_VIDEO_ID)[1:] == ('de', True)
+
+    with pytest.raises(TranscriptNotFoundError):
+        provider.fetch(VIDEO_ID, 'es')
+    # Ids and languages never reach the file system unless they look valid
+    with pytest.raises(TranscriptNotFoundError):
+        provider.fetch('../../etc/passwd')
+    with pytest.raises(TranscriptNotFoundError):
+        provider.fetch(VIDEO_ID, '../en')
+
+
+def test_archives_serve_transcripts_by_video_and_language(tmp_path):
+    path = str(tmp_path / 'transcripts.archive')
+    english = [{'text': 'hello', 'start': 0.0, 'duration': 1.5}, {'text': 'world', 'start': 1.5, 'duration': 2.0}]
+    generated = [{'text': 'hello (auto)', 'start': 0.0, 'duration': 3.5}]
+    count = write_transcript_archive(path, [
+        (VIDEO_ID, 'en', False, english),
+        (VIDEO_ID, 'en-auto', True, generated),
+        (OTHER_VIDEO_ID, 'fr', False, [{'text': 'bonjour', 'start': 0.0, 'duration': 1.0}]),
+        # A later record for the same track replaces the earlier one
+        (OTHER_VIDEO_ID, 'fr', False, [{'text': 'salut', 'start': 0.0, 'duration': 1.0}])
+    ])
+    assert count == 3
+    assert not os.path.exists(f"{path}.tmp")
+
+    provider = ArchiveTranscriptProvider(path)
+    assert len(provider) == 2
+    transcript, language, is_generated = provider.fetch(VIDEO_ID, 'en')
+    assert transcript.texts == ['hello', 'world']
+    assert np.array_equal(transcript.durations, [1.5, 2.0])
+    assert (language, is_generated) == ('en', False)
+    # Without a language the auto-generated track is preferred, as on YouTube
+    assert provider.fetch(VIDEO_ID)[0].texts == ['hello (auto)']
+    assert provider.fetch(OTHER_VIDEO_ID)[0].texts == ['salut']
+    assert sorted((video_id, language) for video_id, language, _, _ in provider.records()) == [
+        (VIDEO_ID, 'en'), (VIDEO_ID, 'en-auto'), (OTHER_VIDEO_ID, 'fr')
+    ]
+    with pytest.raises(TranscriptNotFoundError):
+        provider.fetch(VIDEO_ID, 'de')
+
+    write_transcript_archive(path, [(VIDEO_ID, 'en', False, [{'text': 'replaced', 'start': 0.0, 'duration': 1.0}])])
+    # Make sure the new file's modification time differs even on coarse clocks
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert provider.fetch(VIDEO_ID)[0].texts == ['replaced']
+    assert len(provider) == 1
+
+
+def test_missing_archives_have_no_transcripts(tmp_path):
+    provider = ArchiveTranscriptProvider(str(tmp_path / 'missing.archive'))
+    with pytest.raises(TranscriptNotFoundError):
+        provider.fetch(VIDEO_ID)
+    assert list(provider.records()) == []
+
+
+def test_archives_must_have_the_archive_header(tmp_path):
+    path = tmp_path / 'not.archive'
+    path.write_bytes(b'\0' * 64)
+    with pytest.raises(ValueError):
+        ArchiveTranscriptProvider(str(path)).fetch(VIDEO_ID)
+
+
+class FakeProvider:
+    def __init__(self, name, result=None, error=None):
+        self.name = name
+        self.result = result
+        self.error = error
+        self.calls = 0
+
+    def fetch(self, video_id, language=None):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return self.result
+
+
+def test_chained_providers_fall_through_until_one_has_the_transcript():
+    missing = FakeProvider('local', error=TranscriptNotFoundError('no file'))
+    found = FakeProvider('archive', result=([], 'en', None))
+    unused = FakeProvider('youtube', result=([], 'fr', None))
+    assert ChainedTranscriptProvider([missing, found, unused]).fetch(VIDEO_ID) == ([], 'en', None)
+    assert unused.calls == 0
+
+
+def test_chained_providers_report_outages_over_missing_transcripts():
+    outage = FakeProvider('youtube', error=ConnectionError('down'))
+    missing = FakeProvider('local', error=TranscriptNotFoundError('no file'))
+    with pytest.raises(ConnectionError):
+        ChainedTranscriptProvider([outage, missing]).fetch(VIDEO_ID)
+    with pytest.raises(TranscriptNotFoundError):
+        ChainedTranscriptProvider([missing, missing]).fetch(VIDEO_ID)
+
+
+def test_providers_are_created_from_their_names():
+    chain = create_transcript_provider('local, archive')
+    assert isinstance(chain, ChainedTranscriptProvider)
+    assert chain.name == 'local,archive'
+    assert isinstance(create_transcript_provider('Local'), LocalFileTranscriptProvider)
+    with pytest.raises(ValueError):
+        create_transcript_provider('ftp')
+    with pytest.raises(ValueError):
+        create_transcript_provider(' , ')
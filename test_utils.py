@@ -0,0 +1,69 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import utils
+from metrics import cache_requests
+from transcript_columns import Transcript
+from utils import SegmentIntervalIndex, process_transcript_with_fact_check
+
+
+def overlapping_by_scan(transcript, start, end):
+    return [i for i, segment in enumerate(transcript) if segment.start < end and segment.start + segment.duration > start]
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_interval_index_matches_a_linear_scan(seed):
+    random = np.random.RandomState(seed)
+    count = random.randint(0, 300)
+    # Unsorted, overlapping and zero-length segments
+    starts = np.round(random.uniform(0, 600, count), 1)
+    durations = np.round(random.choice([0.0, 1.0, 4.5, 30.0, 120.0], count), 1)
+    transcript = Transcript([f"segment {i}" for i in range(count)], starts, durations)
+    index = SegmentIntervalIndex(transcript)
+
+    for start in random.uniform(-10, 700, 40).tolist():
+        end = start + float(random.choice([0.5, 1, 10, 200]))
+        assert sorted(index.overlapping(start, end)) == overlapping_by_scan(transcript, start, end)
+
+
+def test_interval_index_excludes_touching_segments():
+    transcript = Transcript(['a', 'b', 'c'], [0.0, 5.0, 10.0], [5.0, 5.0, 5.0])
+    index = SegmentIntervalIndex(transcript)
+    assert index.overlapping(5, 10) == [1]
+    assert index.overlapping(4.9, 10.1) == [0, 1, 2]
+    assert index.overlapping(20, 30) == []
+
+
+def test_fact_checks_attach_to_every_overlapped_segment_in_start_order():
+    transcript = Transcript(['a', 'b', 'c', 'd'], [0.0, 4.0, 8.0, 12.0], [4.0, 4.0, 4.0, 4.0])
+    fact_check = {'results': [
+        {'claim': 'later', 'status': 'TRUE', 'timestamp_range': '00:08-00:09'},
+        {'claim': 'earlier', 'status': 'FALSE', 'timestamp_range': '00:05-00:08'},
+        {'claim': 'no time', 'status': 'TRUE'}
+    ]}
+    segments = process_transcript_with_fact_check(transcript, fact_check).to_list()
+    assert [[check['claim'] for check in segment['fact_checks']] for segment in segments] == [
+        [], ['earlier'], ['earlier', 'later'], []
+    ]
+    assert segments[2]['fact_check']['claim'] == 'earlier'
+    assert segments[0]['fact_check'] is None
+
+
+def test_transcript_memory_misses_are_counted_once(db, monkeypatch):
+    monkeypatch.setattr(utils, 'fetch_transcript', lambda video_id, language=None: (
+        [{'text': 'hello', 'start': 0.0, 'duration': 1.0}], 'en', False
+    ))
+    utils.transcript_cache.clear()
+    misses = cache_requests.value(cache='transcript_memory', result='miss')
+    hits = cache_requests.value(cache='transcript_memory', result='hit')
+    lru_misses, lru_hits = utils.transcript_cache.misses, utils.transcript_cache.hits
+
+    record = asyncio.run(utils.get_transcript_record_async('video', 'en'))
+    assert record['transcript'].texts == ['hello']
+    assert asyncio.run(utils.get_transcript_record_async('video', 'en')) is record
+
+    assert cache_requests.value(cache='transcript_memory', result='miss') == misses + 1
+    assert cache_requests.value(cache='transcript_memory', result='hit') == hits + 1
+    assert (utils.transcript_cache.misses, utils.transcript_cache.hits) == (lru_misses + 1, lru_hits + 1)
@@ -0,0 +1,231 @@
+import threading
+
+import numpy as np
+
+
+class Segment:
+    """One transcript segment.
+    
+    Supports segment['text']-style access so code written against the
+    dicts returned by the transcript API works unchanged.
+    """
+
+    __slots__ = ('text', 'start', 'duration')
+
+    def __init__(self, text, start, duration):
+        self.text = text
+        self.start = start
+        self.duration = duration
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def to_dict(self):
+        return {'text': self.text, 'start': self.start, 'duration': self.duration}
+
+
+class Transcript:
+    """A transcript stored as parallel columns, shared by every stage of an analysis.
+    
+    Start times and durations are NumPy arrays and the texts a list, so
+    chunking, windowing and timestamp formatting work on whole columns
+    instead of looping over segment dicts. Slicing returns a view over the
+    same columns rather than a copy. Fact-check annotations are kept beside
+    the columns, and nothing is turned into dicts until to_list() is called
+    when the response is serialized.
+    """
+
+    __slots__ = ('_texts', '_offset', '_length', 'starts', 'durations', '_fact_checks')
+
+    def __init__(self, texts, starts, durations, offset=0, length=None, fact_checks=None):
+        self._texts = texts
+        self._offset = offset
+        self._length = len(texts) - offset if length is None else length
+        self.starts = np.asarray(starts, dtype=np.float64)
+        self.durations = np.asarray(durations, dtype=np.float64)
+        # Fact checks per segment, keyed by position in the full transcript
+        self._fact_checks = fact_checks
+
+    @classmethod
+    def from_segments(cls, transcript):
+        """Build a transcript from a list of segment dicts (or return it if it already is one)."""
+        if isinstance(transcript, cls):
+            return transcript
+        count = len(transcript)
+        return cls(
+            [entry['text'] for entry in transcript],
+            np.fromiter((entry['start'] for entry in transcript), dtype=np.float64, count=count),
+            np.fromiter((entry['duration'] for entry in transcript), dtype=np.float64, count=count)
+        )
+
+    def __len__(self):
+        return self._length
+
+    def __bool__(self):
+        return self._length > 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._length)
+            if step != 1:
+                raise ValueError('Transcript slices must be contiguous')
+            stop = max(start, stop)
+            return Transcript(
+                self._texts, self.starts[start:stop], self.durations[start:stop],
+                offset=self._offset + start, length=stop - start, fact_checks=self._fact_checks
+            )
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('Transcript index out of range')
+        return Segment(self._texts[self._offset + index], float(self.starts[index]), float(self.durations[index]))
+
+    def __iter__(self):
+        for text, start, duration in zip(self.texts, self.starts.tolist(), self.durations.tolist()):
+            yield Segment(text, start, duration)
+
+    @property
+    def texts(self):
+        return self._texts[self._offset:self._offset + self._length]
+
+    @property
+    def ends(self):
+        return self.starts + self.durations
+
+    def text_lengths(self):
+        return np.fromiter((len(text) for text in self.texts), dtype=np.int64, count=self._length)
+
+    def with_fact_checks(self, fact_checks):
+        """The same transcript with fact checks attached, given as {segment index: [fact_check, ...]}."""
+        absolute = {self._offset + i: checks for i, checks in fact_checks.items()}
+        return Transcript(
+            self._texts, self.starts, self.durations,
+            offset=self._offset, length=self._length, fact_checks=absolute
+        )
+
+    def to_list(self):
+        """Serialize to the list of dicts sent in API responses."""
+        texts = self.texts
+        starts = self.starts.tolist()
+        durations = self.durations.tolist()
+        if self._fact_checks is None:
+            return [
+                {'text': text, 'start': start, 'duration': duration}
+                for text, start, duration in zip(texts, starts, durations)
+            ]
+        
+        start_labels = format_timestamps(self.starts)
+        end_labels = format_timestamps(self.ends)
+        segments = []
+        for i, (text, start, duration) in enumerate(zip(texts, starts, durations)):
+            fact_checks = self._fact_checks.get(self._offset + i, [])
+            segments.append({
+                'text': text,
+                'timestamp': start_labels[i],
+                'timestamp_range': f"{start_labels[i]}-{end_labels[i]}",
+                'start': start,
+                'duration': duration,
+                'fact_check': fact_checks[0] if fact_checks else None,
+                'fact_checks': fact_checks
+            })
+        return segments
+
+    def chunk_bounds(self, chunk_size):
+        """(start, end) index pairs of consecutive chunks of at most chunk_size seconds.
+
+        Matches filling each chunk greedily: a segment starts a new chunk when
+        adding its duration would take the current chunk over chunk_size. A
+        chunk always holds at least one segment.
+
+        Differences of a whole-transcript running sum round differently from
+        a sum restarted at each chunk, which moves boundaries where a chunk
+        adds up to exactly chunk_size. So the whole-transcript sum only gives
+        a first guess at each chunk's end, and the chunk's own running sum,
+        added up in the same order as the greedy loop, decides it.
+        """
+        durations = self.durations
+        cumulative = np.concatenate(([0.0], np.cumsum(durations)))
+        bounds = []
+        start = 0
+        count = len(self)
+        while start < count:
+            guess = int(np.searchsorted(cumulative, cumulative[start] + chunk_size, side='right'))
+            stop = min(max(guess, start + 1) + 8, count)
+            while True:
+                over = np.flatnonzero(np.cumsum(durations[start:stop])[1:] > chunk_size)
+                if len(over):
+                    end = start + 1 + int(over[0])
+                    break
+                if stop == count:
+                    end = count
+                    break
+                stop = min(stop + (stop - start), count)
+            bounds.append((start, end))
+            start = end
+        return bounds
+
+    def window_bounds(self, window_size, step):
+        """(start, end) index pairs of overlapping windows of window_size segments."""
+        starts = np.arange(0, len(self), step)
+        ends = np.minimum(starts + window_size, len(self))
+        return list(zip(starts.tolist(), ends.tolist()))
+
+    def windows(self, window_size, step):
+        """Merge overlapping windows of segments into single segments."""
+        bounds = self.window_bounds(window_size, step)
+        if not bounds:
+            return []
+        first = np.array([start for start, _ in bounds])
+        last = np.array([end - 1 for _, end in bounds])
+        window_starts = self.starts[first]
+        window_durations = self.ends[last] - window_starts
+        texts = self.texts
+        return [
+            {'text': ' '.join(texts[start:end]), 'start': start_time, 'duration': duration}
+            for (start, end), start_time, duration in zip(bounds, window_starts.tolist(), window_durations.tolist())
+        ]
+
+
+# MM:SS labels for every whole second up to 100 hours are built once and
+# reused; later times are formatted on each call
+LABEL_TABLE_MAX_SECONDS = 100 * 60 * 60
+
+_labels = []
+_labels_lock = threading.Lock()
+
+
+def _label(value):
+    return f"{value // 60:02d}:{value % 60:02d}"
+
+
+def _label_table(max_seconds):
+    """The shared list of labels, extended to cover max_seconds."""
+    if len(_labels) <= max_seconds:
+        with _labels_lock:
+            _labels.extend(_label(value) for value in range(len(_labels), max_seconds + 1))
+    return _labels
+
+
+def format_timestamps(seconds):
+    """Format an array of times in seconds as MM:SS labels, all at once.
+
+    Gives the same labels as format_timestamp.
+    """
+    whole_seconds = np.floor(np.asarray(seconds, dtype=np.float64)).astype(np.int64)
+    if not len(whole_seconds):
+        return []
+    highest = int(whole_seconds.max())
+    if whole_seconds.min() >= 0 and highest <= LABEL_TABLE_MAX_SECONDS:
+        labels = _label_table(highest)
+        return [labels[value] for value in whole_seconds.tolist()]
+    return [_label(value) for value in whole_seconds.tolist()]
+
+
+def json_default(value):
+    """json.dumps default= hook that serializes transcripts."""
+    if isinstance(value, Transcript):
+        return value.to_list()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
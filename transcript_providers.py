@@ -0,0 +1,356 @@
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import traceback
+
+from youtube_transcript_api import YouTubeTranscriptApi
+
+from circuit_breaker import transcript_breaker
+from rate_limiter import retry_with_backoff
+from storage_format import pack_transcript, unpack_transcript
+
+# Where transcripts come from, tried in order: 'youtube' (the YouTube
+# transcript API), 'local' (WebVTT, SRT or JSON files in TRANSCRIPT_DIR) and
+# 'archive' (a memory-mapped archive written by prefetch.py)
+TRANSCRIPT_PROVIDERS = os.getenv('TRANSCRIPT_PROVIDERS', 'youtube')
+TRANSCRIPT_DIR = os.getenv('TRANSCRIPT_DIR', 'transcripts')
+TRANSCRIPT_ARCHIVE_PATH = os.getenv('TRANSCRIPT_ARCHIVE_PATH', 'transcripts.archive')
+
+# Transcript API errors that mean the video has no usable transcript
+NOT_FOUND_ERRORS = {'NoTranscriptFound', 'NoTranscriptAvailable', 'TranscriptsDisabled', 'VideoUnavailable'}
+
+VIDEO_ID_PATTERN = re.compile(r'[0-9A-Za-z_-]{11}')
+LANGUAGE_PATTERN = re.compile(r'[0-9A-Za-z_-]{1,20}')
+
+
+class TranscriptNotFoundError(Exception):
+    """A provider has no transcript for the video (in the requested language)."""
+
+
+class YouTubeTranscriptProvider:
+    """Fetches transcripts from YouTube, preferring the auto-generated track in the video's language."""
+
+    name = 'youtube'
+
+    def fetch(self, video_id, language=None):
+        return fetch_youtube_transcript(video_id, language)
+
+
+@retry_with_backoff(max_attempts=3)
+@transcript_breaker.protect
+def fetch_youtube_transcript(video_id, language=None):
+    """Fetch a transcript from YouTube in the requested language, or the video's original language.
+
+    Returns (transcript, language_code, is_generated).
+    """
+    try:
+        print(f"\nGetting transcript for video ID: {video_id}")
+
+        # Get list of available transcripts
+        print("Fetching available transcripts...")
+        transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
+
+        available_transcript = None
+
+        if language:
+            print(f"Looking for transcript in {language}...")
+            try:
+                available_transcript = transcript_list.find_transcript([language])
+            except Exception as e:
+                print(f"Error finding transcript in {language}: {str(e)}")
+                raise TranscriptNotFoundError(f"No transcript available in {language}")
+        else:
+            # Try to find auto-generated transcript in video's language
+            print("Looking for auto-generated transcript...")
+            for transcript_info in transcript_list:
+                if transcript_info.is_generated:
+                    print(f"Found auto-generated transcript in {transcript_info.language_code}")
+                    available_transcript = transcript_info
+                    break
+
+            if not available_transcript:
+                print("No auto-generated transcripts found, looking for manual transcripts...")
+                try:
+                    available_transcript = transcript_list.find_manually_created_transcript()
+                    print(f"Found manual transcript in {available_transcript.language_code}")
+                except Exception as e:
+                    print(f"Error finding manual transcript: {str(e)}")
+
+        if not available_transcript:
+            print("No transcripts available for this video")
+            raise TranscriptNotFoundError("No transcripts available for this video")
+
+        # Get the transcript in the chosen language
+        print(f"Fetching transcript in {available_transcript.language_code}...")
+        transcript = available_transcript.fetch()
+        print(f"Successfully retrieved {len(transcript)} transcript segments")
+
+        return transcript, available_transcript.language_code, available_transcript.is_generated
+
+    except Exception as e:
+        print(f"Error in fetch_youtube_transcript: {str(e)}")
+        print("Traceback:")
+        print(traceback.format_exc())
+        not_found = isinstance(e, TranscriptNotFoundError) or type(e).__name__ in NOT_FOUND_ERRORS
+        error_type = TranscriptNotFoundError if not_found else Exception
+        raise error_type(f"Error fetching transcript: {str(e)}") from e
+
+
+def parse_caption_timestamp(value):
+    """Seconds from an SRT or WebVTT timestamp: HH:MM:SS,mmm, HH:MM:SS.mmm or MM:SS.mmm."""
+    parts = value.strip().replace(',', '.').split(':')
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+CUE_TIMING = re.compile(r'([\d:.,]+)\s*-->\s*([\d:.,]+)')
+CUE_TAG = re.compile(r'<[^>]*>')
+
+
+def parse_cues(text):
+    """Segments from the cue blocks of an SRT or WebVTT file."""
+    transcript = []
+    for block in re.split(r'\n\s*\n', text.replace('\r\n', '\n').strip()):
+        lines = block.split('\n')
+        for i, line in enumerate(lines):
+            match = CUE_TIMING.search(line)
+            if match:
+                start = parse_caption_timestamp(match.group(1))
+                end = parse_caption_timestamp(match.group(2))
+                # Inline styling and karaoke timestamps are not part of the text
+                caption = ' '.join(CUE_TAG.sub('', cue_line).strip() for cue_line in lines[i + 1:])
+                caption = caption.strip()
+                if caption:
+                    transcript.append({'text': caption, 'start': start, 'duration': max(0.0, end - start)})
+                break
+    return transcript
+
+
+def parse_json_transcript(text):
+    """(segments, language_code, is_generated) from a JSON list of segments or a transcript record."""
+    data = json.loads(text)
+    if isinstance(data, list):
+        return data, None, None
+    return data['transcript'], data.get('language_code'), data.get('is_generated')
+
+
+class LocalFileTranscriptProvider:
+    """Reads transcripts from files in a directory, for offline and air-gapped use.
+
+    Files are named <video id>.<language>.<ext> or <video id>.<ext>, where
+    ext is vtt, srt or json. JSON files hold either a list of segments
+    ({text, start, duration}) or an object with a transcript list and,
+    optionally, language_code and is_generated.
+    """
+
+    name = 'local'
+    extensions = ('json', 'vtt', 'srt')
+
+    def __init__(self, directory=TRANSCRIPT_DIR):
+        self.directory = directory
+
+    def find_file(self, video_id, language=None):
+        """(path, language code from the file name) of the best matching file, or (None, None)."""
+        if not VIDEO_ID_PATTERN.fullmatch(video_id or ''):
+            return None, None
+        if language and not LANGUAGE_PATTERN.fullmatch(language):
+            return None, None
+
+        names = [f"{video_id}.{language}.{ext}" for ext in self.extensions] if language else []
+        names += [f"{video_id}.{ext}" for ext in self.extensions]
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if os.path.isfile(path):
+                return path, language if name.count('.') == 2 else None
+
+        if not language:
+            # Any language will do
+            try:
+                for name in sorted(os.listdir(self.directory)):
+                    parts = name.split('.')
+                    if len(parts) == 3 and parts[0] == video_id and parts[2] in self.extensions:
+                        return os.path.join(self.directory, name), parts[1]
+            except OSError:
+                pass
+        return None, None
+
+    def fetch(self, video_id, language=None):
+        path, language_code = self.find_file(video_id, language)
+        if not path:
+            raise TranscriptNotFoundError(f"No transcript file for video ID: {video_id}")
+
+        print(f"Reading transcript from {path}")
+        with open(path, encoding='utf-8-sig') as f:
+            text = f.read()
+        is_generated = None
+        if path.endswith('.json'):
+            transcript, stored_language, is_generated = parse_json_transcript(text)
+            language_code = stored_language or language_code
+        else:
+            transcript = parse_cues(text)
+
+        if not transcript:
+            raise TranscriptNotFoundError(f"Transcript file {path} has no segments")
+        return transcript, language_code or language, is_generated
+
+
+ARCHIVE_MAGIC = b'TRA1'
+ARCHIVE_HEADER = struct.Struct('<4sQQ')
+
+
+def write_transcript_archive(path, records):
+    """Write transcripts to an archive that ArchiveTranscriptProvider can memory-map.
+
+    records yields (video_id, language_code, is_generated, transcript). The
+    file holds a header, each transcript packed as by pack_transcript, and a
+    JSON index of where each one starts. It is written to a temporary file
+    and moved into place, so readers never see a partial archive.
+    """
+    index = {}
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'wb') as f:
+        f.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, 0, 0))
+        for video_id, language_code, is_generated, transcript in records:
+            data = pack_transcript(transcript)
+            entries = index.setdefault(video_id, [])
+            entries[:] = [entry for entry in entries if entry[0] != language_code]
+            entries.append([language_code, is_generated, f.tell(), len(data)])
+            f.write(data)
+        index_offset = f.tell()
+        index_data = json.dumps(index, separators=(',', ':')).encode('utf-8')
+        f.write(index_data)
+        f.seek(0)
+        f.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, index_offset, len(index_data)))
+    os.replace(temporary_path, path)
+    return sum(len(entries) for entries in index.values())
+
+
+class ArchiveTranscriptProvider:
+    """Serves transcripts from a memory-mapped archive of pre-fetched transcripts.
+
+    Only the index is read up front. Each transcript is read from the mapping
+    when it is asked for, so the OS pages in just the parts in use and the
+    archive can be much larger than memory. The archive is reopened when
+    the file is replaced.
+    """
+
+    name = 'archive'
+
+    def __init__(self, path=TRANSCRIPT_ARCHIVE_PATH):
+        self.path = path
+        self._mapping = None
+        self._index = {}
+        self._opened_mtime = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        """Map the archive if it isn't mapped yet or the file has changed."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self._opened_mtime:
+            return True
+        with self._lock:
+            if mtime == self._opened_mtime:
+                return True
+            with open(self.path, 'rb') as f:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, index_offset, index_length = ARCHIVE_HEADER.unpack_from(mapping, 0)
+            if magic != ARCHIVE_MAGIC:
+                mapping.close()
+                raise ValueError(f"{self.path} is not a transcript archive")
+            self._index = json.loads(mapping[index_offset:index_offset + index_length])
+            # The previous mapping is left for the garbage collector, since
+            # another thread may still be reading from it
+            self._mapping = mapping
+            self._opened_mtime = mtime
+            print(f"Opened transcript archive {self.path} ({len(self._index)} videos)")
+        return True
+
+    def __len__(self):
+        self._open()
+        return len(self._index)
+
+    def _entry(self, video_id, language=None):
+        entries = self._index.get(video_id, [])
+        if language:
+            return next((entry for entry in entries if entry[0] == language), None)
+        # Like the YouTube provider, prefer the auto-generated track
+        return next((entry for entry in entries if entry[1]), entries[0] if entries else None)
+
+    def _read(self, entry):
+        mapping = self._mapping
+        language_code, is_generated, offset, length = entry
+        return unpack_transcript(mapping[offset:offset + length]), language_code, is_generated
+
+    def fetch(self, video_id, language=None):
+        if not self._open():
+            raise TranscriptNotFoundError(f"No transcript archive at {self.path}")
+        entry = self._entry(video_id, language)
+        if not entry:
+            raise TranscriptNotFoundError(f"No archived transcript for video ID: {video_id}")
+        return self._read(entry)
+
+    def records(self):
+        """Every archived transcript as (video_id, language_code, is_generated, transcript)."""
+        if not self._open():
+            return
+        for video_id, entries in list(self._index.items()):
+            for entry in entries:
+                transcript, language_code, is_generated = self._read(entry)
+                yield video_id, language_code, is_generated, transcript
+
+
+class ChainedTranscriptProvider:
+    """Tries providers in order until one has the transcript.
+
+    If none has it, raises TranscriptNotFoundError. If a provider failed for
+    another reason, that error is raised instead, so callers can tell an
+    outage from a video that has no transcript.
+    """
+
+    def __init__(self, providers):
+        self.providers = providers
+        self.name = ','.join(provider.name for provider in providers)
+
+    def fetch(self, video_id, language=None):
+        failure = None
+        for provider in self.providers:
+            try:
+                return provider.fetch(video_id, language)
+            except TranscriptNotFoundError as e:
+                not_found = e
+            except Exception as e:
+                print(f"Transcript provider {provider.name} failed: {str(e)}")
+                failure = failure or e
+        raise failure or not_found
+
+
+PROVIDER_TYPES = {
+    'youtube': YouTubeTranscriptProvider,
+    'local': LocalFileTranscriptProvider,
+    'archive': ArchiveTranscriptProvider
+}
+
+
+def create_transcript_provider(names=TRANSCRIPT_PROVIDERS):
+    """Build the provider (or chain of providers) named in a comma-separated list."""
+    providers = []
+    for name in names.split(','):
+        name = name.strip().lower()
+        if not name:
+            continue
+        if name not in PROVIDER_TYPES:
+            raise ValueError(f"Unknown transcript provider: {name}")
+        providers.append(PROVIDER_TYPES[name]())
+    if not providers:
+        raise ValueError("No transcript providers configured")
+    if len(providers) == 1:
+        return providers[0]
+    return ChainedTranscriptProvider(providers)
@@ -1,32 +1,40 @@
-from youtube_transcript_api import YouTubeTranscriptApi
 import re
 from mistralai import Mistral
 import os
 import json
-import requests
-import time
-from functools import wraps
 import traceback
+import asyncio
+import concurrent.futures
+import threading
+import numpy as np
+from http_client import async_http_get, async_http_post, async_http_request
+from transcript_columns import Transcript, format_timestamps
+from prompt_budget import (
+    LLM_PROMPT_TOKEN_BUDGET,
+    estimate_tokens,
+    estimate_transcript_tokens,
+    fits_budget,
+    pack_segments
+)
+from cache import LRUCache, SQLiteCache, ResponseCache, SingleFlight, AsyncSingleFlight
+from database import save_transcript, get_stored_transcript, delete_stored_transcript
+from rate_limiter import (
+    RETRYABLE_STATUS_CODES,
+    gemini_limiter,
+    async_retry_with_backoff
+)
+from circuit_breaker import (
+    CircuitOpenError,
+    is_upstream_failure,
+    oembed_breaker,
+    gemini_breaker
+)
+from pipeline import hedged
+from transcript_providers import create_transcript_provider
+from metrics import timed, record_cache, record_llm_usage
+from claim_store import CLAIM_CACHE_ENABLED, CLAIM_PASSAGE_MAX_SEGMENTS, find_known_passages, remember_claim
 
 
-def rate_limit_with_retry(max_retries=3, delay=5):
-    """Decorator to handle rate limiting with retries."""
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            for attempt in range(max_retries):
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    if "rate limit" in str(e).lower() and attempt < max_retries - 1:
-                        print(f"Rate limit hit, retrying in {delay * (attempt + 1)} seconds...")
-                        time.sleep(delay * (attempt + 1))  # Exponential backoff
-                        continue
-                    raise
-            return func(*args, **kwargs)
-        return wrapper
-    return decorator
-
 def extract_video_id(url):
     """Extract YouTube video ID from URL."""
     print(f"\nExtracting video ID from URL: {url}")
@@ -40,169 +48,361 @@ def extract_video_id(url):
     return None
 
 
-def get_video_info(url):
-    """Get video title and description using YouTube Data API v3."""
-    try:
-        print(f"\nGetting video info for URL: {url}")
-        video_id = extract_video_id(url)
-        if not video_id:
-            raise Exception("Invalid YouTube URL")
-
-        # Use YouTube oEmbed API (doesn't require API key)
-        oembed_url = f"https://www.youtube.com/oembed?url=https://www.youtube.com/watch?v={video_id}&format=json"
-        print(f"Fetching oEmbed data from: {oembed_url}")
-        response = requests.get(oembed_url)
-        
-        if response.status_code != 200:
-            print(f"Failed to fetch video info. Status code: {response.status_code}")
-            print(f"Response: {response.text}")
-            raise Exception("Failed to fetch video info")
-            
-        data = response.json()
-        print(f"Successfully retrieved video info: {data}")
+# Concurrent lookups for the same video share one upstream call
+video_info_async_flight = AsyncSingleFlight()
+transcript_flight = SingleFlight()
+
+YOUTUBE_OEMBED_URL = os.getenv('YOUTUBE_OEMBED_URL', 'https://www.youtube.com/oembed')
+
+# Last known info per video, served when the oEmbed API is unavailable
+VIDEO_INFO_CACHE_SIZE = int(os.getenv('VIDEO_INFO_CACHE_SIZE', 1024))
+video_info_cache = LRUCache(max_size=VIDEO_INFO_CACHE_SIZE)
+
+
+async def get_video_info_async(url):
+    """Get video title and description without blocking a thread on the request."""
+    video_id = extract_video_id(url)
+    if not video_id:
+        raise Exception("Error fetching video info: Invalid YouTube URL")
+    return await video_info_async_flight.do(video_id, fetch_video_info_async, video_id)
+
+
+def oembed_url_for(video_id):
+    # Use YouTube oEmbed API (doesn't require API key)
+    return f"{YOUTUBE_OEMBED_URL}?url=https://www.youtube.com/watch?v={video_id}&format=json"
+
+
+def parse_video_info(video_id, response):
+    """Turn an oEmbed response into the video info dict."""
+    if response.status_code != 200:
+        print(f"Failed to fetch video info. Status code: {response.status_code}")
+        print(f"Response: {response.text}")
+        raise Exception("Failed to fetch video info")
         
-        return {
-            'title': data.get('title', 'Unknown Title'),
-            'description': data.get('author_name', 'No description available'),
-            'thumbnail': data.get('thumbnail_url', f"https://img.youtube.com/vi/{video_id}/maxresdefault.jpg")
-        }
+    data = response.json()
+    print(f"Successfully retrieved video info: {data}")
+    
+    video_info = {
+        'title': data.get('title', 'Unknown Title'),
+        'description': data.get('author_name', 'No description available'),
+        'thumbnail': data.get('thumbnail_url', f"https://img.youtube.com/vi/{video_id}/maxresdefault.jpg")
+    }
+    video_info_cache.set(video_id, video_info)
+    return video_info
+
+
+def check_upstream_response(response):
+    """Raise for responses that mean the upstream is unhealthy, so its breaker counts them."""
+    if response.status_code in RETRYABLE_STATUS_CODES:
+        response.raise_for_status()
+    return response
+
+
+@oembed_breaker.protect_async
+async def request_oembed_async(video_id):
+    return check_upstream_response(await async_http_get(oembed_url_for(video_id)))
+
+
+def stale_video_info(video_id, error):
+    """Last known info for a video if the oEmbed API is down, else None."""
+    if not (isinstance(error, CircuitOpenError) or is_upstream_failure(error)):
+        return None
+    video_info = video_info_cache.get(video_id)
+    if video_info:
+        print(f"oEmbed unavailable, serving last known info for video ID: {video_id}")
+    return video_info
+
+
+async def fetch_video_info_async(video_id):
+    """Fetch video title, channel and thumbnail from the YouTube oEmbed API."""
+    try:
+        print(f"\nGetting video info for video ID: {video_id}")
+        print(f"Fetching oEmbed data from: {oembed_url_for(video_id)}")
+        with timed('oembed'):
+            response = await request_oembed_async(video_id)
+        return parse_video_info(video_id, response)
     except Exception as e:
-        print(f"Error in get_video_info: {str(e)}")
-        print("Traceback:")
-        print(traceback.format_exc())
+        video_info = stale_video_info(video_id, e)
+        if video_info:
+            return video_info
+        print(f"Error in fetch_video_info_async: {str(e)}")
         raise Exception(f"Error fetching video info: {str(e)}")
 
 
-@rate_limit_with_retry(max_retries=3, delay=5)
-def get_transcript(video_id):
-    """Get video transcript with timestamps in the video's original language."""
+# Transcript cache: a small in-process LRU in front of the SQLite transcripts table
+TRANSCRIPT_CACHE_SIZE = int(os.getenv('TRANSCRIPT_CACHE_SIZE', 128))
+TRANSCRIPT_CACHE_TTL = int(os.getenv('TRANSCRIPT_CACHE_TTL', 7 * 24 * 60 * 60))
+TRANSCRIPT_DB_MAX_ROWS = int(os.getenv('TRANSCRIPT_DB_MAX_ROWS', 10000))
+
+transcript_cache = LRUCache(max_size=TRANSCRIPT_CACHE_SIZE, ttl=TRANSCRIPT_CACHE_TTL)
+
+# Expired stored transcripts are served while a fresh copy is fetched on
+# this many background threads
+TRANSCRIPT_REFRESH_IN_BACKGROUND = os.getenv('TRANSCRIPT_REFRESH_IN_BACKGROUND', 'true').lower() == 'true'
+TRANSCRIPT_REFRESH_WORKERS = int(os.getenv('TRANSCRIPT_REFRESH_WORKERS', 2))
+
+transcript_refresh_pool = concurrent.futures.ThreadPoolExecutor(
+    max_workers=TRANSCRIPT_REFRESH_WORKERS, thread_name_prefix='transcript-refresh'
+)
+transcript_refreshes = set()
+transcript_refresh_lock = threading.Lock()
+
+transcript_provider = create_transcript_provider()
+
+
+async def get_transcript_async(video_id, language=None, force_refresh=False):
+    """Get video transcript from an async context.
+    
+    The transcript API is blocking, so cache misses run on the event loop's
+    blocking-call pool and still share the synchronous single-flight. With
+    force_refresh the transcript is fetched again, bypassing both cache tiers.
+    """
+    record = await get_transcript_record_async(video_id, language, force_refresh)
+    return record['transcript']
+
+
+async def get_transcript_record_async(video_id, language=None, force_refresh=False):
+    """Get a transcript along with the language and track (generated or manual) it came from.
+    
+    Looks in the in-process LRU first, then the on-disk store, and only then
+    fetches from YouTube.
+    """
+    if force_refresh:
+        print(f"Refetching transcript for video ID: {video_id}")
+        return await asyncio.to_thread(fetch_and_store_transcript, video_id, language)
+    cache_key = (video_id, language or '')
+    record = transcript_cache.get(cache_key)
+    record_cache('transcript_memory', record is not None)
+    if record:
+        print(f"Transcript cache hit (memory) for video ID: {video_id}")
+        return record
+    
+    # Concurrent misses for the same transcript share one load
+    return await asyncio.to_thread(transcript_flight.do, cache_key, load_transcript_record, video_id, language)
+
+
+def load_transcript_record(video_id, language=None):
+    """Load a transcript from the on-disk store, or fetch and store it, and fill the LRU."""
+    cache_key = (video_id, language or '')
     try:
-        print(f"\nGetting transcript for video ID: {video_id}")
-        
-        # Get list of available transcripts
-        print("Fetching available transcripts...")
-        transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
-        
-        # Try to find auto-generated transcript in video's language
-        print("Looking for auto-generated transcript...")
-        available_transcript = None
-        
-        for transcript_info in transcript_list:
-            if transcript_info.is_generated:
-                print(f"Found auto-generated transcript in {transcript_info.language_code}")
-                available_transcript = transcript_info
-                break
-        
-        if not available_transcript:
-            print("No auto-generated transcripts found, looking for manual transcripts...")
-            try:
-                available_transcript = transcript_list.find_manually_created_transcript()
-                print(f"Found manual transcript in {available_transcript.language_code}")
-            except Exception as e:
-                print(f"Error finding manual transcript: {str(e)}")
-        
-        if not available_transcript:
-            print("No transcripts available for this video")
-            raise Exception("No transcripts available for this video")
-        
-        # Get the transcript in original language
-        print(f"Fetching transcript in {available_transcript.language_code}...")
-        transcript = available_transcript.fetch()
-        print(f"Successfully retrieved {len(transcript)} transcript segments")
-        
-        return transcript
-        
+        with timed('transcript_db_read'):
+            record = get_stored_transcript(video_id, language, max_age=TRANSCRIPT_CACHE_TTL)
     except Exception as e:
-        print(f"Error in get_transcript: {str(e)}")
-        print("Traceback:")
-        print(traceback.format_exc())
-        raise Exception(f"Error fetching transcript: {str(e)}")
+        print(f"Error reading stored transcript: {str(e)}")
+        record = None
+    
+    record_cache('transcript_disk', record is not None)
+    if record:
+        print(f"Transcript cache hit (disk) for video ID: {video_id}")
+        transcript_cache.set(cache_key, record)
+        return record
+    
+    try:
+        expired = get_stored_transcript(video_id, language)
+    except Exception as e:
+        print(f"Error reading stored transcript: {str(e)}")
+        expired = None
+    
+    if expired and TRANSCRIPT_REFRESH_IN_BACKGROUND:
+        # Serve what we have rather than make the caller wait on a refetch
+        print(f"Stored transcript expired, refreshing in the background for video ID: {video_id}")
+        refresh_transcript_in_background(video_id, language)
+        transcript_cache.set(cache_key, expired)
+        return expired
+    
+    return fetch_and_store_transcript(video_id, language, fallback=expired)
+
+
+def fetch_and_store_transcript(video_id, language=None, fallback=None):
+    """Fetch a transcript from the providers, store it and fill the LRU.
+    
+    If the providers are failing and a fallback record is given, the
+    fallback is returned instead.
+    """
+    cache_key = (video_id, language or '')
+    try:
+        with timed('transcript_fetch'):
+            transcript, language_code, is_generated = fetch_transcript(video_id, language)
+    except Exception as e:
+        # While YouTube is failing, an expired transcript beats none at all
+        if not fallback or not (isinstance(e, CircuitOpenError) or is_upstream_failure(e)):
+            raise
+        print(f"Transcript API unavailable, serving stored transcript for video ID: {video_id}")
+        return fallback
+    
+    record = {
+        'video_id': video_id,
+        'language_code': language_code,
+        'is_generated': is_generated,
+        'transcript': Transcript.from_segments(transcript)
+    }
+    
+    try:
+        with timed('transcript_db_write'):
+            save_transcript(
+                video_id,
+                record['transcript'],
+                language_code=language_code,
+                is_generated=is_generated,
+                requested_language=language,
+                max_rows=TRANSCRIPT_DB_MAX_ROWS
+            )
+    except Exception as e:
+        print(f"Error storing transcript: {str(e)}")
+    
+    transcript_cache.set(cache_key, record)
+    return record
 
 
+def refresh_transcript_in_background(video_id, language=None):
+    """Refetch a stored transcript on the refresh pool, once per video at a time."""
+    cache_key = (video_id, language or '')
+    with transcript_refresh_lock:
+        if cache_key in transcript_refreshes:
+            return
+        transcript_refreshes.add(cache_key)
+    
+    def refresh():
+        try:
+            fetch_and_store_transcript(video_id, language)
+        except Exception as e:
+            print(f"Error refreshing transcript for video ID {video_id}: {str(e)}")
+        finally:
+            with transcript_refresh_lock:
+                transcript_refreshes.discard(cache_key)
+    
+    transcript_refresh_pool.submit(refresh)
 
 
+def invalidate_transcript(video_id):
+    """Drop a video's transcripts from both cache tiers."""
+    for key in [key for key in transcript_cache.keys() if key[0] == video_id]:
+        transcript_cache.delete(key)
+    return delete_stored_transcript(video_id)
 
 
+def fetch_transcript(video_id, language=None):
+    """Fetch a transcript from the configured providers.
+    
+    Returns (transcript, language_code, is_generated).
+    """
+    return transcript_provider.fetch(video_id, language)
+
 
 def combine_transcript_segments(transcript, window_size=5):
     """Combine consecutive transcript segments into larger chunks for better context."""
-    combined_segments = []
-    i = 0
-    while i < len(transcript):
-        # Get a window of segments
-        window = transcript[i:i + window_size]
-        
-        # Combine the text and timing information
-        combined_text = ' '.join(seg['text'] for seg in window)
-        start_time = window[0]['start']
-        end_time = window[-1]['start'] + window[-1]['duration']
-        
-        combined_segments.append({
-            'text': combined_text,
-            'start': start_time,
-            'duration': end_time - start_time
-        })
-        
-        # Move the window forward
-        i += window_size // 2  # Overlap windows to not miss context at boundaries
-    
-    return combined_segments
+    # Overlap windows to not miss context at boundaries
+    step = max(1, window_size // 2)
+    return Transcript.from_segments(transcript).windows(window_size, step)
 
 
-def analyze_with_llm(content, task, question=None):
-    """Analyze content using Gemini model."""
-    print(f"\nAnalyzing content with LLM for task: {task}")
-    
-    # Convert transcript segments into a single text with timestamps
-    if isinstance(content, str) and task == 'fact_check':
-        content = json.loads(content)
-    
-    formatted_text = ""
-    if task == 'fact_check':
-        # Process transcript in 2-minute chunks for better organization
-        chunk_size = 120  # 2 minutes in seconds
-        chunks = []
-        current_chunk = []
-        current_chunk_duration = 0
-        
-        # Split into chunks first
-        for entry in content:
-            if current_chunk_duration + entry['duration'] > chunk_size:
-                chunks.append(current_chunk)
-                current_chunk = [entry]
-                current_chunk_duration = entry['duration']
-            else:
-                current_chunk.append(entry)
-                current_chunk_duration += entry['duration']
-        
-        if current_chunk:
-            chunks.append(current_chunk)
-        
-        # Format all chunks into one text
-        for i, chunk in enumerate(chunks, 1):
-            chunk_start = format_timestamp(chunk[0]['start'])
-            chunk_end = format_timestamp(chunk[-1]['start'] + chunk[-1]['duration'])
-            formatted_text += f"\nCHUNK {i} [{chunk_start} - {chunk_end}]:\n"
-            
-            for entry in chunk:
-                timestamp = format_timestamp(entry['start'])
-                end_timestamp = format_timestamp(entry['start'] + entry['duration'])
-                formatted_text += f"[{timestamp}-{end_timestamp}] {entry['text']}\n"
-        
-        print(f"Split transcript into {len(chunks)} chunks")
-        print(formatted_text)
-    else:
-        if isinstance(content, list):
-            # Format transcript entries into readable text
-            formatted_text = ' '.join([entry['text'] for entry in content])
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.0-flash-exp')
+# Overridable so benchmarks can point the app at a local stand-in
+GEMINI_API_BASE = os.getenv('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com').rstrip('/')
+
+# LLM response cache: 'memory', 'sqlite' or 'none'
+LLM_CACHE_BACKEND = os.getenv('LLM_CACHE_BACKEND', 'sqlite')
+LLM_CACHE_SIZE = int(os.getenv('LLM_CACHE_SIZE', 1024))
+
+# Seconds to keep a cached response per task; questions are cached for less
+# time since they are more varied and cheaper to recompute.
+LLM_CACHE_TTLS = {
+    'fact_check': int(os.getenv('LLM_CACHE_TTL_FACT_CHECK', 7 * 24 * 60 * 60)),
+    'summarize': int(os.getenv('LLM_CACHE_TTL_SUMMARIZE', 7 * 24 * 60 * 60)),
+    'key_points': int(os.getenv('LLM_CACHE_TTL_KEY_POINTS', 7 * 24 * 60 * 60)),
+    'question': int(os.getenv('LLM_CACHE_TTL_QUESTION', 24 * 60 * 60))
+}
+
+
+# Tasks a user is waiting on interactively get a duplicate request if the
+# first hasn't answered within LLM_HEDGE_DELAY seconds (0 disables hedging)
+LLM_HEDGE_TASKS = [task.strip() for task in os.getenv('LLM_HEDGE_TASKS', 'question').split(',') if task.strip()]
+LLM_HEDGE_DELAY = float(os.getenv('LLM_HEDGE_DELAY', 5))
+
+
+def create_llm_cache(backend):
+    """Create the LLM response cache for the configured backend, or None if disabled."""
+    if backend == 'memory':
+        return ResponseCache(LRUCache(max_size=LLM_CACHE_SIZE), ttls=LLM_CACHE_TTLS)
+    if backend == 'sqlite':
+        return ResponseCache(SQLiteCache(table='llm_cache', max_rows=LLM_CACHE_SIZE * 10), ttls=LLM_CACHE_TTLS)
+    return None
+
+
+llm_cache = create_llm_cache(LLM_CACHE_BACKEND)
+llm_async_flight = AsyncSingleFlight()
+
+
+# Fact checks are run as one LLM call per group of chunks, several at a time
+FACT_CHECK_CHUNK_SECONDS = 120
+FACT_CHECK_CHUNKS_PER_CALL = int(os.getenv('FACT_CHECK_CHUNKS_PER_CALL', 2))
+FACT_CHECK_CONCURRENCY = int(os.getenv('FACT_CHECK_CONCURRENCY', 4))
+
+
+def group_chunks(transcript, bounds):
+    """Group consecutive chunks into the ones fact-checked by the same LLM call.
+
+    bounds are the chunks' (start, end) segment indexes. Returns lists of
+    indexes into bounds; each group holds up to FACT_CHECK_CHUNKS_PER_CALL
+    chunks and stays within the prompt token budget.
+    """
+    per_call = max(1, FACT_CHECK_CHUNKS_PER_CALL)
+    budget = LLM_PROMPT_TOKEN_BUDGET - prompt_overhead_tokens('fact_check')
+    groups = []
+    group_tokens = 0
+    for i, (start, end) in enumerate(bounds):
+        chunk_tokens = estimate_transcript_tokens(transcript[start:end])
+        if groups and len(groups[-1]) < per_call and group_tokens + chunk_tokens <= budget:
+            groups[-1].append(i)
+            group_tokens += chunk_tokens
         else:
-            formatted_text = content
-    
-    print("Sending to LLM for analysis...")
+            groups.append([i])
+            group_tokens = chunk_tokens
+    return groups
+
+
+def group_fact_check_chunks(content):
+    """Split a transcript into the parts that are fact-checked by separate LLM calls.
+
+    Groups are views over the transcript, not copies.
+    """
+    transcript = Transcript.from_segments(content)
+    bounds = transcript.chunk_bounds(FACT_CHECK_CHUNK_SECONDS)
+    return [transcript[bounds[group[0]][0]:bounds[group[-1]][1]] for group in group_chunks(transcript, bounds)]
+
 
+def parse_timestamp(timestamp):
+    """Convert an MM:SS (or HH:MM:SS) timestamp to seconds. Returns None if it can't be parsed."""
+    try:
+        seconds = 0
+        for part in str(timestamp).strip().split(':'):
+            seconds = seconds * 60 + float(part)
+        return seconds
+    except ValueError:
+        return None
+
+
+def merge_fact_check_results(results_list):
+    """Merge fact-check results from several calls, dropping duplicates and sorting by time."""
+    merged = {}
+    for results in results_list:
+        for result in (results or {}).get('results', []):
+            key = (
+                result.get('timestamp_range') or result.get('timestamp'),
+                ' '.join(str(result.get('claim', '')).lower().split())
+            )
+            if key not in merged:
+                merged[key] = result
+    
+    def sort_key(result):
+        seconds = parse_timestamp(result.get('timestamp', ''))
+        return float('inf') if seconds is None else seconds
     
-    prompts = {
-        'fact_check': """IMPORTANT: For every claim, you must choose one of these statuses:
+    return {'results': sorted(merged.values(), key=sort_key)}
+
+
+LLM_PROMPTS = {
+    'fact_check': """IMPORTANT: For every claim, you must choose one of these statuses:
 - TRUE: Only if you can verify with 100% certainty using reliable sources
 - FALSE: Only if you can prove it's incorrect using reliable sources
 - SKIP: If you have ANY doubt or can't verify with 100% certainty
@@ -287,7 +487,7 @@ CRITICAL RULES:
    - Unverifiable statistics
 5. Check ALL chunks for facts, don't stop after the first one
 6. Better to SKIP than to make a wrong TRUE/FALSE judgment""",
-        'summarize': """Analyze the following video transcript and provide a summary in JSON format. Include both a brief overview and detailed sections.
+    'summarize': """Analyze the following video transcript and provide a summary in JSON format. Include both a brief overview and detailed sections.
 
 Format your response as a JSON object with the following structure:
 {
@@ -309,7 +509,7 @@ Format your response as a JSON object with the following structure:
 }
 
 Here's the transcript:""",
-        'key_points': """Extract the main key points from this video transcript and format them as JSON. Include timestamps where available.
+    'key_points': """Extract the main key points from this video transcript and format them as JSON. Include timestamps where available.
 
 Format your response as a JSON object with the following structure:
 {
@@ -337,79 +537,447 @@ Format your response as a JSON object with the following structure:
 }
 
 Here's the transcript:""",
-        'question': "Based on this video transcript, please answer the following question:"
-    }
+    'question': "Based on this video transcript, please answer the following question:",
+    'chunk_notes': """You are reading one part of a longer video transcript. Write detailed notes on this part so that a later step can work from your notes instead of the transcript.
+
+Include:
+- The main topics, arguments and conclusions, in order
+- Specific claims, numbers, names and examples
+- The timestamp (MM:SS) of each important moment
+
+Write plain text, not JSON. Here's the transcript part:"""
+}
+
+
+def build_llm_prompt(content, task, question=None):
+    """Build the Gemini prompt for a task from transcript content."""
+    # Convert transcript segments into a single text with timestamps
+    if isinstance(content, str) and task == 'fact_check':
+        content = json.loads(content)
+    if isinstance(content, list):
+        content = Transcript.from_segments(content)
     
-    try:
-        # Prepare the request to Gemini API
-        api_key = os.getenv('GEMINI_API_KEY')
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-exp:generateContent?key={api_key}"
+    formatted_text = ""
+    if task == 'fact_check':
+        # Process transcript in 2-minute chunks for better organization
+        bounds = content.chunk_bounds(FACT_CHECK_CHUNK_SECONDS)
+        texts = content.texts
+        start_labels = format_timestamps(content.starts)
+        end_labels = format_timestamps(content.ends)
         
-        headers = {
-            'Content-Type': 'application/json'
-        }
+        # Format all chunks into one text
+        lines = []
+        for i, (start, end) in enumerate(bounds, 1):
+            lines.append(f"\nCHUNK {i} [{start_labels[start]} - {end_labels[end - 1]}]:")
+            lines.extend(
+                f"[{start_labels[j]}-{end_labels[j]}] {texts[j]}"
+                for j in range(start, end)
+            )
+        formatted_text = '\n'.join(lines) + '\n'
         
-        # Format the prompt based on task
-        if task == 'question':
-            prompt = f"{prompts[task]} {question}\n\n{formatted_text}"
+        print(f"Split transcript into {len(bounds)} chunks")
+        print(f"Formatted transcript: {formatted_text[:500]}...")  # Print first 500 chars
+    elif task == 'chunk_notes' and isinstance(content, Transcript):
+        # Keep timestamps so the notes can refer to them
+        formatted_text = '\n'.join(
+            f"[{label}] {text}" for label, text in zip(format_timestamps(content.starts), content.texts)
+        )
+    else:
+        if isinstance(content, Transcript):
+            # Format transcript entries into readable text
+            formatted_text = ' '.join(content.texts)
         else:
-            prompt = f"{prompts[task]}\n\n{formatted_text}"
-        
-        data = {
-            "contents": [{
-                "parts":[{
-                    "text": prompt
-                }]
-            }]
-        }
-        
-        print(f"\nSending request to LLM for task: {task}")
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()
+            formatted_text = content
+    
+    print("Sending to LLM for analysis...")
+    
+    # Format the prompt based on task
+    if task == 'question':
+        return f"{LLM_PROMPTS[task]} {question}\n\n{formatted_text}"
+    if task == 'chunk_notes' and question:
+        return f"{LLM_PROMPTS[task]}\n\nFocus on anything relevant to this question: {question}\n\n{formatted_text}"
+    return f"{LLM_PROMPTS[task]}\n\n{formatted_text}"
+
+
+async def analyze_with_llm_async(content, task, question=None, video_id=None, force_refresh=False):
+    """Analyze content using Gemini model without blocking a thread on the request.
+    
+    Responses are cached under the video_id they are for, if given. With
+    force_refresh, cached responses and known claims are not reused.
+    """
+    print(f"\nAnalyzing content with LLM for task: {task}")
+    
+    try:
+        if isinstance(content, str) and task == 'fact_check':
+            content = json.loads(content)
+        if isinstance(content, list):
+            content = Transcript.from_segments(content)
         
-        # Extract the response
-        result = response.json()
-        print(f"Raw API Response: {result}")
+        if task == 'fact_check':
+            groups = group_fact_check_chunks(content)
+            if len(groups) > 1:
+                return await fact_check_groups_async(groups, video_id, force_refresh)
+            return await fact_check_group_async(content, video_id, force_refresh)
+        elif needs_hierarchical_mode(content, task, question):
+            return await analyze_hierarchically_async(content, task, question, video_id, force_refresh)
         
-        if 'candidates' in result and len(result['candidates']) > 0:
-            candidate = result['candidates'][0]
-            
-            # Handle different response structures
-            if 'content' in candidate and 'parts' in candidate['content']:
-                response_text = candidate['content']['parts'][0]['text']
-            elif 'text' in candidate:
-                response_text = candidate['text']
-            else:
-                print(f"Unexpected response structure: {candidate}")
-                return None
-            
-            # Remove markdown code block markers if present
-            response_text = response_text.replace('```json\n', '').replace('\n```', '').strip()
-            print(f"Extracted response text: {response_text[:200]}...")  # Print first 200 chars
-            
-            # For fact-checking and structured responses, ensure we have valid JSON
-            if task in ['fact_check', 'summarize', 'key_points']:
-                try:
-                    json_data = json.loads(response_text)
-                    if task == 'fact_check' and 'results' not in json_data:
-                        json_data = {'results': []}
-                    return json_data
-                except json.JSONDecodeError as e:
-                    print(f"JSON decode error: {str(e)}")
-                    if task == 'fact_check':
-                        return {'results': []}
-                    return None
-            
-            return response_text
-        else:
-            print("No candidates found in response")
-            return None
+        return await cached_llm_request_async(content, task, question, video_id, force_refresh)
             
     except Exception as e:
         print(f"Error analyzing content with LLM: {str(e)}")
         print("Traceback:")
         print(traceback.format_exc())
         return None
+
+
+async def cached_llm_request_async(content, task, question=None, video_id=None, force_refresh=False):
+    """Build the prompt for a task and get Gemini's answer, from cache if it was asked before.
+    
+    The answer is cached under video_id, so it can be dropped with the
+    video's analysis. force_refresh asks Gemini again and replaces the cached answer.
+    """
+    prompt = build_llm_prompt(content, task, question)
+    
+    # Identical prompts get identical answers, so serve them from cache
+    cache_key = ResponseCache.make_key(GEMINI_MODEL, task, prompt, question)
+    if llm_cache and not force_refresh:
+        cached = await asyncio.to_thread(llm_cache.get, task, cache_key)
+        record_cache('llm', cached is not None)
+        if cached is not None:
+            print(f"LLM cache hit for task: {task}")
+            return cached
+    
+    if task in LLM_HEDGE_TASKS and LLM_HEDGE_DELAY > 0:
+        return await llm_async_flight.do(cache_key, request_llm_hedged_async, task, prompt, cache_key, video_id)
+    return await llm_async_flight.do(cache_key, request_llm_async, task, prompt, cache_key, video_id)
+
+
+def split_known_claims(content):
+    """Split off the passages of a transcript whose claims were already verified in other videos.
+    
+    Returns (fact-check results for those passages, the rest of the
+    transcript), with the results timed at where the passages are in this
+    transcript.
+    """
+    with timed('claim_lookup'):
+        passages = find_known_passages(content.texts)
+    if not passages:
+        record_cache('claim_segments', False, len(content))
+        return [], content
+    
+    start_labels = format_timestamps(content.starts)
+    end_labels = format_timestamps(content.ends)
+    keep = np.ones(len(content), dtype=bool)
+    results = []
+    for start, end, claims in passages:
+        keep[start:end] = False
+        for claim in claims:
+            results.append({
+                'timestamp': start_labels[start],
+                'timestamp_range': f"{start_labels[start]}-{end_labels[end - 1]}",
+                **claim
+            })
+    
+    remaining = int(keep.sum())
+    record_cache('claim_segments', True, len(content) - remaining)
+    record_cache('claim_segments', False, remaining)
+    print(f"Reusing {len(results)} known claims, leaving {len(content) - remaining} of {len(content)} segments out of the prompt")
+    texts = content.texts
+    return results, Transcript(
+        [text for text, kept in zip(texts, keep.tolist()) if kept], content.starts[keep], content.durations[keep]
+    )
+
+
+def remember_fact_checks(content, fact_check):
+    """Add the claims fact-checked in a transcript to the claim store, with the passages they came from."""
+    index = SegmentIntervalIndex(content)
+    texts = content.texts
+    with timed('claim_store'):
+        for result in (fact_check or {}).get('results', []):
+            passage = None
+            interval = claim_interval(result)
+            if interval is not None:
+                # Only segments wholly inside the claim's time span: later
+                # transcripts leave a matching passage out of the prompt, so a
+                # segment the claim shares with other statements must stay in
+                indexes = [
+                    i for i in index.overlapping(*interval)
+                    if content.starts[i] >= interval[0] and content.ends[i] <= interval[1]
+                ]
+                if indexes and max(indexes) - min(indexes) < CLAIM_PASSAGE_MAX_SEGMENTS:
+                    passage = ' '.join(texts[min(indexes):max(indexes) + 1])
+            remember_claim(result, passage)
+
+
+async def fact_check_with_known_claims_async(content, video_id=None, force_refresh=False):
+    """Fact-check a transcript, reusing the verdicts of claims already checked in other videos.
+    
+    With force_refresh every claim is checked again, and the new verdicts
+    are still added to the claim store.
+    """
+    known = []
+    if not force_refresh:
+        try:
+            known, content = await asyncio.to_thread(split_known_claims, content)
+        except Exception as e:
+            print(f"Error looking up known claims: {str(e)}")
+    if not content:
+        return {'results': known}
+    
+    result = await cached_llm_request_async(content, 'fact_check', video_id=video_id, force_refresh=force_refresh)
+    if result is None:
+        return None
+    try:
+        await asyncio.to_thread(remember_fact_checks, content, result)
+    except Exception as e:
+        print(f"Error storing fact-checked claims: {str(e)}")
+    return merge_fact_check_results([{'results': known}, result]) if known else result
+
+
+async def fact_check_group_async(content, video_id=None, force_refresh=False):
+    """Fact-check a transcript part in a single LLM call, without splitting it into groups again."""
+    if CLAIM_CACHE_ENABLED:
+        return await fact_check_with_known_claims_async(content, video_id, force_refresh)
+    return await cached_llm_request_async(content, 'fact_check', video_id=video_id, force_refresh=force_refresh)
+
+
+async def fact_check_groups_async(groups, video_id=None, force_refresh=False):
+    """Fact-check each group of chunks as its own LLM call and merge the results."""
+    print(f"Fact-checking {len(groups)} chunk groups in parallel")
+    semaphore = asyncio.Semaphore(FACT_CHECK_CONCURRENCY)
+    
+    async def check(group):
+        async with semaphore:
+            return await analyze_with_llm_async(group, 'fact_check', video_id=video_id, force_refresh=force_refresh)
+    
+    results = await asyncio.gather(*(check(group) for group in groups))
+    return merge_fact_check_results(results)
+
+
+def prompt_overhead_tokens(task, question=None):
+    """Estimated tokens in a task's prompt apart from the transcript itself."""
+    return estimate_tokens(LLM_PROMPTS[task]) + (estimate_tokens(question) if question else 0)
+
+
+def needs_hierarchical_mode(content, task, question=None):
+    """Whether a transcript is too long to send for a task in a single prompt."""
+    if not isinstance(content, Transcript) or task == 'chunk_notes':
+        return False
+    return not fits_budget(content, prompt_overhead_tokens(task, question))
+
+
+def split_for_notes(content, question=None):
+    """Split a transcript into parts that each fit in a chunk_notes prompt."""
+    budget = LLM_PROMPT_TOKEN_BUDGET - prompt_overhead_tokens('chunk_notes', question)
+    parts = pack_segments(content, max(1, budget))
+    print(f"Transcript exceeds the prompt budget, taking notes on {len(parts)} parts first")
+    return parts
+
+
+def notes_to_segments(parts, notes):
+    """Turn per-part notes into transcript-like segments so they can be analyzed in turn."""
+    segments = []
+    for part, note in zip(parts, notes):
+        if not note:
+            continue
+        start = part[0]['start']
+        end = part[-1]['start'] + part[-1]['duration']
+        segments.append({
+            'text': f"[{format_timestamp(start)}-{format_timestamp(end)}] {note}",
+            'start': start,
+            'duration': end - start
+        })
+    return segments
+
+
+async def analyze_hierarchically_async(content, task, question=None, video_id=None, force_refresh=False):
+    """Run a task on a transcript that doesn't fit one prompt.
+    
+    Notes are taken on each part in parallel, then the task runs on the
+    notes (recursing again if the notes are still too long).
+    """
+    parts = split_for_notes(content, question)
+    semaphore = asyncio.Semaphore(FACT_CHECK_CONCURRENCY)
+    
+    async def take_notes(part):
+        async with semaphore:
+            return await analyze_with_llm_async(part, 'chunk_notes', question, video_id, force_refresh)
+    
+    notes = await asyncio.gather(*(take_notes(part) for part in parts))
+    
+    segments = notes_to_segments(parts, notes)
+    if not segments or len(segments) >= len(content):
+        print("Notes did not shrink the transcript, giving up on hierarchical analysis")
+        return None
+    return await analyze_with_llm_async(segments, task, question, video_id, force_refresh)
+
+
+def build_gemini_request(prompt, history=None, system=None, cached_content=None):
+    """Build the Gemini generateContent URL, headers and body for a prompt.
+    
+    For a conversation, history holds the earlier (role, text) turns, sent
+    before the prompt, and system an instruction that applies to all of
+    them. cached_content names a Gemini context cache the request builds on.
+    """
+    api_key = os.getenv('GEMINI_API_KEY')
+    url = f"{GEMINI_API_BASE}/v1beta/models/{GEMINI_MODEL}:generateContent?key={api_key}"
+    
+    headers = {
+        'Content-Type': 'application/json'
+    }
+    
+    contents = [{"role": role, "parts": [{"text": text}]} for role, text in history or []]
+    contents.append({"role": "user", "parts": [{"text": prompt}]})
+    data = {
+        "contents": contents
+    }
+    if system:
+        data["systemInstruction"] = {"parts": [{"text": system}]}
+    if cached_content:
+        data["cachedContent"] = cached_content
+    
+    return url, headers, data
+
+
+def request_tokens(prompt, history=None, system=None):
+    """Estimated tokens Gemini will process for a request, apart from any context cache."""
+    tokens = estimate_tokens(prompt) + sum(estimate_tokens(text) for _, text in history or [])
+    return tokens + (estimate_tokens(system) if system else 0)
+
+
+@async_retry_with_backoff(limiter=gemini_limiter)
+@gemini_breaker.protect_async
+async def send_gemini_request_async(task, prompt, history=None, system=None, cached_content=None):
+    """POST a prompt to Gemini once its turn under the rate limit comes up.
+    
+    Waiting for the rate limit happens on the event loop, without holding a thread.
+    """
+    url, headers, data = build_gemini_request(prompt, history, system, cached_content)
+    estimated_tokens = request_tokens(prompt, history, system)
+    await gemini_limiter.acquire_async(estimated_tokens)
+    
+    print(f"\nSending request to LLM for task: {task}")
+    with timed('gemini_request'):
+        response = await async_http_post(url, headers=headers, json=data)
+    response.raise_for_status()
+    
+    result = response.json()
+    usage = result.get('usageMetadata', {})
+    gemini_limiter.on_success()
+    gemini_limiter.record_usage(estimated_tokens, usage.get('totalTokenCount'))
+    record_llm_usage(task, usage)
+    return result
+
+
+def gemini_cache_url(name=None):
+    """URL of Gemini's context caches, or of the one with the given name."""
+    api_key = os.getenv('GEMINI_API_KEY')
+    return f"{GEMINI_API_BASE}/v1beta/{name or 'cachedContents'}?key={api_key}"
+
+
+@async_retry_with_backoff(limiter=gemini_limiter)
+@gemini_breaker.protect_async
+async def create_gemini_cache_async(system, ttl):
+    """Store a system instruction in a Gemini context cache for ttl seconds. Returns the cache's name.
+    
+    Requests that name the cache are billed for its tokens at the reduced
+    cached rate instead of sending them again.
+    """
+    data = {
+        "model": f"models/{GEMINI_MODEL}",
+        "systemInstruction": {"parts": [{"text": system}]},
+        "ttl": f"{int(ttl)}s"
+    }
+    await gemini_limiter.acquire_async(estimate_tokens(system))
+    with timed('gemini_cache_create'):
+        response = await async_http_post(gemini_cache_url(), headers={'Content-Type': 'application/json'}, json=data)
+    response.raise_for_status()
+    gemini_limiter.on_success()
+    return response.json()['name']
+
+
+@async_retry_with_backoff(limiter=gemini_limiter)
+@gemini_breaker.protect_async
+async def extend_gemini_cache_async(name, ttl):
+    """Keep a Gemini context cache for another ttl seconds."""
+    response = await async_http_request(
+        'PATCH', gemini_cache_url(name) + '&updateMask=ttl',
+        headers={'Content-Type': 'application/json'}, json={"ttl": f"{int(ttl)}s"}
+    )
+    response.raise_for_status()
+
+
+async def delete_gemini_cache_async(name):
+    """Delete a Gemini context cache. Failures are only logged, since caches expire on their own."""
+    try:
+        response = await async_http_request('DELETE', gemini_cache_url(name))
+        response.raise_for_status()
+    except Exception as e:
+        print(f"Error deleting Gemini context cache {name}: {str(e)}")
+
+
+async def request_llm_async(task, prompt, cache_key=None, video_id=None):
+    """Send a prompt to Gemini over the async client and parse the response."""
+    result = await send_gemini_request_async(task, prompt)
+    
+    parsed = parse_llm_response(task, result)
+    if parsed is not None and llm_cache and cache_key:
+        await asyncio.to_thread(llm_cache.set, task, cache_key, parsed, video_id)
+    return parsed
+
+
+async def request_llm_hedged_async(task, prompt, cache_key=None, video_id=None):
+    """Send a prompt to Gemini, sending a duplicate if the first is slow to answer.
+    
+    Hedging is skipped while Gemini's breaker isn't closed, so a struggling
+    upstream doesn't get twice the load.
+    """
+    if not gemini_breaker.is_closed:
+        return await request_llm_async(task, prompt, cache_key, video_id)
+    return await hedged(lambda: request_llm_async(task, prompt, cache_key, video_id), LLM_HEDGE_DELAY)
+
+
+def parse_llm_response(task, result):
+    """Extract the answer from a Gemini response.
+    
+    Returns None if the response has no usable answer, such as fact checks
+    that aren't valid JSON, so failures are never cached or stored as results.
+    """
+    print(f"Raw API Response: {result}")
+    
+    if 'candidates' in result and len(result['candidates']) > 0:
+        candidate = result['candidates'][0]
+        
+        # Handle different response structures
+        if 'content' in candidate and 'parts' in candidate['content']:
+            response_text = candidate['content']['parts'][0]['text']
+        elif 'text' in candidate:
+            response_text = candidate['text']
+        else:
+            print(f"Unexpected response structure: {candidate}")
+            return None
+        
+        # Remove markdown code block markers if present
+        response_text = response_text.replace('```json\n', '').replace('\n```', '').strip()
+        print(f"Extracted response text: {response_text[:200]}...")  # Print first 200 chars
+        
+        # For fact-checking and structured responses, ensure we have valid JSON
+        if task in ['fact_check', 'summarize', 'key_points']:
+            try:
+                json_data = json.loads(response_text)
+                if task == 'fact_check' and 'results' not in json_data:
+                    json_data = {'results': []}
+                return json_data
+            except json.JSONDecodeError as e:
+                print(f"JSON decode error: {str(e)}")
+                return None
+        
+        return response_text
+    else:
+        print("No candidates found in response")
+        return None
+
+
 def format_timestamp(seconds):
     """Convert seconds to MM:SS format."""
     
@@ -419,51 +987,78 @@ def format_timestamp(seconds):
 
     return timestamp
 
+def claim_interval(result):
+    """Parse the time span (start, end) in seconds that a fact-check result covers.
+    
+    Timestamps only have one-second resolution, so a claim runs to the end of
+    its last second. Returns None if the result has no usable timestamp.
+    """
+    start = end = None
+    timestamp_range = result.get('timestamp_range')
+    if timestamp_range and '-' in str(timestamp_range):
+        range_start, _, range_end = str(timestamp_range).partition('-')
+        start, end = parse_timestamp(range_start), parse_timestamp(range_end)
+    if start is None:
+        start = parse_timestamp(result.get('timestamp', ''))
+        end = start
+    if start is None:
+        return None
+    if end is None or end < start:
+        end = start
+    return start, end + 1
+
+
+class SegmentIntervalIndex:
+    """Sorted index over transcript segment time spans for overlap queries."""
+    
+    def __init__(self, transcript):
+        self.order = np.argsort(transcript.starts, kind='stable')
+        self.starts = transcript.starts[self.order]
+        self.ends = transcript.ends[self.order]
+        # Segments can overlap, so search on the running maximum of end times,
+        # which unlike the ends themselves is always sorted
+        self.max_ends = np.maximum.accumulate(self.ends) if len(self.ends) else self.ends
+    
+    def overlapping(self, start, end):
+        """Indexes (into the original transcript) of segments overlapping [start, end)."""
+        low = np.searchsorted(self.max_ends, start, side='right')
+        high = np.searchsorted(self.starts, end, side='left')
+        candidates = np.arange(low, high)
+        return self.order[candidates[self.ends[candidates] > start]].tolist()
+
+
 def process_transcript_with_fact_check(transcript, fact_check_results):
-    """Process transcript entries with fact-check results."""
+    """Process transcript entries with fact-check results.
+    
+    Each claim is attached to every segment its time range overlaps. A segment
+    overlapped by several claims lists them all under 'fact_checks', and the
+    first one is also its 'fact_check'. The annotated transcript shares the
+    original's columns.
+    """
+    transcript = Transcript.from_segments(transcript)
     if not fact_check_results:
         return transcript
-        
-    # Create a map of timestamps to fact-check results
-    fact_check_map = {}
+    
+    index = SegmentIntervalIndex(transcript)
+    segment_fact_checks = {}
     for result in fact_check_results.get('results', []):
-        # Store by both single timestamp and range
-        timestamp = result['timestamp']
-        timestamp_range = result['timestamp_range']
-        fact_check_map[timestamp] = result
-        fact_check_map[timestamp_range] = result
-    
-    # Process each transcript entry
-    annotated_transcript = []
-    for entry in transcript:
-        timestamp = format_timestamp(entry['start'])
-        end_timestamp = format_timestamp(entry['start'] + entry['duration'])
-        timestamp_range = f"{timestamp}-{end_timestamp}"
-        
-        # Try to find fact check by either single timestamp or range
-        fact_check = fact_check_map.get(timestamp) or fact_check_map.get(timestamp_range)
-        
-        annotated_entry = {
-            'text': entry['text'],
-            'timestamp': timestamp,
-            'timestamp_range': timestamp_range,
-            'start': entry['start'],
-            'duration': entry['duration'],
-            'fact_check': None
+        interval = claim_interval(result)
+        if interval is None:
+            continue
+        fact_check = {
+            'claim': result.get('claim'),
+            'status': result.get('status'),
+            'explanation': result.get('explanation'),
+            'references': result.get('references'),
+            'timestamp': result.get('timestamp'),
+            'timestamp_range': result.get('timestamp_range')
         }
-        
-        if fact_check:
-            annotated_entry['fact_check'] = {
-                'claim': fact_check['claim'],
-                'status': fact_check['status'],
-                'explanation': fact_check['explanation'],
-                'references': fact_check['references'],
-                'timestamp': fact_check['timestamp'],
-                'timestamp_range': fact_check['timestamp_range']
-            }
-        
-        annotated_transcript.append(annotated_entry)
+        for i in index.overlapping(*interval):
+            segment_fact_checks.setdefault(i, []).append((interval[0], fact_check))
     
-    return annotated_transcript        
+    return transcript.with_fact_checks({
+        i: [fact_check for _, fact_check in sorted(checks, key=lambda item: item[0])]
+        for i, checks in segment_fact_checks.items()
+    })        
 
 